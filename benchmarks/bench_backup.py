@@ -0,0 +1,100 @@
+"""Benchmark: online backup throughput and writer latency while a backup runs.
+
+Usage: python benchmarks/bench_backup.py [--size-mb 2048] [--pages 256 1024 -1] [--sleep 0.005] [--idle]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from dollmart import BACKUP_STEP_SLEEP, DatabaseBackup, connect_db, create_database
+
+
+def populate(size_mb):
+    """Grow dollmart.db with order history until it reaches size_mb"""
+    rng = random.Random(7)
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO categories (name) VALUES ('General')")
+    cursor.executemany("INSERT INTO products (name, price, category_id, quantity) VALUES (?, ?, 1, 1000000)",
+                       [(f'Product {i}', rng.uniform(1, 100)) for i in range(1000)])
+    cursor.executemany("INSERT INTO users (username, password, role, customer_type, visit_count) "
+                       "VALUES (?, 'x', 'customer', 'individual', 0)", [(f'user{i}',) for i in range(10000)])
+    conn.commit()
+    order_id = 0
+    date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    while os.path.getsize('dollmart.db') < size_mb * 1e6:
+        orders = []
+        items = []
+        for _ in range(50000):
+            order_id += 1
+            orders.append((order_id, f'user{rng.randrange(10000)}', rng.uniform(5, 500), date, '000000'))
+            for _ in range(3):
+                items.append((order_id, rng.randint(1, 1000), rng.randint(1, 5), rng.uniform(1, 100)))
+        cursor.executemany("INSERT INTO orders (id, username, total_amount, order_date, otp, status) "
+                           "VALUES (?, ?, ?, ?, ?, 'delivered')", orders)
+        cursor.executemany("INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
+                           items)
+        conn.commit()
+    conn.close()
+
+
+def writer(stop, latencies):
+    """Simulate checkout writes, recording how long each commit waits"""
+    conn = connect_db()
+    while not stop.is_set():
+        start = time.perf_counter()
+        conn.execute("UPDATE users SET visit_count = visit_count + 1 WHERE username = 'user1'")
+        conn.commit()
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.001)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=2048)
+    parser.add_argument('--pages', type=int, nargs='+', default=[256, 1024, -1])
+    parser.add_argument('--sleep', type=float, default=BACKUP_STEP_SLEEP, help='pause after each step, in seconds')
+    parser.add_argument('--idle', action='store_true', help='no concurrent writer, so paged copies never restart')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    create_database()
+    start = time.perf_counter()
+    populate(args.size_mb)
+    print(f"Built {os.path.getsize('dollmart.db') / 1e6:.0f} MB database in {time.perf_counter() - start:.1f}s")
+
+    print(f"{'pages/step':>10}{'MB/s':>10}{'seconds':>10}{'restarts':>10}{'writes':>10}"
+          f"{'p99 write ms':>14}{'max write ms':>14}")
+    for pages in args.pages:
+        stop = threading.Event()
+        latencies = []
+        thread = threading.Thread(target=writer, args=(stop, latencies))
+        if not args.idle:
+            thread.start()
+        stats = DatabaseBackup.backup('backups', pages=pages, sleep=args.sleep)
+        stop.set()
+        if not args.idle:
+            thread.join()
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0
+        worst = latencies[-1] * 1000 if latencies else 0.0
+        print(f"{pages:>10}{stats['mb_per_second']:>10.1f}{stats['seconds']:>10.2f}{stats['restarts']:>10}"
+              f"{len(latencies):>10}"
+              f"{p99:>14.1f}{worst:>14.1f}")
+        shutil.rmtree('backups')
+
+    start = time.perf_counter()
+    problems = DatabaseBackup.verify('dollmart.db')
+    print(f"integrity_check: {'ok' if not problems else problems[0]} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark: cart writes/second from concurrent sessions, one commit per write vs group commit.
+
+Usage: python benchmarks/bench_cart_writes.py [--sessions 16] [--writes 200] [--windows 1 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from dollmart import Cart, connect_db, create_database
+
+
+def setup(sessions):
+    if os.path.exists('dollmart.db'):
+        os.remove('dollmart.db')
+    create_database()
+    conn = connect_db()
+    conn.execute("INSERT INTO categories (name) VALUES ('General')")
+    conn.executemany("INSERT INTO products (name, price, category_id, quantity) VALUES (?, 1.0, 1, 1000000)",
+                     [(f'Product {i}',) for i in range(100)])
+    conn.executemany("INSERT INTO users (username, password, role, customer_type, visit_count) "
+                     "VALUES (?, 'x', 'customer', 'individual', 0)", [(f'user{i}',) for i in range(sessions)])
+    conn.commit()
+    conn.close()
+
+
+def run_sessions(sessions, writes):
+    def session(index):
+        for i in range(writes):
+            if i % 4 == 3:
+                Cart.remove_item(f'user{index}', i % 100 + 1, 1)
+            else:
+                Cart.add_item(f'user{index}', i % 100 + 1, 1)
+
+    threads = [threading.Thread(target=session, args=(index,)) for index in range(sessions)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=200)
+    parser.add_argument('--windows', type=float, nargs='+', default=[1, 5])
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    total = args.sessions * args.writes
+    print(f"{'mode':<22}{'seconds':>10}{'writes/s':>12}{'commits':>10}{'fsyncs saved':>14}")
+    setup(args.sessions)
+    seconds = run_sessions(args.sessions, args.writes)
+    print(f"{'commit per write':<22}{seconds:>10.2f}{total / seconds:>12.0f}{total:>10}{0:>14}")
+    for window in args.windows:
+        setup(args.sessions)
+        Cart.enable_write_buffer(window)
+        seconds = run_sessions(args.sessions, args.writes)
+        stats = Cart.disable_write_buffer()
+        label = f"group commit {window:g} ms"
+        print(f"{label:<22}{seconds:>10.2f}{total / seconds:>12.0f}{stats['commits']:>10}{stats['fsyncs_saved']:>14}")
+
+
+if __name__ == '__main__':
+    main()
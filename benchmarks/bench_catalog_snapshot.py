@@ -0,0 +1,88 @@
+"""Benchmark: NumPy catalog snapshot vs SQL for filtered top-k product queries.
+
+Usage: python benchmarks/bench_catalog_snapshot.py [--rows 1000000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from dollmart import CatalogSnapshot, connect_db, create_database
+
+CATEGORIES = ['Electronics', 'Toys', 'Books', 'Garden', 'Kitchen', 'Sports', 'Beauty', 'Office']
+
+SQL_QUERY = """
+    SELECT p.id
+    FROM products p
+    LEFT JOIN (SELECT product_id, SUM(quantity) AS reserved FROM cart GROUP BY product_id) r
+        ON r.product_id = p.id
+    WHERE p.quantity - COALESCE(r.reserved, 0) > 0
+        AND p.category_id = (SELECT id FROM categories WHERE name = ?) AND p.price < ?
+    ORDER BY p.price, p.id
+    LIMIT 50
+"""
+
+
+def populate(cursor, rows):
+    rng = random.Random(42)
+    cursor.executemany("INSERT INTO categories (name) VALUES (?)", [(name,) for name in CATEGORIES])
+    batch = []
+    for i in range(rows):
+        batch.append((f'Product {i}', round(rng.uniform(1, 500), 2), rng.randint(1, len(CATEGORIES)),
+                      rng.randint(0, 100)))
+        if len(batch) == 50000:
+            cursor.executemany("INSERT INTO products (name, price, category_id, quantity) VALUES (?, ?, ?, ?)",
+                               batch)
+            batch = []
+    if batch:
+        cursor.executemany("INSERT INTO products (name, price, category_id, quantity) VALUES (?, ?, ?, ?)", batch)
+    cursor.executemany("INSERT INTO cart (username, product_id, quantity) VALUES (?, ?, ?)",
+                       [(f'user{i}', rng.randint(1, rows), 1) for i in range(1000)])
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    create_database()
+    conn = connect_db()
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    populate(cursor, args.rows)
+    conn.commit()
+    print(f"Populated {args.rows} products in {time.perf_counter() - start:.2f}s")
+
+    build_time, snapshot = timed(lambda: CatalogSnapshot.build(cursor), 1)
+    print(f"Snapshot build: {build_time * 1000:.1f} ms")
+
+    sql_time, sql_ids = timed(lambda: [row[0] for row in cursor.execute(SQL_QUERY, ('Toys', 100)).fetchall()],
+                              args.repeat)
+    np_time, np_ids = timed(lambda: snapshot.query(in_stock=True, category='Toys', max_price=99.999999,
+                                                   sort_by='price', limit=50), args.repeat)
+    assert sql_ids == np_ids, "snapshot and SQL results differ"
+    print(f"SQL query:      {sql_time * 1000:8.2f} ms")
+    print(f"Snapshot query: {np_time * 1000:8.2f} ms  ({sql_time / np_time:.1f}x faster)")
+
+    cursor.execute("UPDATE products SET price = price * 0.9 WHERE id % 1000 = 0")
+    conn.commit()
+    refresh_time, _ = timed(lambda: snapshot.refresh(cursor), 1)
+    print(f"Incremental refresh after {args.rows // 1000} updates: {refresh_time * 1000:.1f} ms")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Benchmark: orders/second for inline checkout vs queued checkout with group-committing workers.
+
+Usage: python benchmarks/bench_checkout_queue.py [--orders 2000] [--workers 1 2 4] [--batch-size 50]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from dollmart import Cart, CheckoutQueue, connect_db, create_database
+
+
+def fresh_store(orders):
+    """New database with one customer per order, each with a three-item cart"""
+    for name in os.listdir('.'):
+        if name.startswith('dollmart.db'):
+            os.remove(name)
+    create_database()
+    rng = random.Random(7)
+    conn = connect_db()
+    conn.execute("INSERT INTO categories (name) VALUES ('General')")
+    conn.executemany("INSERT INTO products (name, price, category_id, quantity) VALUES (?, ?, 1, 1000000)",
+                     [(f'Product {i}', rng.uniform(1, 100)) for i in range(200)])
+    conn.executemany("INSERT INTO users (username, password, role, customer_type, visit_count) "
+                     "VALUES (?, 'x', 'customer', 'individual', 0)", [(f'user{i}',) for i in range(orders)])
+    conn.executemany("INSERT INTO cart (username, product_id, quantity) VALUES (?, ?, ?)",
+                     [(f'user{i}', product_id, rng.randint(1, 3))
+                      for i in range(orders) for product_id in rng.sample(range(1, 201), 3)])
+    conn.commit()
+    conn.close()
+
+
+def inline(orders):
+    start = time.perf_counter()
+    for i in range(orders):
+        Cart.submit_order(f'user{i}')
+    return time.perf_counter() - start, 0.0
+
+
+def queued(orders, workers, batch_size):
+    start = time.perf_counter()
+    for i in range(orders):
+        CheckoutQueue.submit(f'user{i}')
+    submitted = time.perf_counter() - start
+    for worker in CheckoutQueue.start_workers(workers, batch_size, exit_when_idle=True):
+        worker.join()
+    return time.perf_counter() - start, submitted
+
+
+def placed():
+    conn = connect_db()
+    count = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    conn.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    print(f"{'path':<28}{'seconds':>10}{'orders/s':>12}{'submit ms/order':>17}{'checkout orders/s':>19}")
+    runs = [('inline', lambda: inline(args.orders))]
+    runs += [(f'queue, {n} worker(s), batch {args.batch_size}',
+              lambda n=n: queued(args.orders, n, args.batch_size)) for n in args.workers]
+    for label, run in runs:
+        fresh_store(args.orders)
+        seconds, submitted = run()
+        assert placed() == args.orders
+        print(f"{label:<28}{seconds:>10.2f}{args.orders / seconds:>12.0f}{submitted / args.orders * 1000:>17.2f}"
+              f"{args.orders / (seconds - submitted):>19.0f}")
+    os.chdir('/')
+    shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Benchmark: hot-table size and manager query latency before and after order archival.
+
+Usage: python benchmarks/bench_order_archive.py [--orders 200000] [--days 30]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from dollmart import Order, connect_db, create_database
+
+PENDING_SQL = "SELECT id, username, order_date, total_amount FROM orders WHERE status = 'placed' ORDER BY order_date ASC"
+
+
+def populate(cursor, orders):
+    rng = random.Random(7)
+    now = datetime.now()
+    cursor.execute("INSERT INTO categories (name) VALUES ('General')")
+    cursor.executemany("INSERT INTO products (name, price, category_id, quantity) VALUES (?, ?, 1, 1000000)",
+                       [(f'Product {i}', rng.uniform(1, 100)) for i in range(200)])
+    cursor.executemany("INSERT INTO users (username, password, role, customer_type, visit_count) "
+                       "VALUES (?, 'x', 'customer', 'individual', 0)", [(f'user{i}',) for i in range(1000)])
+    order_rows = []
+    item_rows = []
+    for order_id in range(1, orders + 1):
+        recent = rng.random() < 0.1
+        age = timedelta(days=rng.uniform(0, 7) if recent else rng.uniform(31, 730))
+        status = 'placed' if recent and rng.random() < 0.5 else 'delivered'
+        order_rows.append((order_id, f'user{rng.randrange(1000)}', rng.uniform(5, 500),
+                           (now - age).strftime("%Y-%m-%d %H:%M:%S"), '000000', status))
+        for _ in range(rng.randint(1, 3)):
+            item_rows.append((order_id, rng.randint(1, 200), rng.randint(1, 5), rng.uniform(1, 100)))
+    cursor.executemany("INSERT INTO orders (id, username, total_amount, order_date, otp, status) "
+                       "VALUES (?, ?, ?, ?, ?, ?)", order_rows)
+    cursor.executemany("INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
+                       item_rows)
+
+
+def timed(fn, repeat=3):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def measure(cursor):
+    def quiet(fn):
+        with contextlib.redirect_stdout(io.StringIO()), patch('builtins.input', return_value='n'):
+            fn()
+    cursor.execute("SELECT COUNT(*) FROM orders")
+    orders = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM order_items")
+    items = cursor.fetchone()[0]
+    return {
+        'hot orders': orders,
+        'hot order_items': items,
+        'view_all_orders ms': timed(lambda: quiet(Order.view_all_orders)),
+        'pending scan ms': timed(lambda: cursor.execute(PENDING_SQL).fetchall()),
+        'view_all_customers ms': timed(lambda: quiet(Order.view_all_customers)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    create_database()
+    conn = connect_db()
+    cursor = conn.cursor()
+    populate(cursor, args.orders)
+    conn.commit()
+
+    before = measure(cursor)
+    start = time.perf_counter()
+    archived = Order.archive_orders(args.days)
+    archive_time = time.perf_counter() - start
+    after = measure(cursor)
+    conn.close()
+
+    print(f"Archived {archived} orders in {archive_time:.2f}s")
+    print(f"{'metric':<24}{'before':>12}{'after':>12}")
+    for key in before:
+        print(f"{key:<24}{before[key]:>12.1f}{after[key]:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
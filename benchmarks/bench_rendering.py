@@ -0,0 +1,94 @@
+"""Benchmark: rows/second for large listings, per-row print() vs TableWriter.
+
+Output goes through line-buffered streams, which flush like a terminal does, to os.devnull
+and to a pseudo-terminal drained by a background thread.
+
+Usage: python benchmarks/bench_rendering.py [--rows 100000]
+"""
+import argparse
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import dollmart
+from dollmart import Product, TableWriter, connect_db, create_database
+
+COLUMNS = [('ID', '{}', '>'), ('Name', '{}'), ('Price', '${:.2f}', '>'), ('Category', '{}'),
+           ('Total Quantity', '{}', '>'), ('Available Quantity', '{}', '>')]
+
+
+def print_rows(rows):
+    """The previous rendering: one print() of an f-string per row"""
+    print("ID | Name | Price | Category | Total Quantity | Available Quantity")
+    print("-" * 80)
+    for product_id, name, price, category, quantity, available in rows:
+        print(f"{product_id} | {name} | ${price:.2f} | {category} | {quantity} | {available}")
+    print("-" * 80)
+
+
+def table_rows(rows):
+    writer = TableWriter(COLUMNS)
+    writer.write_rows(rows)
+    writer.finish()
+
+
+def open_pty():
+    """Writable end of a pseudo-terminal whose output is read and discarded"""
+    master, slave = os.openpty()
+
+    def drain():
+        try:
+            while os.read(master, 1 << 16):
+                pass
+        except OSError:
+            pass
+
+    threading.Thread(target=drain, daemon=True).start()
+    return slave
+
+
+def timed(sink, fn, *args):
+    with open(sink, 'w', buffering=1, closefd=sink == os.devnull) as out, contextlib.redirect_stdout(out):
+        start = time.perf_counter()
+        fn(*args)
+        out.flush()
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    dollmart.USE_PAGER = False
+    rng = random.Random(7)
+    rows = [(i, f'Product {i}', rng.uniform(1, 500), f'Category {i % 50}', rng.randint(0, 100), rng.randint(0, 100))
+            for i in range(1, args.rows + 1)]
+
+    os.chdir(tempfile.mkdtemp())
+    create_database()
+    conn = connect_db()
+    conn.executemany("INSERT INTO categories (name) VALUES (?)", [(f'Category {i}',) for i in range(50)])
+    conn.executemany("INSERT INTO products (name, price, category_id, quantity) VALUES (?, ?, ?, ?)",
+                     [(name, price, product_id % 50 + 1, quantity) for product_id, name, price, _, quantity, _ in rows])
+    conn.commit()
+    conn.close()
+    timed(os.devnull, Product.view_all_products)
+
+    pty = open_pty()
+    print(f"{'renderer':<20}{'sink':<10}{'seconds':>10}{'rows/s':>14}")
+    for sink_name, sink in (('devnull', os.devnull), ('pty', pty)):
+        for label, fn, fn_args in (('print() per row', print_rows, (rows,)),
+                                   ('TableWriter', table_rows, (rows,)),
+                                   ('view_all_products', Product.view_all_products, ())):
+            seconds = timed(sink, fn, *fn_args)
+            print(f"{label:<20}{sink_name:<10}{seconds:>10.3f}{args.rows / seconds:>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
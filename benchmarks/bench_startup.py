@@ -0,0 +1,60 @@
+"""Benchmark: process startup time (import + create_database) for fresh and current schemas.
+
+Usage: python benchmarks/bench_startup.py [--runs 20]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+STARTUP = f"import sys; sys.path.insert(0, {SRC!r}); import dollmart; dollmart.create_database()"
+IMPORT_ONLY = f"import sys; sys.path.insert(0, {SRC!r}); import dollmart"
+# Measure with cached bytecode, as an installed copy would run
+ENV = {key: value for key, value in os.environ.items() if key != 'PYTHONDONTWRITEBYTECODE'}
+
+
+def run(code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], check=True, env=ENV)
+    return (time.perf_counter() - start) * 1000
+
+
+def median_ms(code, runs, before=None):
+    samples = []
+    for _ in range(runs):
+        if before:
+            before()
+        samples.append(run(code))
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    run(IMPORT_ONLY)
+
+    def fresh():
+        if os.path.exists('dollmart.db'):
+            os.remove('dollmart.db')
+
+    results = {
+        'python -c pass': median_ms('pass', args.runs),
+        'import dollmart': median_ms(IMPORT_ONLY, args.runs),
+        'startup, new database': median_ms(STARTUP, args.runs, before=fresh),
+    }
+    run(STARTUP)
+    results['startup, current schema'] = median_ms(STARTUP, args.runs)
+
+    for label, ms in results.items():
+        print(f"{label:<26}{ms:>8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Benchmark: cart-and-checkout sessions/second on the SQLite file backend vs the in-memory backend.
+
+Usage: python benchmarks/bench_storage.py [--sessions 2000]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import dollmart
+from dollmart import Cart, MemoryStorage, SQLiteStorage, connect_db, create_database
+
+
+def fresh_store(storage, sessions):
+    """Install storage with a 200-product catalog and one customer per session"""
+    dollmart.STORAGE = storage
+    create_database()
+    rng = random.Random(7)
+    conn = connect_db()
+    conn.execute("INSERT INTO categories (name) VALUES ('General')")
+    conn.executemany("INSERT INTO products (name, price, category_id, quantity) VALUES (?, ?, 1, 1000000)",
+                     [(f'Product {i}', rng.uniform(1, 100)) for i in range(200)])
+    conn.executemany("INSERT INTO users (username, password, role, customer_type, visit_count) "
+                     "VALUES (?, 'x', 'customer', 'individual', 0)", [(f'user{i}',) for i in range(sessions)])
+    conn.commit()
+    conn.close()
+
+
+def run(sessions):
+    """Each session adds three products to its cart and checks out"""
+    rng = random.Random(11)
+    start = time.perf_counter()
+    for i in range(sessions):
+        for product_id in rng.sample(range(1, 201), 3):
+            Cart.add_item(f'user{i}', product_id, rng.randint(1, 3))
+        Cart.submit_order(f'user{i}')
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    print(f"{'backend':<10}{'seconds':>10}{'sessions/s':>12}")
+    for label, storage in (('sqlite', SQLiteStorage()), ('memory', MemoryStorage())):
+        fresh_store(storage, args.sessions)
+        seconds = run(args.sessions)
+        print(f"{label:<10}{seconds:>10.2f}{args.sessions / seconds:>12.0f}")
+        storage.close()
+    os.chdir('/')
+    shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
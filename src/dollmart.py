@@ -1,12 +1,238 @@
 import hashlib
+import io
+import json
+import os
 import sqlite3
+import queue
 import random
-from datetime import datetime
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from itertools import islice
+from datetime import datetime, timedelta
+
+# NumPy is optional and slow to import; load_numpy() imports it on first use
+np = None
+_numpy_checked = False
+
+# Bump whenever create_database() changes; stored in PRAGMA user_version
+SCHEMA_VERSION = 11
+
+# Number of product change-log rows kept for cache/consumer catch-up
+CHANGE_LOG_RETENTION = 10000
+
+# Orders moved to the archive tables per transaction
+ARCHIVE_BATCH_SIZE = 500
+
+# Allowed order status changes; delivery can be confirmed at any pre-delivery stage
+ORDER_TRANSITIONS = {
+    'placed': ('packed', 'shipped', 'delivered', 'cancelled'),
+    'packed': ('shipped', 'delivered', 'cancelled'),
+    'shipped': ('delivered',),
+    'delivered': ('returned',),
+    'cancelled': (),
+    'returned': (),
+}
+PENDING_STATUSES = ('placed', 'packed', 'shipped')
+STOCK_RESTORING_STATUSES = ('cancelled', 'returned')
+
+# Reporting snapshot file and how old it may get before manager reports refresh it
+REPORT_DB_PATH = 'dollmart_report.db'
+REPORT_MAX_AGE_SECONDS = 300
+
+# Online backups: directory, pages copied per step and pause between steps so writers get the lock
+BACKUP_DIR = 'backups'
+BACKUP_PAGES_PER_STEP = 1024
+BACKUP_STEP_SLEEP = 0.005
+BACKUP_MAX_RESTARTS = 3
+BACKUP_TIME_FORMAT = "%Y%m%d-%H%M%S-%f"
+
+# Queued checkout: orders committed per worker transaction and how often idle workers poll
+CHECKOUT_BATCH_SIZE = 50
+CHECKOUT_POLL_INTERVAL = 0.05
+
+# Cart write buffer: how long the writer waits for more cart writes before committing, and the most per commit
+CART_COMMIT_WINDOW_MS = 5
+CART_COMMIT_MAX_WRITES = 500
+
+# Co-purchase recommendations: products shown, candidates read per product, order ids per backfill transaction,
+# and the most distinct products an order may have to be counted (pairs grow with the square of the basket)
+RECOMMENDATION_LIMIT = 3
+RECOMMENDATION_CANDIDATES = 20
+PAIRS_BACKFILL_BATCH = 1000
+PAIRS_MAX_BASKET = 20
+
+# Restock report: sales-velocity windows in days, and how many days of stock left gets a product flagged
+RESTOCK_WINDOWS = (7, 30)
+RESTOCK_THRESHOLD_DAYS = 14
+
+# Loyalty tiers, best first: (name, lifetime orders, lifetime spend); reaching either threshold earns the tier
+LOYALTY_TIERS = (('Gold', 25, 2500.0), ('Silver', 10, 1000.0), ('Bronze', 3, 250.0))
+
+# Login and delivery-OTP throttling: attempts allowed in a burst, tokens regained per second,
+# how long a key is locked out once its bucket runs dry, and how many idle buckets are kept in memory
+LOGIN_ATTEMPTS = 5
+LOGIN_REFILL_PER_SECOND = 1 / 60
+OTP_ATTEMPTS = 3
+OTP_REFILL_PER_SECOND = 1 / 300
+LOCKOUT_SECONDS = 900
+RATE_LIMIT_MAX_KEYS = 100000
+
+# Listing output: rows formatted per write, widest cell shown, and whether tall listings on a terminal are paged
+TABLE_BATCH_ROWS = 1000
+TABLE_CELL_MAX_WIDTH = 40
+USE_PAGER = True
+
+# Upper bounds of the price buckets shown in faceted browse; the last bucket is open-ended
+PRICE_BUCKET_BOUNDS = (10, 25, 50, 100, 250)
+
+
+def chunked(items, size=500):
+    """Yield successive slices of items, keeping IN (...) lists under SQLite's variable limit"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def price_bucket_sql(column):
+    """Return a SQL expression mapping a price column to its bucket number"""
+    cases = ' '.join(f"WHEN {column} < {bound} THEN {i}" for i, bound in enumerate(PRICE_BUCKET_BOUNDS))
+    return f"(CASE {cases} ELSE {len(PRICE_BUCKET_BOUNDS)} END)"
+
+
+def price_bucket_label(bucket):
+    """Return a human-readable label for a price bucket"""
+    if bucket == 0:
+        return f"Under ${PRICE_BUCKET_BOUNDS[0]}"
+    if bucket >= len(PRICE_BUCKET_BOUNDS):
+        return f"${PRICE_BUCKET_BOUNDS[-1]} and above"
+    return f"${PRICE_BUCKET_BOUNDS[bucket - 1]} - ${PRICE_BUCKET_BOUNDS[bucket]}"
+
+
+def loyalty_tier(order_count, lifetime_spend):
+    """Return the best loyalty tier a customer qualifies for, or None"""
+    for name, min_orders, min_spend in LOYALTY_TIERS:
+        if order_count >= min_orders or lifetime_spend >= min_spend:
+            return name
+    return None
+
+
+# Product columns in ProductRecord order, with the category name resolved
+PRODUCT_SELECT = """
+    SELECT p.id, p.name, p.price, cat.name, p.quantity
+    FROM products p
+    JOIN categories cat ON cat.id = p.category_id
+"""
+
+
+def load_numpy():
+    """Import NumPy on first use; returns the module, or None if it is not installed"""
+    global np, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            np = None
+    return np
+
+
+class SQLiteStorage:
+    """Storage backend for a SQLite database file"""
+
+    def __init__(self, path='dollmart.db'):
+        self.path = path
+
+    def connect(self):
+        return sqlite3.connect(self.path)
+
+    def close(self):
+        pass
+
+
+class MemoryStorage:
+    """Storage backend that keeps the whole store in process memory.
+
+    Connections share one named shared-cache in-memory database, so the same
+    SQL runs with no disk I/O. An anchor connection keeps the database alive
+    until close(). Nothing is shared with other processes, and shared-cache
+    locks are per table, so it suits tests and simulations rather than serving.
+    """
+
+    def __init__(self, name=None):
+        self.uri = f"file:dollmart-{name or uuid.uuid4().hex}?mode=memory&cache=shared"
+        self._anchor = self.connect()
+
+    def connect(self):
+        return sqlite3.connect(self.uri, uri=True)
+
+    def close(self):
+        self._anchor.close()
+
+
+# Backend behind every connect_db(); replace to run the store somewhere else
+STORAGE = SQLiteStorage()
+
+
+def connect_db():
+    """Open a connection to the store through the configured storage backend"""
+    return STORAGE.connect()
+
+
+def table_columns(cursor, table):
+    """Return the column names of a table"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cursor.fetchall()]
+
+
+def migrate_product_categories(cursor):
+    """Move free-text products.category values into the categories table"""
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'products'")
+    row = cursor.fetchone()
+    last_id = row[0] if row else 0
+    cursor.execute("INSERT OR IGNORE INTO categories (name) SELECT DISTINCT category FROM products")
+    cursor.execute('''
+    CREATE TABLE products_migrated (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        price REAL NOT NULL,
+        category_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        FOREIGN KEY (category_id) REFERENCES categories (id)
+    )
+    ''')
+    cursor.execute('''
+    INSERT INTO products_migrated (id, name, price, category_id, quantity)
+    SELECT p.id, p.name, p.price, cat.id, p.quantity
+    FROM products p
+    JOIN categories cat ON cat.name = p.category
+    ''')
+    cursor.execute("DROP TABLE products")
+    cursor.execute("ALTER TABLE products_migrated RENAME TO products")
+    cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'products'", (last_id,))
+    cursor.execute("DROP TABLE IF EXISTS product_facets")
+
 
 def create_database():
     """Create database and required tables if they don't exist"""
-    conn = sqlite3.connect('dollmart.db')
+    conn = connect_db()
     cursor = conn.cursor()
+    cursor.execute("PRAGMA user_version")
+    previous_version = cursor.fetchone()[0]
+    if previous_version == SCHEMA_VERSION:
+        # Schema is current: skip DDL and seeding, only trim the change log if it has grown
+        cursor.execute("SELECT MAX(seq) - MIN(seq) FROM product_changes")
+        if (cursor.fetchone()[0] or 0) >= CHANGE_LOG_RETENTION:
+            prune_change_log(cursor)
+            conn.commit()
+        conn.close()
+        return
+    # WAL lets long readers (snapshot refreshes, backups, reports) run without holding off checkout
+    # writers; the mode is stored in the file. In-memory stores keep their 'memory' journal.
+    cursor.execute("PRAGMA journal_mode = WAL")
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
         username TEXT PRIMARY KEY,
@@ -17,14 +243,24 @@ def create_database():
     )
     ''')
     cursor.execute('''
+    CREATE TABLE IF NOT EXISTS categories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE COLLATE NOCASE
+    )
+    ''')
+    cursor.execute('''
     CREATE TABLE IF NOT EXISTS products (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
         price REAL NOT NULL,
-        category TEXT NOT NULL,
-        quantity INTEGER NOT NULL
+        category_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        FOREIGN KEY (category_id) REFERENCES categories (id)
     )
     ''')
+    if 'category' in table_columns(cursor, 'products'):
+        migrate_product_categories(cursor)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products (category_id)")
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS cart (
         username TEXT,
@@ -35,6 +271,27 @@ def create_database():
         PRIMARY KEY (username, product_id)
     )
     ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cart_product ON cart (product_id)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS saved_baskets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        name TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        UNIQUE (username, name),
+        FOREIGN KEY (username) REFERENCES users (username)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS saved_basket_items (
+        basket_id INTEGER,
+        product_id INTEGER,
+        quantity INTEGER,
+        PRIMARY KEY (basket_id, product_id),
+        FOREIGN KEY (basket_id) REFERENCES saved_baskets (id),
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    )
+    ''')
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS orders (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -43,6 +300,7 @@ def create_database():
         order_date TEXT,
         otp TEXT,
         status TEXT DEFAULT 'placed',
+        idempotency_key TEXT,
         FOREIGN KEY (username) REFERENCES users (username)
     )
     ''')
@@ -56,15 +314,930 @@ def create_database():
         FOREIGN KEY (product_id) REFERENCES products (id)
     )
     ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS orders_archive (
+        id INTEGER PRIMARY KEY,
+        username TEXT,
+        total_amount REAL,
+        order_date TEXT,
+        otp TEXT,
+        status TEXT,
+        archived_at TEXT,
+        idempotency_key TEXT
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS order_items_archive (
+        order_id INTEGER,
+        product_id INTEGER,
+        quantity INTEGER,
+        price REAL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS order_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        from_status TEXT,
+        to_status TEXT NOT NULL,
+        changed_at TEXT NOT NULL,
+        note TEXT
+    )
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS order_events_no_update BEFORE UPDATE ON order_events
+    BEGIN
+        SELECT RAISE(ABORT, 'order_events is append-only');
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS order_events_no_delete BEFORE DELETE ON order_events
+    BEGIN
+        SELECT RAISE(ABORT, 'order_events is append-only');
+    END
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_events_order ON order_events (order_id)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS order_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_type TEXT NOT NULL,
+        order_id INTEGER NOT NULL,
+        payload TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS outbox_offsets (
+        consumer TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS checkout_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        idempotency_key TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        order_id INTEGER,
+        error TEXT,
+        submitted_at TEXT NOT NULL,
+        finished_at TEXT,
+        FOREIGN KEY (username) REFERENCES users (username)
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_checkout_jobs_status ON checkout_jobs (status, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_checkout_jobs_username ON checkout_jobs (username)")
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'checkout_job_items'")
+    new_job_items = cursor.fetchone() is None
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS checkout_job_items (
+        job_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        PRIMARY KEY (job_id, product_id),
+        FOREIGN KEY (job_id) REFERENCES checkout_jobs (id),
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    ) WITHOUT ROWID
+    ''')
+    if new_job_items:
+        # Jobs queued before lines were stored: the oldest queued job of each user takes the cart
+        cursor.execute("""
+            INSERT INTO checkout_job_items (job_id, product_id, quantity)
+            SELECT j.id, c.product_id, c.quantity
+            FROM (SELECT MIN(id) AS id, username FROM checkout_jobs WHERE status = 'queued' GROUP BY username) j
+            JOIN cart c ON c.username = j.username
+        """)
+        cursor.execute("DELETE FROM cart WHERE username IN (SELECT username FROM checkout_jobs WHERE status = 'queued')")
+    elif previous_version in (8, 9):
+        # Versions 8 and 9 kept the lines of finished jobs; only queued jobs hold stock now
+        cursor.execute("DELETE FROM checkout_job_items WHERE job_id NOT IN "
+                       "(SELECT id FROM checkout_jobs WHERE status = 'queued')")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_checkout_job_items_product ON checkout_job_items (product_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_checkout_jobs_key ON checkout_jobs (idempotency_key)")
+    # Stock held back from other customers: cart lines, and the lines of queued checkouts (username NULL)
+    cursor.execute('''
+    CREATE VIEW IF NOT EXISTS reserved_items (username, product_id, quantity) AS
+    SELECT username, product_id, quantity FROM cart
+    UNION ALL
+    SELECT NULL, product_id, quantity FROM checkout_job_items
+    ''')
+    if 'idempotency_key' not in table_columns(cursor, 'orders'):
+        cursor.execute("ALTER TABLE orders ADD COLUMN idempotency_key TEXT")
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_idempotency_key ON orders (idempotency_key) "
+        "WHERE idempotency_key IS NOT NULL"
+    )
+    if 'idempotency_key' not in table_columns(cursor, 'orders_archive'):
+        cursor.execute("ALTER TABLE orders_archive ADD COLUMN idempotency_key TEXT")
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_archive_idempotency_key ON orders_archive (idempotency_key) "
+        "WHERE idempotency_key IS NOT NULL"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, order_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_username ON orders (username)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_username ON orders_archive (username)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_archive_order ON order_items_archive (order_id)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS store_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS product_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        changed_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        name TEXT,
+        price REAL,
+        category_id INTEGER,
+        quantity INTEGER,
+        old_quantity INTEGER
+    )
+    ''')
+    change_columns = table_columns(cursor, 'product_changes')
+    if 'old_quantity' not in change_columns:
+        # Upgrade the id-only change log to carry row values
+        for column, column_type in (('name', 'TEXT'), ('price', 'REAL'), ('category_id', 'INTEGER'),
+                                    ('quantity', 'INTEGER'), ('old_quantity', 'INTEGER')):
+            if column not in change_columns:
+                cursor.execute(f"ALTER TABLE product_changes ADD COLUMN {column} {column_type}")
+        for trigger in ('products_log_insert', 'products_log_update', 'products_log_delete'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS products_log_insert AFTER INSERT ON products
+    BEGIN
+        INSERT INTO product_changes (product_id, op, name, price, category_id, quantity, old_quantity)
+        VALUES (NEW.id, 'insert', NEW.name, NEW.price, NEW.category_id, NEW.quantity, NULL);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS products_log_update AFTER UPDATE ON products
+    BEGIN
+        INSERT INTO product_changes (product_id, op, name, price, category_id, quantity, old_quantity)
+        VALUES (
+            NEW.id,
+            CASE WHEN OLD.name IS NEW.name AND OLD.price IS NEW.price AND OLD.category_id IS NEW.category_id
+                 THEN 'stock' ELSE 'update' END,
+            NEW.name, NEW.price, NEW.category_id, NEW.quantity, OLD.quantity
+        );
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS products_log_delete AFTER DELETE ON products
+    BEGIN
+        INSERT INTO product_changes (product_id, op, name, price, category_id, quantity, old_quantity)
+        VALUES (OLD.id, 'delete', OLD.name, OLD.price, OLD.category_id, NULL, OLD.quantity);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS product_facets (
+        category_id INTEGER NOT NULL,
+        price_bucket INTEGER NOT NULL,
+        product_count INTEGER NOT NULL DEFAULT 0,
+        in_stock_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (category_id, price_bucket)
+    )
+    ''')
+    facet_add = f'''
+        INSERT INTO product_facets (category_id, price_bucket, product_count, in_stock_count)
+        VALUES (NEW.category_id, {price_bucket_sql('NEW.price')}, 1, NEW.quantity > 0)
+        ON CONFLICT (category_id, price_bucket) DO UPDATE SET
+            product_count = product_count + 1,
+            in_stock_count = in_stock_count + excluded.in_stock_count;
+    '''
+    facet_remove = f'''
+        UPDATE product_facets SET
+            product_count = product_count - 1,
+            in_stock_count = in_stock_count - (OLD.quantity > 0)
+        WHERE category_id = OLD.category_id AND price_bucket = {price_bucket_sql('OLD.price')};
+        DELETE FROM product_facets
+        WHERE category_id = OLD.category_id AND price_bucket = {price_bucket_sql('OLD.price')}
+            AND product_count <= 0;
+    '''
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS products_facets_insert AFTER INSERT ON products BEGIN {facet_add} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS products_facets_delete AFTER DELETE ON products BEGIN {facet_remove} END")
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS products_facets_update AFTER UPDATE OF category_id, price, quantity ON products
+    BEGIN {facet_remove} {facet_add} END
+    ''')
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM product_facets), EXISTS (SELECT 1 FROM products)")
+    has_facets, has_products = cursor.fetchone()
+    if has_products and not has_facets:
+        Product.rebuild_facets(cursor)
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_pairs'")
+    new_pairs = cursor.fetchone() is None
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS product_pairs (
+        product_id INTEGER NOT NULL,
+        other_id INTEGER NOT NULL,
+        orders INTEGER NOT NULL,
+        PRIMARY KEY (product_id, other_id)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_pairs_rank ON product_pairs (product_id, orders DESC, other_id)")
+    if new_pairs:
+        # Orders placed so far are counted by Product.backfill_co_purchases(); later ones at checkout
+        cursor.execute("SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM orders UNION ALL SELECT MAX(id) FROM orders_archive)")
+        cursor.executemany("INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)",
+                           [('pairs_backfill_upto', cursor.fetchone()[0] or 0), ('pairs_backfill_done', 0)])
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_sales'")
+    new_daily_sales = cursor.fetchone() is None
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_sales (
+        product_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        PRIMARY KEY (product_id, day)
+    ) WITHOUT ROWID
+    ''')
+    if new_daily_sales:
+        Product.rebuild_daily_sales(cursor)
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'customer_stats'")
+    new_customer_stats = cursor.fetchone() is None
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS customer_stats (
+        username TEXT PRIMARY KEY,
+        order_count INTEGER NOT NULL DEFAULT 0,
+        item_count INTEGER NOT NULL DEFAULT 0,
+        lifetime_spend REAL NOT NULL DEFAULT 0,
+        last_order_date TEXT,
+        FOREIGN KEY (username) REFERENCES users (username)
+    )
+    ''')
+    if new_customer_stats or previous_version in (5, 6):
+        # Versions 5 and 6 counted cancelled and returned orders in customer_stats
+        Order.rebuild_customer_stats(cursor)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS auth_lockouts (
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        locked_until REAL NOT NULL,
+        PRIMARY KEY (scope, key)
+    )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('instance_id', ?)",
+                   (uuid.uuid4().hex,))
+    prune_change_log(cursor)
     cursor.execute("SELECT * FROM users WHERE username = 'mngr'")
     if cursor.fetchone() is None:
         hashed_password = hashlib.sha256("123".encode()).hexdigest()
         cursor.execute("INSERT INTO users (username, password, role, visit_count) VALUES (?, ?, ?, NULL)", 
                     ('mngr', hashed_password, 'manager'))
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
     conn.close()
 
 
+def prune_change_log(cursor):
+    """Keep only the newest CHANGE_LOG_RETENTION product change-log rows"""
+    cursor.execute(
+        "DELETE FROM product_changes WHERE seq <= (SELECT MAX(seq) FROM product_changes) - ?",
+        (CHANGE_LOG_RETENTION,)
+    )
+
+
+class ProductRecord:
+    """Compact in-memory copy of a products row"""
+    __slots__ = ('id', 'name', 'price', 'category', 'quantity')
+
+    def __init__(self, id, name, price, category, quantity):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.category = category
+        self.quantity = quantity
+
+    def as_row(self):
+        """Return the record in products column order"""
+        return (self.id, self.name, self.price, self.category, self.quantity)
+
+
+class CatalogCache:
+    """In-process cache of product rows with LRU eviction.
+
+    Writes made by this process are applied write-through by calling sync()
+    after commit; writes from other processes are picked up the same way
+    because sync() replays the trigger-maintained product_changes log.
+    """
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._records = OrderedDict()
+        self._complete = False
+        self._instance = None
+        self._seq = 0
+        self._conn = None
+        self._conn_state = None
+
+    def clear(self):
+        """Drop every cached record"""
+        self._records.clear()
+        self._complete = False
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._records),
+            'capacity': self.capacity,
+            'complete': self._complete,
+        }
+
+    def _store(self, record):
+        self._records[record.id] = record
+        if not self._complete:
+            self._records.move_to_end(record.id)
+        if len(self._records) > self.capacity:
+            self._records.popitem(last=False)
+            self._complete = False
+
+    def _latest_seq(self, cursor):
+        cursor.execute("SELECT MAX(seq) FROM product_changes")
+        return cursor.fetchone()[0] or 0
+
+    def _sync_if_changed(self, cursor):
+        """sync() unless this connection already synced and nothing was committed since.
+
+        PRAGMA data_version only moves when another connection commits and
+        total_changes counts this connection's own writes; neither reads a
+        table, so repeated lookups within one operation skip the log replay.
+        """
+        conn = cursor.connection
+        if conn is self._conn and conn.in_transaction and conn.total_changes == self._conn_state[1]:
+            # Inside our own transaction no other connection can commit
+            return
+        cursor.execute("PRAGMA data_version")
+        state = (cursor.fetchone()[0], conn.total_changes)
+        if conn is self._conn and state == self._conn_state:
+            return
+        self.sync(cursor)
+        self._conn, self._conn_state = conn, state
+
+    def sync(self, cursor):
+        """Bring the cache up to date with the database"""
+        cursor.execute("SELECT value FROM store_meta WHERE key = 'instance_id'")
+        row = cursor.fetchone()
+        instance = row[0] if row else None
+        if instance != self._instance:
+            self.clear()
+            self._instance = instance
+            self._seq = self._latest_seq(cursor)
+            return
+        cursor.execute("SELECT seq, product_id, op FROM product_changes WHERE seq > ? ORDER BY seq",
+                       (self._seq,))
+        changes = cursor.fetchall()
+        if not changes:
+            return
+        if changes[0][0] != self._seq + 1:
+            # Log was pruned past our position; start over
+            self.clear()
+            self._seq = changes[-1][0]
+            return
+        self._seq = changes[-1][0]
+        changed_ids = []
+        for _, product_id, op in changes:
+            if op == 'delete':
+                self._records.pop(product_id, None)
+            elif self._complete or product_id in self._records:
+                changed_ids.append(product_id)
+        changed_ids = list(dict.fromkeys(changed_ids))
+        for chunk in chunked(changed_ids):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(
+                f"{PRODUCT_SELECT} WHERE p.id IN ({placeholders})",
+                chunk
+            )
+            found = set()
+            for row in cursor.fetchall():
+                found.add(row[0])
+                if row[0] in self._records:
+                    record = self._records[row[0]]
+                    record.name, record.price, record.category, record.quantity = row[1:]
+                else:
+                    self._store(ProductRecord(*row))
+            for product_id in chunk:
+                if product_id not in found:
+                    self._records.pop(product_id, None)
+
+    def get(self, cursor, product_id):
+        """Return the ProductRecord for product_id, or None"""
+        self._sync_if_changed(cursor)
+        record = self._records.get(product_id)
+        if record is not None:
+            self.hits += 1
+            if not self._complete:
+                self._records.move_to_end(product_id)
+            return record
+        self.misses += 1
+        if self._complete:
+            return None
+        cursor.execute(f"{PRODUCT_SELECT} WHERE p.id = ?", (product_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        record = ProductRecord(*row)
+        self._store(record)
+        return record
+
+    def get_many(self, cursor, product_ids):
+        """Return ProductRecords for product_ids in the given order, skipping ids that do not exist.
+
+        Cached records are used as they are; the rest are read with one
+        chunked IN query.
+        """
+        self._sync_if_changed(cursor)
+        missing = [product_id for product_id in product_ids if product_id not in self._records]
+        self.hits += len(product_ids) - len(missing)
+        self.misses += len(missing)
+        fetched = {}
+        if missing and not self._complete:
+            for chunk in chunked(missing):
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f"{PRODUCT_SELECT} WHERE p.id IN ({placeholders})", chunk)
+                for row in cursor.fetchall():
+                    fetched[row[0]] = ProductRecord(*row)
+        records = []
+        for product_id in product_ids:
+            record = self._records.get(product_id) or fetched.get(product_id)
+            if record is not None:
+                records.append(record)
+        for record in fetched.values():
+            self._store(record)
+        return records
+
+    def products(self, cursor):
+        """Return all products ordered by id"""
+        self._sync_if_changed(cursor)
+        if self._complete:
+            self.hits += 1
+            return list(self._records.values())
+        self.misses += 1
+        cursor.execute(f"{PRODUCT_SELECT} ORDER BY p.id")
+        records = [ProductRecord(*row) for row in cursor.fetchall()]
+        if len(records) <= self.capacity:
+            self._records = OrderedDict((record.id, record) for record in records)
+            self._complete = True
+        return records
+
+    def search(self, cursor, term, by_name=True, by_category=True):
+        """Return products whose name and/or category contains term"""
+        if by_category and not by_name:
+            # Match the small categories table, then seek products by category_id
+            cursor.execute("SELECT id FROM categories WHERE name LIKE ?", (f'%{term}%',))
+            category_ids = [row[0] for row in cursor.fetchall()]
+            if not category_ids:
+                return []
+            self._sync_if_changed(cursor)
+            if not self._complete:
+                self.misses += 1
+                placeholders = ','.join('?' * len(category_ids))
+                cursor.execute(f"{PRODUCT_SELECT} WHERE p.category_id IN ({placeholders}) ORDER BY p.id",
+                               category_ids)
+                return [ProductRecord(*row) for row in cursor.fetchall()]
+        term = term.lower()
+        return [
+            record for record in self.products(cursor)
+            if (by_name and term in record.name.lower())
+            or (by_category and term in record.category.lower())
+        ]
+
+
+CATALOG_CACHE = CatalogCache()
+
+
+class CatalogSnapshot:
+    """Column-oriented NumPy copy of the catalog for vectorized filtering.
+
+    Columns are parallel arrays sorted by product id. refresh() replays
+    product_changes so only rows that changed since the last refresh are
+    re-read; cart reservations are re-aggregated on every refresh.
+    """
+    SORT_COLUMNS = ('price', 'quantity', 'available', 'id')
+
+    def __init__(self):
+        if load_numpy() is None:
+            raise RuntimeError("NumPy is required for catalog snapshots.")
+        self.ids = np.empty(0, dtype=np.int64)
+        self.prices = np.empty(0, dtype=np.float64)
+        self.quantities = np.empty(0, dtype=np.int64)
+        self.available = np.empty(0, dtype=np.int64)
+        self.category_ids = np.empty(0, dtype=np.int64)
+        self._category_index = {}
+        self._instance = None
+        self._seq = 0
+
+    @staticmethod
+    def build(cursor):
+        """Create a snapshot from the products table"""
+        snapshot = CatalogSnapshot()
+        snapshot.refresh(cursor)
+        return snapshot
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _load_all(self, cursor):
+        cursor.execute("SELECT id, price, quantity, category_id FROM products ORDER BY id")
+        rows = cursor.fetchall()
+        self.ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        self.prices = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+        self.quantities = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+        self.category_ids = np.fromiter((row[3] for row in rows), dtype=np.int64, count=len(rows))
+
+    def _apply_changes(self, cursor, changes):
+        changed_ids = list(dict.fromkeys(product_id for _, product_id, _ in changes))
+        rows = []
+        for chunk in chunked(changed_ids):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(
+                f"SELECT id, price, quantity, category_id FROM products WHERE id IN ({placeholders})",
+                chunk
+            )
+            rows.extend(cursor.fetchall())
+        changed = np.array(changed_ids, dtype=np.int64)
+        keep = ~np.isin(self.ids, changed)
+        rows.sort()
+        self.ids = np.concatenate([self.ids[keep], np.array([row[0] for row in rows], dtype=np.int64)])
+        self.prices = np.concatenate([self.prices[keep], np.array([row[1] for row in rows], dtype=np.float64)])
+        self.quantities = np.concatenate([self.quantities[keep], np.array([row[2] for row in rows], dtype=np.int64)])
+        self.category_ids = np.concatenate([self.category_ids[keep], np.array([row[3] for row in rows], dtype=np.int64)])
+        order = np.argsort(self.ids, kind='stable')
+        self.ids = self.ids[order]
+        self.prices = self.prices[order]
+        self.quantities = self.quantities[order]
+        self.category_ids = self.category_ids[order]
+
+    def refresh(self, cursor):
+        """Bring the snapshot up to date with the database"""
+        cursor.execute("SELECT value FROM store_meta WHERE key = 'instance_id'")
+        row = cursor.fetchone()
+        instance = row[0] if row else None
+        cursor.execute("SELECT seq, product_id, op FROM product_changes WHERE seq > ? ORDER BY seq",
+                       (self._seq,))
+        changes = cursor.fetchall()
+        if instance != self._instance or (changes and changes[0][0] != self._seq + 1):
+            cursor.execute("SELECT MAX(seq) FROM product_changes")
+            self._seq = cursor.fetchone()[0] or 0
+            self._instance = instance
+            self._load_all(cursor)
+        elif changes:
+            self._seq = changes[-1][0]
+            self._apply_changes(cursor, changes)
+        cursor.execute("SELECT name, id FROM categories")
+        self._category_index = {name.lower(): category_id for name, category_id in cursor.fetchall()}
+        cursor.execute("SELECT product_id, SUM(quantity) FROM reserved_items GROUP BY product_id")
+        reserved = cursor.fetchall()
+        self.available = self.quantities.copy()
+        if reserved and len(self.ids):
+            reserved_ids = np.array([row[0] for row in reserved], dtype=np.int64)
+            reserved_qty = np.array([row[1] for row in reserved], dtype=np.int64)
+            positions = np.searchsorted(self.ids, reserved_ids)
+            positions = np.minimum(positions, len(self.ids) - 1)
+            found = self.ids[positions] == reserved_ids
+            np.subtract.at(self.available, positions[found], reserved_qty[found])
+
+    def query(self, in_stock=False, category=None, min_price=None, max_price=None,
+              sort_by='price', descending=False, limit=None):
+        """Return product ids matching the filter, sorted and optionally top-k limited"""
+        if sort_by not in self.SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by {sort_by!r}.")
+        mask = np.ones(len(self.ids), dtype=bool)
+        if in_stock:
+            mask &= self.available > 0
+        if category is not None:
+            category_id = self._category_index.get(category.lower())
+            if category_id is None:
+                return []
+            mask &= self.category_ids == category_id
+        if min_price is not None:
+            mask &= self.prices >= min_price
+        if max_price is not None:
+            mask &= self.prices <= max_price
+        matches = np.flatnonzero(mask)
+        column = {
+            'price': self.prices,
+            'quantity': self.quantities,
+            'available': self.available,
+            'id': self.ids,
+        }[sort_by]
+        keys = column[matches]
+        if descending:
+            keys = -keys
+        if limit is not None and limit < len(matches):
+            # Keep ties with the k-th key so the id tie-break stays deterministic
+            kth = np.partition(keys, limit - 1)[limit - 1]
+            top = keys <= kth
+            matches, keys = matches[top], keys[top]
+        order = np.lexsort((self.ids[matches], keys))
+        return self.ids[matches[order]][:limit].tolist()
+
+
+class TableWriter:
+    """Buffered renderer for ' | '-separated listings with aligned columns.
+
+    columns is a list of (header, format) or (header, format, align) where
+    format is a str.format template or a callable and align is '<' or '>'.
+    Rows are formatted TABLE_BATCH_ROWS at a time and written with one
+    write() per batch. Column widths come from the first batch and only
+    grow, so long listings stream without being held in memory. Cells wider
+    than max_width are cut short with '...'.
+    """
+
+    def __init__(self, columns, out=None, max_width=TABLE_CELL_MAX_WIDTH, batch_rows=TABLE_BATCH_ROWS):
+        self.headers = [column[0] for column in columns]
+        self.formats = [column[1] if callable(column[1]) else column[1].format for column in columns]
+        self.aligns = [column[2] if len(column) > 2 else '<' for column in columns]
+        self.out = out
+        self.max_width = max_width
+        self.batch_rows = batch_rows
+        self.widths = None
+        self.rows_written = 0
+
+    def _template(self):
+        """str.format template for one line at the current widths"""
+        fields = [f"{{:{align}{width}}}" for align, width in zip(self.aligns, self.widths)]
+        if self.aligns[-1] == '<':
+            fields[-1] = "{}"
+        return ' | '.join(fields)
+
+    def rule(self):
+        """Separator line as wide as the table"""
+        widths = self.widths or [len(header) for header in self.headers]
+        return '-' * (sum(widths) + 3 * (len(widths) - 1))
+
+    def write_rows(self, rows):
+        """Format and write rows (any iterable) in batches"""
+        out = self.out or sys.stdout
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_rows))
+            if not batch:
+                break
+            self._write_batch(out, batch)
+
+    def _write_batch(self, out, batch):
+        # Format column by column so the per-cell work stays in C-level map() calls
+        columns = []
+        for fmt, values in zip(self.formats, zip(*batch)):
+            cells = list(map(fmt, values))
+            if max(map(len, cells)) > self.max_width:
+                cells = [cell if len(cell) <= self.max_width else cell[:self.max_width - 3] + '...'
+                         for cell in cells]
+            columns.append(cells)
+        header = self.widths is None
+        widths = self.widths or [len(header_text) for header_text in self.headers]
+        self.widths = [max(width, max(map(len, cells))) for width, cells in zip(widths, columns)]
+        template = self._template()
+        lines = [template.format(*self.headers), self.rule()] if header else []
+        lines.extend(map(template.format, *columns))
+        out.write('\n'.join(lines) + '\n')
+        self.rows_written += len(batch)
+
+    def finish(self):
+        """Write the closing separator (or just the header if there were no rows)"""
+        out = self.out or sys.stdout
+        if self.widths is None:
+            self.widths = [len(header) for header in self.headers]
+            out.write(self._template().format(*self.headers) + '\n')
+        out.write(self.rule() + '\n')
+
+    @staticmethod
+    def render(columns, rows, title=None, out=None, max_width=TABLE_CELL_MAX_WIDTH):
+        """Write a complete table, through the pager if it is taller than the terminal"""
+        buffer = io.StringIO() if out is None and wants_pager(rows) else None
+        writer = TableWriter(columns, buffer or out, max_width)
+        target = buffer or out or sys.stdout
+        if title:
+            target.write(f"\n{title}\n")
+        writer.write_rows(rows)
+        writer.finish()
+        if buffer is not None:
+            show_text(buffer.getvalue())
+
+
+def wants_pager(rows=None, line_count=None):
+    """Whether output of this size should be paged on the current stdout"""
+    if not USE_PAGER or not sys.stdout.isatty():
+        return False
+    if line_count is None:
+        if not hasattr(rows, '__len__'):
+            return False
+        line_count = len(rows) + 4
+    return line_count > shutil.get_terminal_size().lines
+
+
+def show_text(text):
+    """Write a block of output, through $PAGER if it is taller than the terminal"""
+    if wants_pager(line_count=text.count('\n')):
+        import pydoc
+        pydoc.pager(text)
+    else:
+        sys.stdout.write(text)
+
+
+class ReportingSnapshot:
+    """Periodically refreshed copy of dollmart.db for long manager reports.
+
+    The copy is written with VACUUM INTO a temporary file and swapped in with
+    os.replace. The live database is in WAL mode, so the read transaction
+    behind VACUUM INTO does not hold off checkout writers however long the
+    copy takes; readers of the snapshot never touch the live database and
+    always see a complete file. It is refreshed lazily when older than
+    max_age seconds, or on a schedule by start().
+    """
+
+    def __init__(self, path=REPORT_DB_PATH, max_age=REPORT_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_age = max_age
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def age(self):
+        """Seconds since the snapshot was last refreshed, or None if there is none"""
+        try:
+            return max(0.0, time.time() - os.path.getmtime(self.path))
+        except OSError:
+            return None
+
+    def refresh(self):
+        """Copy the live database into the snapshot file"""
+        with self._lock:
+            temp_path = self.path + '.tmp'
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            conn = connect_db()
+            conn.execute("VACUUM INTO ?", (temp_path,))
+            conn.close()
+            os.replace(temp_path, self.path)
+
+    def connect(self):
+        """Open the snapshot, refreshing it first if it is missing or stale"""
+        age = self.age()
+        if age is None or age > self.max_age:
+            self.refresh()
+        return sqlite3.connect(self.path)
+
+    def reader(self):
+        """Connection for a report: the snapshot in reporting mode, else the live database"""
+        if not self.enabled:
+            return connect_db()
+        conn = self.connect()
+        print(f"(Reporting snapshot, {self.age():.0f}s old)")
+        return conn
+
+    def start(self, interval=None):
+        """Refresh the snapshot every interval seconds (default max_age) in a background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        interval = self.max_age if interval is None else interval
+        self._stop.clear()
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.refresh()
+                except sqlite3.Error as e:
+                    print(f"Reporting snapshot refresh failed: {e}")
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=run, name='reporting-snapshot', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background refresh thread"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
+REPORTING_SNAPSHOT = ReportingSnapshot()
+
+
+def toggle_reporting_mode():
+    """Switch manager reports between the live database and the reporting snapshot"""
+    REPORTING_SNAPSHOT.enabled = not REPORTING_SNAPSHOT.enabled
+    if not REPORTING_SNAPSHOT.enabled:
+        REPORTING_SNAPSHOT.stop()
+        print("Reporting mode off: reports read the live database.")
+        return
+    REPORTING_SNAPSHOT.refresh()
+    REPORTING_SNAPSHOT.start()
+    print(f"Reporting mode on: reports read a snapshot refreshed every {REPORTING_SNAPSHOT.max_age}s.")
+
+
+class RateLimiter:
+    """Token-bucket limiter for authentication attempts, with persisted lockouts.
+
+    Each key (a username, an order id) gets a bucket of capacity tokens that
+    refills at refill_per_second. Every attempt takes a token, and the
+    attempt that empties the bucket locks the key out for lockout_seconds.
+    Lockouts are written to auth_lockouts so they survive a restart; they are
+    read once per process, after which every check is in memory, so a
+    rejected attempt costs no SQL and no password hashing. Buckets are kept
+    in least-recently-attempted order and the oldest are dropped beyond
+    max_keys; lockouts are kept in expiry order and dropped once they end.
+    Either way each attempt does O(1) bookkeeping.
+    """
+
+    def __init__(self, scope, capacity, refill_per_second, lockout_seconds=LOCKOUT_SECONDS,
+                 max_keys=RATE_LIMIT_MAX_KEYS):
+        self.scope = scope
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.lockout_seconds = lockout_seconds
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._locked = None
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.lockouts = 0
+
+    def _load_lockouts(self):
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT key, locked_until FROM auth_lockouts WHERE scope = ? AND locked_until > ? "
+                       "ORDER BY locked_until", (self.scope, time.time()))
+        self._locked = OrderedDict(cursor.fetchall())
+        conn.close()
+
+    def _prune(self, now):
+        """Forget ended lockouts and the least recently attempted buckets beyond max_keys"""
+        while self._locked and next(iter(self._locked.values())) <= now:
+            self._locked.popitem(last=False)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def acquire(self, key):
+        """Take a token for an attempt on key; returns False if the attempt must be rejected"""
+        key = str(key)
+        now = time.time()
+        with self._lock:
+            if self._locked is None:
+                self._load_lockouts()
+            locked_until = self._locked.get(key)
+            if locked_until is not None:
+                if now < locked_until:
+                    self.rejected += 1
+                    return False
+                del self._locked[key]
+            tokens, updated_at = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.refill_per_second) - 1
+            self.allowed += 1
+            if tokens >= 1:
+                self._buckets[key] = (tokens, now)
+                self._prune(now)
+                return True
+            locked_until = now + self.lockout_seconds
+            self._locked[key] = locked_until
+            self._prune(now)
+            self.lockouts += 1
+        conn = connect_db()
+        conn.execute("INSERT OR REPLACE INTO auth_lockouts (scope, key, locked_until) VALUES (?, ?, ?)",
+                     (self.scope, key, locked_until))
+        conn.commit()
+        conn.close()
+        return True
+
+    def reset(self, key):
+        """Refill key's bucket and lift any lockout, e.g. after a successful attempt"""
+        key = str(key)
+        with self._lock:
+            self._buckets.pop(key, None)
+            was_locked = self._locked is not None and self._locked.pop(key, None) is not None
+        if was_locked:
+            conn = connect_db()
+            conn.execute("DELETE FROM auth_lockouts WHERE scope = ? AND key = ?", (self.scope, key))
+            conn.commit()
+            conn.close()
+
+    def stats(self):
+        """Return attempt counters and how many keys are tracked or locked out"""
+        with self._lock:
+            now = time.time()
+            return {'allowed': self.allowed, 'rejected': self.rejected, 'lockouts': self.lockouts,
+                    'tracked_keys': len(self._buckets),
+                    'locked_keys': sum(1 for until in (self._locked or {}).values() if until > now)}
+
+
+LOGIN_LIMITER = RateLimiter('login', LOGIN_ATTEMPTS, LOGIN_REFILL_PER_SECOND)
+OTP_LIMITER = RateLimiter('otp', OTP_ATTEMPTS, OTP_REFILL_PER_SECOND)
+
+
+def rate_limit_metrics():
+    """Return the login and OTP limiter counters, keyed by scope"""
+    return {limiter.scope: limiter.stats() for limiter in (LOGIN_LIMITER, OTP_LIMITER)}
+
+
 class User:
     def __init__(self, username, role, customer_type=None, visit_count=0):
         self.username = username
@@ -80,7 +1253,7 @@ class User:
     @staticmethod
     def register():
         """Register a new customer"""
-        conn = sqlite3.connect('dollmart.db')
+        conn = connect_db()
         cursor = conn.cursor()
         while True:
             username = input("Enter username: ")
@@ -119,16 +1292,20 @@ class User:
     @staticmethod
     def login():
         """Login a user and return User object if successful"""
-        conn = sqlite3.connect('dollmart.db')
-        cursor = conn.cursor()
         username = input("Enter username: ")
         password = input("Enter password: ")
+        if not LOGIN_LIMITER.acquire(username):
+            print("Too many login attempts. Please try again later.")
+            return None
         hashed_password = User.hash_password(password)
+        conn = connect_db()
+        cursor = conn.cursor()
         cursor.execute("SELECT username, role, customer_type, visit_count FROM users WHERE username = ? AND password = ?", 
                      (username, hashed_password))
         user_data = cursor.fetchone()
         conn.close()
         if user_data:
+            LOGIN_LIMITER.reset(username)
             return User(user_data[0], user_data[1], user_data[2], user_data[3])
         else:
             print("Invalid username or password.")
@@ -143,10 +1320,20 @@ class Product:
         self.category = category
         self.quantity = quantity
     
+    @staticmethod
+    def get_or_create_category(cursor, name):
+        """Return the id of a category, creating it if needed"""
+        cursor.execute("SELECT id FROM categories WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        if row:
+            return row[0]
+        cursor.execute("INSERT INTO categories (name) VALUES (?)", (name,))
+        return cursor.lastrowid
+
     @staticmethod
     def add_product():
         """Add a new product to the database"""
-        conn = sqlite3.connect('dollmart.db')
+        conn = connect_db()
         cursor = conn.cursor()
         name = input("Enter product name: ")
         while True:
@@ -158,6 +1345,7 @@ class Product:
             except ValueError as e:
                 print(e)
         category = input("Enter product category: ")
+        category_id = Product.get_or_create_category(cursor, category)
         while True:
             try:
                 quantity = int(input("Enter product quantity: "))
@@ -167,20 +1355,20 @@ class Product:
             except ValueError as e:
                 print(e)
         cursor.execute(
-            "INSERT INTO products (name, price, category, quantity) VALUES (?, ?, ?, ?)",
-            (name, price, category, quantity)
+            "INSERT INTO products (name, price, category_id, quantity) VALUES (?, ?, ?, ?)",
+            (name, price, category_id, quantity)
         )
         conn.commit()
+        CATALOG_CACHE.sync(cursor)
         conn.close()
         print(f"Product '{name}' added successfully!")
     
     @staticmethod
     def remove_product():
         """Remove a product from the database"""
-        conn = sqlite3.connect('dollmart.db')
+        conn = connect_db()
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM products")
-        if cursor.fetchone()[0] == 0:
+        if not CATALOG_CACHE.products(cursor):
             print("No products available in the store.")
             conn.close()
             return
@@ -188,8 +1376,7 @@ class Product:
         while True:
             try:
                 product_id = int(input("Enter product ID to remove: "))
-                cursor.execute("SELECT id FROM products WHERE id = ?", (product_id,))
-                if not cursor.fetchone():
+                if not CATALOG_CACHE.get(cursor, product_id):
                     print("Product ID does not exist.")
                     continue
                 break
@@ -198,6 +1385,7 @@ class Product:
         cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
         cursor.execute("DELETE FROM cart WHERE product_id = ?", (product_id,))
         conn.commit()
+        CATALOG_CACHE.sync(cursor)
         conn.close()
         print(f"Product with ID {product_id} removed successfully!")
     
@@ -205,10 +1393,9 @@ class Product:
     @staticmethod
     def update_product():
         """Update product details"""
-        conn = sqlite3.connect('dollmart.db')
+        conn = connect_db()
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM products")
-        if cursor.fetchone()[0] == 0:
+        if not CATALOG_CACHE.products(cursor):
             print("No products available in the store.")
             conn.close()
             return
@@ -216,8 +1403,7 @@ class Product:
         while True:
             try:
                 product_id = int(input("Enter product ID to update: "))
-                cursor.execute("SELECT id FROM products WHERE id = ?", (product_id,))
-                if not cursor.fetchone():
+                if not CATALOG_CACHE.get(cursor, product_id):
                     print("Product ID does not exist.")
                     continue
                 break
@@ -246,7 +1432,8 @@ class Product:
                     print("Please enter a valid price.")
             elif choice == '3':
                 new_value = input("Enter new category: ")
-                cursor.execute("UPDATE products SET category = ? WHERE id = ?", (new_value, product_id))
+                cursor.execute("UPDATE products SET category_id = ? WHERE id = ?",
+                               (Product.get_or_create_category(cursor, new_value), product_id))
                 break
             elif choice == '4':
                 try:
@@ -261,39 +1448,308 @@ class Product:
             else:
                 print("Invalid choice. Please try again.")
         conn.commit()
+        CATALOG_CACHE.sync(cursor)
         conn.close()
         print("Product updated successfully!")
     
     @staticmethod
     def view_all_products():
         """View all products in the database"""
-        conn = sqlite3.connect('dollmart.db')
+        if REPORTING_SNAPSHOT.enabled:
+            conn = REPORTING_SNAPSHOT.reader()
+            cursor = conn.cursor()
+            cursor.execute(f"{PRODUCT_SELECT} ORDER BY p.id")
+            products = [ProductRecord(*row) for row in cursor.fetchall()]
+            cursor.execute("SELECT product_id, SUM(quantity) FROM reserved_items GROUP BY product_id")
+            reserved = dict(cursor.fetchall())
+            available_quantities = {product.id: product.quantity - reserved.get(product.id, 0)
+                                    for product in products}
+            conn.close()
+        else:
+            conn = connect_db()
+            cursor = conn.cursor()
+            products = CATALOG_CACHE.products(cursor)
+            conn.close()
+            available_quantities = Cart.update_product_availability() if products else {}
+        if not products:
+            print("No products available in the store.")
+            return
+        TableWriter.render(
+            [('ID', '{}', '>'), ('Name', '{}'), ('Price', '${:.2f}', '>'), ('Category', '{}'),
+             ('Total Quantity', '{}', '>'), ('Available Quantity', '{}', '>')],
+            [(product.id, product.name, product.price, product.category, product.quantity,
+              available_quantities.get(product.id, 0)) for product in products],
+            title="=== Products List ==="
+        )
+
+    @staticmethod
+    def import_catalog(rows):
+        """Insert products from dicts with name, price, category and quantity keys.
+
+        All valid rows are inserted in one transaction. Returns
+        (imported_count, errors) where errors is a list of (row_number, message).
+        """
+        products = []
+        errors = []
+        for row_number, row in enumerate(rows, start=1):
+            try:
+                name = (row.get('name') or '').strip()
+                category = (row.get('category') or '').strip()
+                price = float(row['price'])
+                quantity = int(row['quantity'])
+            except (KeyError, TypeError, ValueError):
+                errors.append((row_number, "Row needs name, numeric price, category and whole-number quantity."))
+                continue
+            if not name or not category:
+                errors.append((row_number, "Name and category are required."))
+            elif price <= 0:
+                errors.append((row_number, "Price must be positive."))
+            elif quantity < 0:
+                errors.append((row_number, "Quantity cannot be negative."))
+            else:
+                products.append((name, price, category, quantity))
+        conn = connect_db()
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM products")
-        if cursor.fetchone()[0] == 0:
+        cursor.execute("BEGIN IMMEDIATE")
+        category_ids = {}
+        for _, _, category, _ in products:
+            if category.lower() not in category_ids:
+                category_ids[category.lower()] = Product.get_or_create_category(cursor, category)
+        cursor.executemany(
+            "INSERT INTO products (name, price, category_id, quantity) VALUES (?, ?, ?, ?)",
+            [(name, price, category_ids[category.lower()], quantity) for name, price, category, quantity in products]
+        )
+        conn.commit()
+        CATALOG_CACHE.sync(cursor)
+        conn.close()
+        return len(products), errors
+
+    @staticmethod
+    def record_co_purchase(cursor, product_ids):
+        """Count one co-purchase for each ordered pair of distinct products in an order.
+
+        Orders with more than PAIRS_MAX_BASKET distinct products are skipped:
+        they would cost n*(n-1) upserts inside the checkout transaction and
+        say little about which products go together.
+        """
+        product_ids = set(product_ids)
+        if len(product_ids) > PAIRS_MAX_BASKET:
+            return
+        cursor.executemany("""
+            INSERT INTO product_pairs (product_id, other_id, orders) VALUES (?, ?, 1)
+            ON CONFLICT (product_id, other_id) DO UPDATE SET orders = orders + 1
+        """, [(product_id, other_id) for product_id in product_ids for other_id in product_ids
+              if product_id != other_id])
+
+    @staticmethod
+    def backfill_co_purchases(batch_size=PAIRS_BACKFILL_BATCH):
+        """Count co-purchases in orders placed before product_pairs existed.
+
+        Order ids are walked in ranges of batch_size, one transaction each,
+        with progress kept in store_meta so an interrupted backfill resumes
+        where it stopped. Archived orders are included, and orders over
+        PAIRS_MAX_BASKET distinct products are skipped as at checkout. Returns
+        the number of order ids covered by this call.
+        """
+        conn = connect_db()
+        cursor = conn.cursor()
+        covered = 0
+        while True:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT key, value FROM store_meta "
+                           "WHERE key IN ('pairs_backfill_done', 'pairs_backfill_upto')")
+            meta = {key: int(value) for key, value in cursor.fetchall()}
+            done, upto = meta.get('pairs_backfill_done', 0), meta.get('pairs_backfill_upto', 0)
+            if done >= upto:
+                conn.rollback()
+                break
+            end = min(done + batch_size, upto)
+            cursor.execute("""
+                WITH items AS (
+                    SELECT order_id, product_id FROM order_items WHERE order_id > :start AND order_id <= :end
+                    UNION
+                    SELECT order_id, product_id FROM order_items_archive WHERE order_id > :start AND order_id <= :end
+                ),
+                counted AS (
+                    SELECT order_id FROM items GROUP BY order_id HAVING COUNT(*) <= :max_basket
+                )
+                INSERT INTO product_pairs (product_id, other_id, orders)
+                SELECT a.product_id, b.product_id, COUNT(*)
+                FROM counted o
+                JOIN items a ON a.order_id = o.order_id
+                JOIN items b ON b.order_id = a.order_id AND b.product_id != a.product_id
+                GROUP BY a.product_id, b.product_id
+                ON CONFLICT (product_id, other_id) DO UPDATE SET orders = orders + excluded.orders
+            """, {'start': done, 'end': end, 'max_basket': PAIRS_MAX_BASKET})
+            cursor.execute("UPDATE store_meta SET value = ? WHERE key = 'pairs_backfill_done'", (end,))
+            conn.commit()
+            covered += end - done
+        conn.close()
+        return covered
+
+    @staticmethod
+    def record_sales(cursor, day, items, sign=1):
+        """Add (product_id, quantity) items to the day's sales totals; sign=-1 takes them back off"""
+        cursor.executemany("""
+            INSERT INTO daily_sales (product_id, day, quantity) VALUES (?, ?, ?)
+            ON CONFLICT (product_id, day) DO UPDATE SET quantity = quantity + excluded.quantity
+        """, [(product_id, day, sign * quantity) for product_id, quantity in items])
+
+    @staticmethod
+    def rebuild_daily_sales(cursor):
+        """Recompute daily_sales from live and archived orders that were not cancelled or returned"""
+        cursor.execute("DELETE FROM daily_sales")
+        placeholders = ','.join('?' * len(STOCK_RESTORING_STATUSES))
+        cursor.execute(f"""
+            INSERT INTO daily_sales (product_id, day, quantity)
+            SELECT product_id, day, SUM(quantity) FROM (
+                SELECT oi.product_id, substr(o.order_date, 1, 10) AS day, oi.quantity
+                FROM order_items oi JOIN orders o ON o.id = oi.order_id
+                WHERE o.status NOT IN ({placeholders})
+                UNION ALL
+                SELECT oi.product_id, substr(o.order_date, 1, 10), oi.quantity
+                FROM order_items_archive oi JOIN orders_archive o ON o.id = oi.order_id
+                WHERE o.status NOT IN ({placeholders})
+            )
+            GROUP BY product_id, day
+        """, STOCK_RESTORING_STATUSES * 2)
+
+    @staticmethod
+    def restock_report(windows=RESTOCK_WINDOWS, threshold_days=RESTOCK_THRESHOLD_DAYS, today=None):
+        """Project days until stockout for every product.
+
+        Velocity for each window is units sold per day over the last N days,
+        today included, read from daily_sales. Days left divides the
+        available quantity (stock minus cart reservations) by the fastest of
+        those rates, so a recent spike is not averaged away. Products with
+        less than threshold_days left, or nothing available, are flagged.
+        Returns dicts with the soonest stockouts first; products that are not
+        selling come last with days_left None.
+        """
+        today = today or datetime.now().date()
+        starts = [(today - timedelta(days=days - 1)).isoformat() for days in windows]
+        conn = connect_db()
+        cursor = conn.cursor()
+        sums = ', '.join('SUM(CASE WHEN d.day >= ? THEN d.quantity ELSE 0 END)' for _ in windows)
+        # Driving from products makes each product one primary-key range seek into its window
+        cursor.execute(f"""
+            SELECT p.id, {sums}
+            FROM products p
+            JOIN daily_sales d ON d.product_id = p.id AND d.day >= ?
+            GROUP BY p.id
+        """, starts + [min(starts)])
+        sold = {row[0]: row[1:] for row in cursor.fetchall()}
+        products = CATALOG_CACHE.products(cursor)
+        conn.close()
+        available = Cart.update_product_availability()
+        report = []
+        for product in products:
+            units = sold.get(product.id, (0,) * len(windows))
+            velocity = {days: count / days for days, count in zip(windows, units)}
+            rate = max(velocity.values())
+            stock = available.get(product.id, 0)
+            days_left = max(stock, 0) / rate if rate > 0 else None
+            report.append({
+                'id': product.id, 'name': product.name, 'available': stock, 'velocity': velocity,
+                'days_left': days_left,
+                'flagged': stock <= 0 or (days_left is not None and days_left < threshold_days),
+            })
+        report.sort(key=lambda row: (row['days_left'] is None, row['days_left'] or 0, row['id']))
+        return report
+
+    @staticmethod
+    def view_restock_report():
+        """Show the restock report (manager only)"""
+        report = Product.restock_report()
+        if not report:
             print("No products available in the store.")
+            return
+        columns = [('ID', '{}', '>'), ('Name', '{}'), ('Available', '{}', '>')]
+        columns += [(f'{days}d Units/Day', '{:.2f}', '>') for days in RESTOCK_WINDOWS]
+        columns += [('Days Left', lambda days_left: '-' if days_left is None else f'{days_left:.1f}', '>'),
+                    ('Restock', lambda flagged: 'RESTOCK' if flagged else '')]
+        TableWriter.render(
+            columns,
+            [(row['id'], row['name'], row['available'], *row['velocity'].values(), row['days_left'], row['flagged'])
+             for row in report],
+            title=f"=== Restock Report (flagged under {RESTOCK_THRESHOLD_DAYS} days of stock) ==="
+        )
+
+    @staticmethod
+    def build_recommendations():
+        """Run the co-purchase backfill from the manager menu"""
+        covered = Product.backfill_co_purchases()
+        if covered:
+            print(f"Counted co-purchases for {covered} past order id(s).")
+        else:
+            print("Recommendations are already up to date.")
+
+    @staticmethod
+    def recommendations(cursor, product_ids, limit=RECOMMENDATION_LIMIT):
+        """Return up to limit (ProductRecord, score) pairs most often bought with product_ids.
+
+        Reads the top candidates for each product from the product_pairs rank
+        index and sums their counts; products in product_ids and products out
+        of stock are left out.
+        """
+        scores = {}
+        for product_id in product_ids:
+            cursor.execute(
+                "SELECT other_id, orders FROM product_pairs WHERE product_id = ? ORDER BY orders DESC LIMIT ?",
+                (product_id, RECOMMENDATION_CANDIDATES)
+            )
+            for other_id, orders in cursor.fetchall():
+                scores[other_id] = scores.get(other_id, 0) + orders
+        recommended = []
+        for other_id, score in sorted(scores.items(), key=lambda item: (-item[1], item[0])):
+            if other_id in product_ids:
+                continue
+            product = CATALOG_CACHE.get(cursor, other_id)
+            if product is not None and product.quantity > 0:
+                recommended.append((product, score))
+                if len(recommended) == limit:
+                    break
+        return recommended
+
+    @staticmethod
+    def print_recommendations(recommendations, heading):
+        """Print a short 'also bought' list, if there is anything to show"""
+        if not recommendations:
+            return
+        print(f"\n{heading}")
+        for product, score in recommendations:
+            print(f"  {product.id} | {product.name} | ${product.price:.2f} ({score} order(s) together)")
+
+    @staticmethod
+    def view_product():
+        """Show one product with what customers who bought it also bought"""
+        try:
+            product_id = int(input("Enter product ID: "))
+        except ValueError:
+            print("Invalid product ID.")
+            return
+        conn = connect_db()
+        cursor = conn.cursor()
+        product = CATALOG_CACHE.get(cursor, product_id)
+        if product is None:
             conn.close()
+            print("Product not found.")
             return
-        cursor.execute("SELECT id, name, price, category, quantity FROM products")
-        products = cursor.fetchall()
+        recommendations = Product.recommendations(cursor, [product_id])
         conn.close()
-        available_quantities = Cart.update_product_availability()
-        print("\n=== Products List ===")
-        print("ID | Name | Price | Category | Total Quantity | Available Quantity")
-        print("-" * 80)
-        for product in products:
-            product_id = product[0]
-            available = available_quantities.get(product_id, 0)
-            print(f"{product[0]} | {product[1]} | ${product[2]:.2f} | {product[3]} | {product[4]} | {available}")
-        print("-" * 80)    
+        print(f"\n=== {product.name} ===")
+        print(f"ID: {product.id}")
+        print(f"Price: ${product.price:.2f}")
+        print(f"Category: {product.category}")
+        print(f"Quantity: {product.quantity}")
+        Product.print_recommendations(recommendations, "Customers who bought this also bought:")
 
     @staticmethod
     def search_products():
         """Search products by category or name"""
-        conn = sqlite3.connect('dollmart.db')
+        conn = connect_db()
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM products")
-        if cursor.fetchone()[0] == 0:
+        if not CATALOG_CACHE.products(cursor):
             print("No products available in the store.")
             conn.close()
             return
@@ -303,50 +1759,295 @@ class Product:
         print("3. Keyword (matches both name and category)")
         while True:
             choice = input("Enter your choice (1-3): ")
-            if choice == '1':
-                search_term = input("Enter category to search: ")
-                cursor.execute("SELECT id, name, price, category, quantity FROM products WHERE category LIKE ?", 
-                            (f'%{search_term}%',))
+            if choice == '1':
+                search_term = input("Enter category to search: ")
+                products = CATALOG_CACHE.search(cursor, search_term, by_name=False)
+                break
+            elif choice == '2':
+                search_term = input("Enter name to search: ")
+                products = CATALOG_CACHE.search(cursor, search_term, by_category=False)
+                break
+            elif choice == '3':
+                search_term = input("Enter keyword to search: ")
+                products = CATALOG_CACHE.search(cursor, search_term)
+                break
+            else:
+                print("Invalid choice. Please try again.")
+        conn.close()
+        if not products:
+            print("No matching products found.")
+            return
+        print("\n=== Search Results ===")
+        print("ID | Name | Price | Category | Quantity")
+        print("-" * 60)
+        for product in products:
+            print(f"{product.id} | {product.name} | ${product.price:.2f} | {product.category} | {product.quantity}")
+        print("-" * 60)
+
+
+    @staticmethod
+    def changes_since(seq, limit=1000):
+        """Return catalog changes after sequence number seq.
+
+        The result holds up to limit changes in order, the sequence number to
+        pass next time, and a reset flag. reset is True when seq is older than
+        the retained change log; the caller must then reload the catalog and
+        continue from last_seq.
+        """
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT MIN(seq), MAX(seq) FROM product_changes")
+        first_seq, latest_seq = cursor.fetchone()
+        if first_seq is not None and seq < first_seq - 1:
+            conn.close()
+            return {'changes': [], 'last_seq': latest_seq, 'reset': True}
+        cursor.execute("""
+            SELECT pc.seq, pc.product_id, pc.op, pc.changed_at, pc.name, pc.price, cat.name,
+                   pc.quantity, pc.old_quantity
+            FROM product_changes pc
+            LEFT JOIN categories cat ON cat.id = pc.category_id
+            WHERE pc.seq > ?
+            ORDER BY pc.seq
+            LIMIT ?
+        """, (seq, limit))
+        rows = cursor.fetchall()
+        conn.close()
+        changes = [
+            {'seq': row[0], 'product_id': row[1], 'op': row[2], 'changed_at': row[3], 'name': row[4],
+             'price': row[5], 'category': row[6], 'quantity': row[7], 'old_quantity': row[8]}
+            for row in rows
+        ]
+        return {'changes': changes, 'last_seq': changes[-1]['seq'] if changes else seq, 'reset': False}
+
+    @staticmethod
+    def rebuild_facets(cursor):
+        """Recompute the product_facets aggregate table from products"""
+        cursor.execute("DELETE FROM product_facets")
+        cursor.execute(f"""
+            INSERT INTO product_facets (category_id, price_bucket, product_count, in_stock_count)
+            SELECT category_id, {price_bucket_sql('price')}, COUNT(*), SUM(quantity > 0)
+            FROM products
+            GROUP BY 1, 2
+        """)
+
+    @staticmethod
+    def facet_counts(cursor, category=None, price_bucket=None):
+        """Return category, price bucket and stock counts for the given filter"""
+        category_id = None
+        if category is not None:
+            cursor.execute("SELECT id FROM categories WHERE name = ?", (category,))
+            row = cursor.fetchone()
+            category_id = row[0] if row else -1
+        cursor.execute("""
+            SELECT cat.name, SUM(f.product_count), SUM(f.in_stock_count)
+            FROM product_facets f
+            JOIN categories cat ON cat.id = f.category_id
+            WHERE ? IS NULL OR f.price_bucket = ?
+            GROUP BY f.category_id
+            ORDER BY cat.name
+        """, (price_bucket, price_bucket))
+        categories = cursor.fetchall()
+        cursor.execute("""
+            SELECT price_bucket, SUM(product_count), SUM(in_stock_count)
+            FROM product_facets
+            WHERE ? IS NULL OR category_id = ?
+            GROUP BY price_bucket
+            ORDER BY price_bucket
+        """, (category_id, category_id))
+        price_buckets = cursor.fetchall()
+        cursor.execute("""
+            SELECT COALESCE(SUM(product_count), 0), COALESCE(SUM(in_stock_count), 0)
+            FROM product_facets
+            WHERE (? IS NULL OR category_id = ?) AND (? IS NULL OR price_bucket = ?)
+        """, (category_id, category_id, price_bucket, price_bucket))
+        total, in_stock = cursor.fetchone()
+        return {
+            'categories': categories,
+            'price_buckets': price_buckets,
+            'total': total,
+            'in_stock': in_stock,
+        }
+
+    @staticmethod
+    def browse_products():
+        """Browse products with category, price and stock facets"""
+        category = None
+        price_bucket = None
+        in_stock_only = False
+        while True:
+            conn = connect_db()
+            cursor = conn.cursor()
+            facets = Product.facet_counts(cursor, category, price_bucket)
+            conn.close()
+            count_index = 2 if in_stock_only else 1
+            print("\n=== Browse Products ===")
+            print(f"Category: {category or 'Any'} | Price: "
+                  f"{price_bucket_label(price_bucket) if price_bucket is not None else 'Any'} | "
+                  f"In stock only: {'Yes' if in_stock_only else 'No'}")
+            print(f"Matching products: {facets['total']} ({facets['in_stock']} in stock)")
+            print("Categories:")
+            for facet in facets['categories']:
+                print(f"  {facet[0]} ({facet[count_index]})")
+            print("Price ranges:")
+            for facet in facets['price_buckets']:
+                print(f"  {facet[0] + 1}. {price_bucket_label(facet[0])} ({facet[count_index]})")
+            print("1. Filter by category")
+            print("2. Filter by price range")
+            print("3. Toggle in-stock only")
+            print("4. Show matching products")
+            print("5. Clear filters")
+            print("6. Back")
+            choice = input("Enter your choice (1-6): ")
+            if choice == '1':
+                category = input("Enter category: ").strip() or None
+            elif choice == '2':
+                try:
+                    bucket = int(input(f"Enter price range number (1-{len(PRICE_BUCKET_BOUNDS) + 1}): ")) - 1
+                    if not 0 <= bucket <= len(PRICE_BUCKET_BOUNDS):
+                        raise ValueError
+                    price_bucket = bucket
+                except ValueError:
+                    print("Please enter a valid price range number.")
+            elif choice == '3':
+                in_stock_only = not in_stock_only
+            elif choice == '4':
+                min_price = PRICE_BUCKET_BOUNDS[price_bucket - 1] if price_bucket else None
+                max_price = None
+                if price_bucket is not None and price_bucket < len(PRICE_BUCKET_BOUNDS):
+                    max_price = PRICE_BUCKET_BOUNDS[price_bucket]
+                conn = connect_db()
+                cursor = conn.cursor()
+                products = [
+                    product for product in CATALOG_CACHE.products(cursor)
+                    if (category is None or product.category.lower() == category.lower())
+                    and (min_price is None or product.price >= min_price)
+                    and (max_price is None or product.price < max_price)
+                    and (not in_stock_only or product.quantity > 0)
+                ]
+                conn.close()
+                if not products:
+                    print("No matching products found.")
+                    continue
+                print("ID | Name | Price | Category | Quantity")
+                print("-" * 60)
+                for product in products:
+                    print(f"{product.id} | {product.name} | ${product.price:.2f} | {product.category} | {product.quantity}")
+                print("-" * 60)
+            elif choice == '5':
+                category = None
+                price_bucket = None
+                in_stock_only = False
+            elif choice == '6':
+                break
+            else:
+                print("Invalid choice. Please try again.")
+
+    @staticmethod
+    def query_catalog(in_stock=False, category=None, min_price=None, max_price=None,
+                      sort_by='price', descending=False, limit=None):
+        """Return ProductRecords matching a filter, via the NumPy snapshot when available"""
+        global _catalog_snapshot
+        conn = connect_db()
+        cursor = conn.cursor()
+        if load_numpy() is not None:
+            if _catalog_snapshot is None:
+                _catalog_snapshot = CatalogSnapshot.build(cursor)
+            else:
+                _catalog_snapshot.refresh(cursor)
+            product_ids = _catalog_snapshot.query(in_stock, category, min_price, max_price,
+                                                  sort_by, descending, limit)
+            products = CATALOG_CACHE.get_many(cursor, [int(product_id) for product_id in product_ids])
+            conn.close()
+            return products
+        if sort_by not in CatalogSnapshot.SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by {sort_by!r}.")
+        available = Cart.update_product_availability()
+        products = [
+            product for product in CATALOG_CACHE.products(cursor)
+            if (not in_stock or available.get(product.id, 0) > 0)
+            and (category is None or product.category.lower() == category.lower())
+            and (min_price is None or product.price >= min_price)
+            and (max_price is None or product.price <= max_price)
+        ]
+        conn.close()
+        sort_key = {
+            'price': lambda product: product.price,
+            'quantity': lambda product: product.quantity,
+            'available': lambda product: available.get(product.id, 0),
+            'id': lambda product: product.id,
+        }[sort_by]
+        products.sort(key=lambda product: (-sort_key(product) if descending else sort_key(product), product.id))
+        return products[:limit] if limit is not None else products
+
+    @staticmethod
+    def filter_products():
+        """Filter products by category, price range and stock"""
+        category = input("Category (leave blank for any): ").strip() or None
+        bounds = []
+        for label in ("Minimum price", "Maximum price"):
+            while True:
+                value = input(f"{label} (leave blank for none): ").strip()
+                if not value:
+                    bounds.append(None)
+                    break
+                try:
+                    bounds.append(float(value))
+                    break
+                except ValueError:
+                    print("Please enter a valid price.")
+        in_stock = input("Only show items in stock? (y/n): ").lower() == 'y'
+        print("Sort by:")
+        print("1. Price (low to high)")
+        print("2. Price (high to low)")
+        print("3. Available quantity")
+        while True:
+            choice = input("Enter your choice (1-3): ")
+            if choice in ['1', '2', '3']:
                 break
-            elif choice == '2':
-                search_term = input("Enter name to search: ")
-                cursor.execute("SELECT id, name, price, category, quantity FROM products WHERE name LIKE ?", 
-                            (f'%{search_term}%',))
+            print("Invalid choice. Please try again.")
+        sort_by, descending = {'1': ('price', False), '2': ('price', True), '3': ('available', True)}[choice]
+        while True:
+            value = input("Maximum number of results (leave blank for all): ").strip()
+            if not value:
+                limit = None
                 break
-            elif choice == '3':
-                search_term = input("Enter keyword to search: ")
-                cursor.execute("SELECT id, name, price, category, quantity FROM products WHERE name LIKE ? OR category LIKE ?", 
-                            (f'%{search_term}%', f'%{search_term}%'))
+            try:
+                limit = int(value)
+                if limit <= 0:
+                    print("Please enter a positive number.")
+                    continue
                 break
-            else:
-                print("Invalid choice. Please try again.")
-        products = cursor.fetchall()
-        conn.close()
+            except ValueError:
+                print("Please enter a valid number.")
+        products = Product.query_catalog(in_stock, category, bounds[0], bounds[1], sort_by, descending, limit)
         if not products:
             print("No matching products found.")
             return
-        print("\n=== Search Results ===")
-        print("ID | Name | Price | Category | Quantity")
-        print("-" * 60)
+        available_quantities = Cart.update_product_availability()
+        print("\n=== Filtered Products ===")
+        print("ID | Name | Price | Category | Available Quantity")
+        print("-" * 70)
         for product in products:
-            print(f"{product[0]} | {product[1]} | ${product[2]:.2f} | {product[3]} | {product[4]}")
-        print("-" * 60)
+            print(f"{product.id} | {product.name} | ${product.price:.2f} | {product.category} | "
+                  f"{available_quantities.get(product.id, 0)}")
+        print("-" * 70)
+
+
+_catalog_snapshot = None
 
 
 class Cart:
     @staticmethod
     def add_to_cart(username):
         """Add item to user's cart"""
-        conn = sqlite3.connect('dollmart.db')
+        conn = connect_db()
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM products")
-        if cursor.fetchone()[0] == 0:
+        products = CATALOG_CACHE.products(cursor)
+        if not products:
             print("No products available in the store to add to cart.")
             conn.close()
             return
-        cursor.execute("SELECT COUNT(*) FROM products WHERE quantity > 0")
-        in_stock_count = cursor.fetchone()[0]
-        if in_stock_count == 0:
+        if not any(product.quantity > 0 for product in products):
             print("Sorry, all products are currently out of stock.")
             conn.close()
             return
@@ -354,11 +2055,10 @@ class Cart:
         while True:
             try:
                 product_id = int(input("Enter product ID to add to cart: "))
-                cursor.execute("SELECT id, quantity FROM products WHERE id = ?", (product_id,))
-                product = cursor.fetchone()
+                product = CATALOG_CACHE.get(cursor, product_id)
                 if not product:
                     raise ValueError("Product ID does not exist.")
-                if product[1] <= 0:
+                if product.quantity <= 0:
                     print("Product is out of stock.")
                     continue
                 break
@@ -367,6 +2067,7 @@ class Cart:
         cursor.execute("SELECT quantity FROM cart WHERE username = ? AND product_id = ?", 
                      (username, product_id))
         cart_item = cursor.fetchone()
+        quantity = 0
         if cart_item:
             while True:
                 try:
@@ -374,14 +2075,13 @@ class Cart:
                     if add_quantity <= 0:
                         print("Quantity must be positive.")
                         continue
-                    if add_quantity + cart_item[0] > product[1]:
-                        print(f"Not enough stock. Available: {product[1]}")
-                        if product[1] <= cart_item[0]:
+                    if add_quantity + cart_item[0] > product.quantity:
+                        print(f"Not enough stock. Available: {product.quantity}")
+                        if product.quantity <= cart_item[0]:
                             print("You already have all available stock in your cart.")
                             break
                         continue
-                    cursor.execute("UPDATE cart SET quantity = quantity + ? WHERE username = ? AND product_id = ?", 
-                                (add_quantity, username, product_id))
+                    quantity = add_quantity
                     break
                 except ValueError:
                     print("Please enter a valid quantity.")
@@ -392,22 +2092,376 @@ class Cart:
                     if quantity <= 0:
                         print("Quantity must be positive.")
                         continue
-                    if quantity > product[1]:
-                        print(f"Not enough stock. Available: {product[1]}")
+                    if quantity > product.quantity:
+                        print(f"Not enough stock. Available: {product.quantity}")
                         continue
-                    cursor.execute("INSERT INTO cart (username, product_id, quantity) VALUES (?, ?, ?)", 
-                                 (username, product_id, quantity))
                     break
                 except ValueError:
                     print("Please enter a valid quantity.")
-        conn.commit()
         conn.close()
+        if quantity:
+            Cart.add_item(username, product_id, quantity)
         print("Item added to cart successfully!")
     
+    @staticmethod
+    def write_cart(statements):
+        """Commit cart (sql, params) statements, through the write buffer when it is enabled"""
+        if CART_WRITE_BUFFER is not None:
+            CART_WRITE_BUFFER.submit(statements)
+            return
+        conn = connect_db()
+        cursor = conn.cursor()
+        try:
+            for sql, params in statements:
+                cursor.execute(sql, params)
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def enable_write_buffer(window_ms=CART_COMMIT_WINDOW_MS):
+        """Start group-committing cart writes"""
+        global CART_WRITE_BUFFER
+        if CART_WRITE_BUFFER is None:
+            CART_WRITE_BUFFER = CartWriteBuffer(window_ms)
+        return CART_WRITE_BUFFER
+
+    @staticmethod
+    def disable_write_buffer():
+        """Stop group-committing cart writes; returns the buffer's stats, or None if it was off"""
+        global CART_WRITE_BUFFER
+        if CART_WRITE_BUFFER is None:
+            return None
+        buffer, CART_WRITE_BUFFER = CART_WRITE_BUFFER, None
+        buffer.close()
+        return buffer.stats()
+
+    @staticmethod
+    def add_item(username, product_id, quantity):
+        """Add quantity of a product to the cart (no stock check)"""
+        Cart.write_cart([("""
+            INSERT INTO cart (username, product_id, quantity) VALUES (?, ?, ?)
+            ON CONFLICT (username, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+        """, (username, product_id, quantity))])
+
+    @staticmethod
+    def remove_item(username, product_id, quantity=None):
+        """Remove a product from the cart, or only reduce it by quantity"""
+        statements = [("DELETE FROM cart WHERE username = ? AND product_id = ? AND quantity <= COALESCE(?, quantity)",
+                       (username, product_id, quantity))]
+        if quantity is not None:
+            statements.append(("UPDATE cart SET quantity = quantity - ? WHERE username = ? AND product_id = ?",
+                               (quantity, username, product_id)))
+        Cart.write_cart(statements)
+
+    @staticmethod
+    def set_quantities(username, quantities):
+        """Set cart quantities for many products in one transaction.
+
+        quantities maps product_id to the desired quantity; 0 removes the item.
+        Stock is validated for every product with one query against what is
+        not reserved in other carts. Valid lines are applied, invalid ones are
+        reported. Returns a list of (product_id, quantity, applied, message).
+        """
+        requested = {}
+        results = []
+        for product_id, quantity in quantities.items():
+            try:
+                product_id, quantity = int(product_id), int(quantity)
+            except (TypeError, ValueError):
+                results.append((product_id, quantity, False, "Product ID and quantity must be whole numbers."))
+                continue
+            if quantity < 0:
+                results.append((product_id, quantity, False, "Quantity cannot be negative."))
+                continue
+            requested[product_id] = quantity
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""
+            SELECT CAST(r.key AS INTEGER), p.id IS NOT NULL,
+                   p.quantity - COALESCE((SELECT SUM(c.quantity) FROM reserved_items c
+                                          WHERE c.product_id = p.id AND c.username IS NOT ?), 0)
+            FROM json_each(?) r
+            LEFT JOIN products p ON p.id = CAST(r.key AS INTEGER)
+        """, (username, json.dumps({str(product_id): quantity for product_id, quantity in requested.items()})))
+        upserts = []
+        deletes = []
+        for product_id, exists, available in cursor.fetchall():
+            quantity = requested[product_id]
+            if quantity == 0:
+                deletes.append((username, product_id))
+                results.append((product_id, quantity, True, "Removed from cart."))
+            elif not exists:
+                results.append((product_id, quantity, False, "Product ID does not exist."))
+            elif quantity > available:
+                results.append((product_id, quantity, False, f"Not enough stock. Available: {max(available, 0)}"))
+            else:
+                upserts.append((username, product_id, quantity))
+                results.append((product_id, quantity, True, "Quantity set."))
+        cursor.executemany("""
+            INSERT INTO cart (username, product_id, quantity) VALUES (?, ?, ?)
+            ON CONFLICT (username, product_id) DO UPDATE SET quantity = excluded.quantity
+        """, upserts)
+        cursor.executemany("DELETE FROM cart WHERE username = ? AND product_id = ?", deletes)
+        conn.commit()
+        conn.close()
+        return results
+
+    @staticmethod
+    def clear_cart(username):
+        """Remove every item from a user's cart and return how many lines were removed"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM cart WHERE username = ?", (username,))
+        removed = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return removed
+
+    @staticmethod
+    def merge_carts(source_username, target_username):
+        """Move a (guest) cart into another user's cart, clamping to available stock.
+
+        Returns a list of (product_id, requested, merged_quantity) per source line.
+        Merging a cart into itself leaves it as it is and returns [].
+        """
+        if source_username == target_username:
+            return []
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""
+            SELECT s.product_id, s.quantity, COALESCE(t.quantity, 0),
+                   p.quantity - COALESCE((SELECT SUM(c.quantity) FROM reserved_items c
+                                          WHERE c.product_id = s.product_id
+                                          AND (c.username IS NULL OR c.username NOT IN (?, ?))), 0)
+            FROM cart s
+            JOIN products p ON p.id = s.product_id
+            LEFT JOIN cart t ON t.username = ? AND t.product_id = s.product_id
+            WHERE s.username = ?
+            ORDER BY s.product_id
+        """, (source_username, target_username, target_username, source_username))
+        results = []
+        upserts = []
+        for product_id, source_quantity, target_quantity, available in cursor.fetchall():
+            merged = max(min(source_quantity + target_quantity, available), target_quantity)
+            results.append((product_id, source_quantity + target_quantity, merged))
+            if merged > 0:
+                upserts.append((target_username, product_id, merged))
+        cursor.executemany("""
+            INSERT INTO cart (username, product_id, quantity) VALUES (?, ?, ?)
+            ON CONFLICT (username, product_id) DO UPDATE SET quantity = excluded.quantity
+        """, upserts)
+        cursor.execute("DELETE FROM cart WHERE username = ?", (source_username,))
+        conn.commit()
+        conn.close()
+        return results
+
+    @staticmethod
+    def copy_into_cart(username, source_sql, params):
+        """Add (product_id, quantity) rows from source_sql to the user's cart.
+
+        The copy is a single INSERT ... SELECT, clamped so that no product is
+        reserved beyond its stock (the same rule as update_product_availability).
+        Returns a list of (product_id, name, requested, added) per source product.
+        """
+        plan_sql = f"""
+            WITH source(product_id, quantity) AS ({source_sql}),
+            requested AS (
+                SELECT product_id, SUM(quantity) AS quantity FROM source GROUP BY product_id
+            ),
+            plan AS (
+                SELECT r.product_id, p.name, r.quantity AS requested, COALESCE(c.quantity, 0) AS current,
+                       CASE WHEN p.id IS NULL THEN COALESCE(c.quantity, 0) ELSE MAX(
+                           MIN(COALESCE(c.quantity, 0) + r.quantity,
+                               p.quantity - COALESCE((SELECT SUM(o.quantity) FROM reserved_items o
+                                                      WHERE o.product_id = r.product_id
+                                                      AND o.username IS NOT :username), 0)),
+                           COALESCE(c.quantity, 0)) END AS new_quantity
+                FROM requested r
+                LEFT JOIN products p ON p.id = r.product_id
+                LEFT JOIN cart c ON c.username = :username AND c.product_id = r.product_id
+            )
+        """
+        params = dict(params, username=username)
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(plan_sql + "SELECT product_id, name, requested, new_quantity - current FROM plan "
+                       "ORDER BY product_id", params)
+        results = cursor.fetchall()
+        cursor.execute(plan_sql + """
+            INSERT INTO cart (username, product_id, quantity)
+            SELECT :username, product_id, new_quantity FROM plan WHERE new_quantity > current
+            ON CONFLICT (username, product_id) DO UPDATE SET quantity = excluded.quantity
+        """, params)
+        conn.commit()
+        conn.close()
+        return results
+
+    @staticmethod
+    def print_copy_report(results):
+        """Print the line-by-line outcome of copy_into_cart"""
+        for product_id, name, requested, added in results:
+            if name is None:
+                print(f"Product {product_id}: no longer available, skipped.")
+            elif added == requested:
+                print(f"{name}: added {added}.")
+            elif added == 0:
+                print(f"{name}: requested {requested}, none available.")
+            else:
+                print(f"{name}: requested {requested}, only {added} available and added.")
+
+    @staticmethod
+    def reorder(username, order_id):
+        """Copy the items of one of the user's past orders into the cart.
+
+        Returns the copy_into_cart report, or None if the order is not the user's.
+        """
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT id FROM {Order.orders_source(include_archive=True)} WHERE id = ? AND username = ?",
+                       (order_id, username))
+        found = cursor.fetchone()
+        conn.close()
+        if not found:
+            return None
+        return Cart.copy_into_cart(
+            username,
+            f"SELECT product_id, quantity FROM {Order.order_items_source(include_archive=True)} "
+            "WHERE order_id = :order_id",
+            {'order_id': order_id}
+        )
+
+    @staticmethod
+    def save_basket(username, name):
+        """Save the current cart as a named basket, replacing any basket with that name"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""
+            INSERT INTO saved_baskets (username, name, created_at) VALUES (?, ?, ?)
+            ON CONFLICT (username, name) DO UPDATE SET created_at = excluded.created_at
+        """, (username, name, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        cursor.execute("SELECT id FROM saved_baskets WHERE username = ? AND name = ?", (username, name))
+        basket_id = cursor.fetchone()[0]
+        cursor.execute("DELETE FROM saved_basket_items WHERE basket_id = ?", (basket_id,))
+        cursor.execute("""
+            INSERT INTO saved_basket_items (basket_id, product_id, quantity)
+            SELECT ?, product_id, quantity FROM cart WHERE username = ?
+        """, (basket_id, username))
+        saved = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return saved
+
+    @staticmethod
+    def list_baskets(username):
+        """Return (name, created_at, item_count) for each of the user's saved baskets"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT b.name, b.created_at, COUNT(i.product_id)
+            FROM saved_baskets b
+            LEFT JOIN saved_basket_items i ON i.basket_id = b.id
+            WHERE b.username = ?
+            GROUP BY b.id
+            ORDER BY b.name
+        """, (username,))
+        baskets = cursor.fetchall()
+        conn.close()
+        return baskets
+
+    @staticmethod
+    def load_basket(username, name):
+        """Copy a saved basket into the cart; returns the report or None if no such basket"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM saved_baskets WHERE username = ? AND name = ?", (username, name))
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return None
+        return Cart.copy_into_cart(
+            username,
+            "SELECT product_id, quantity FROM saved_basket_items WHERE basket_id = :basket_id",
+            {'basket_id': row[0]}
+        )
+
+    @staticmethod
+    def reorder_past_order(username):
+        """Prompt for a past order and copy its items into the cart"""
+        while True:
+            try:
+                order_id = int(input("Enter Order ID to reorder: "))
+                break
+            except ValueError:
+                print("Please enter a valid Order ID.")
+        results = Cart.reorder(username, order_id)
+        if results is None:
+            print("Order not found in your order history.")
+            return
+        Cart.print_copy_report(results)
+
+    @staticmethod
+    def manage_saved_baskets(username):
+        """Save, list and load named baskets"""
+        print("1. Save current cart as a basket")
+        print("2. Load a saved basket into cart")
+        print("3. List saved baskets")
+        while True:
+            choice = input("Enter your choice (1-3): ")
+            if choice in ['1', '2', '3']:
+                break
+            print("Invalid choice. Please try again.")
+        if choice == '1':
+            name = input("Enter basket name: ").strip()
+            saved = Cart.save_basket(username, name)
+            if saved:
+                print(f"Saved basket '{name}' with {saved} item(s).")
+            else:
+                print("Your cart is empty; saved an empty basket.")
+        elif choice == '2':
+            name = input("Enter basket name: ").strip()
+            results = Cart.load_basket(username, name)
+            if results is None:
+                print("No saved basket with that name.")
+                return
+            Cart.print_copy_report(results)
+        else:
+            baskets = Cart.list_baskets(username)
+            if not baskets:
+                print("You have no saved baskets.")
+                return
+            print("Name | Saved | Items")
+            for name, created_at, item_count in baskets:
+                print(f"{name} | {created_at} | {item_count}")
+
+    @staticmethod
+    def bulk_update_cart(username):
+        """Set quantities for several products at once"""
+        while True:
+            entry = input("Enter product_id:quantity pairs separated by commas (quantity 0 removes): ")
+            try:
+                quantities = {}
+                for pair in entry.split(','):
+                    if pair.strip():
+                        product_id, quantity = pair.split(':')
+                        quantities[int(product_id)] = int(quantity)
+                if not quantities:
+                    print("Please enter at least one product.")
+                    continue
+                break
+            except ValueError:
+                print("Please use the format product_id:quantity, e.g. 1:2, 5:1")
+        for product_id, quantity, applied, message in Cart.set_quantities(username, quantities):
+            print(f"Product {product_id} x {quantity}: {'OK' if applied else 'FAILED'} - {message}")
+
     @staticmethod
     def remove_from_cart(username):
         """Remove item from user's cart"""
-        conn = sqlite3.connect('dollmart.db')
+        conn = connect_db()
         cursor = conn.cursor()
         Cart.view_cart(username)
         cursor.execute("""
@@ -436,8 +2490,7 @@ class Cart:
         while True:
             choice = input("Enter your choice (1-2): ")
             if choice == '1':
-                cursor.execute("DELETE FROM cart WHERE username = ? AND product_id = ?", 
-                             (username, product_id))
+                reduce_by = None
                 break
             elif choice == '2':
                 cursor.execute("SELECT quantity FROM cart WHERE username = ? AND product_id = ?", 
@@ -451,35 +2504,31 @@ class Cart:
                             continue
                         if reduce_by >= current_quantity:
                             print("This will remove the item completely.")
-                            cursor.execute("DELETE FROM cart WHERE username = ? AND product_id = ?", 
-                                         (username, product_id))
-                        else:
-                            cursor.execute("UPDATE cart SET quantity = quantity - ? WHERE username = ? AND product_id = ?", 
-                                         (reduce_by, username, product_id))
                         break
                     except ValueError:
                         print("Please enter a valid quantity.")
                 break
             else:
                 print("Invalid choice. Please try again.")
-        conn.commit()
         conn.close()
+        Cart.remove_item(username, product_id, reduce_by)
         print("Cart updated successfully!")
     
     @staticmethod
     def view_cart(username):
         """View user's cart"""
-        conn = sqlite3.connect('dollmart.db')
+        conn = connect_db()
         cursor = conn.cursor()
         cursor.execute("SELECT customer_type FROM users WHERE username = ?", (username,))
         customer_type = cursor.fetchone()[0]
         cursor.execute("""
-            SELECT c.product_id, p.name, p.price, c.quantity, p.category
+            SELECT c.product_id, p.name, p.price, c.quantity
             FROM cart c 
             JOIN products p ON c.product_id = p.id 
             WHERE c.username = ?
         """, (username,))
         cart_items = cursor.fetchall()
+        recommendations = Product.recommendations(cursor, [item[0] for item in cart_items]) if cart_items else []
         conn.close()
         if not cart_items:
             print("Your cart is empty.")
@@ -489,7 +2538,7 @@ class Cart:
         print("-" * 60)
         total = 0
         for item in cart_items:
-            product_id, name, price, quantity, category = item
+            product_id, name, price, quantity = item
             if customer_type == 'retail':
                 discount_price = price * 0.9  # 10% discount for retail
                 subtotal = discount_price * quantity
@@ -500,27 +2549,150 @@ class Cart:
             total += subtotal
         print("-" * 60)
         print(f"Total: ${total:.2f}")
+        Product.print_recommendations(recommendations, "Customers also bought:")
         return total
     
     @staticmethod
-    def place_order(username):
-        """Place an order with items in cart"""
-        conn = sqlite3.connect('dollmart.db')
+    def find_order_by_key(cursor, idempotency_key):
+        """Return the order created with idempotency_key, live or archived, or None"""
+        cursor.execute("""
+            SELECT id, username, total_amount, order_date, otp, status FROM orders WHERE idempotency_key = ?
+            UNION ALL
+            SELECT id, username, total_amount, order_date, otp, status FROM orders_archive WHERE idempotency_key = ?
+        """, (idempotency_key, idempotency_key))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return {'order_id': row[0], 'username': row[1], 'total': row[2], 'order_date': row[3], 'otp': row[4],
+                'status': row[5], 'discount_applied': False, 'replayed': True}
+
+    @staticmethod
+    def checkout(cursor, username, idempotency_key=None, items=None):
+        """Turn the user's cart into an order inside the caller's transaction.
+
+        items, a list of (product_id, quantity), is ordered instead of the
+        cart; the cart is then left alone and stock is checked, since those
+        lines are not held by any cart. Returns a dict describing the order,
+        or None if there is nothing to order.
+        """
+        cursor.execute("SELECT customer_type, visit_count FROM users WHERE username = ?", (username,))
+        user = cursor.fetchone()
+        if user is None:
+            raise ValueError(f"Unknown user: {username}")
+        customer_type, visit_count = user
+        if items is None:
+            cursor.execute("""
+                SELECT c.product_id, p.price, c.quantity 
+                FROM cart c 
+                JOIN products p ON c.product_id = p.id 
+                WHERE c.username = ?
+            """, (username,))
+            cart_items = cursor.fetchall()
+        else:
+            cursor.execute("""
+                SELECT p.id, p.price, CAST(r.value AS INTEGER), p.quantity
+                FROM json_each(?) r
+                JOIN products p ON p.id = CAST(r.key AS INTEGER)
+            """, (json.dumps({str(product_id): quantity for product_id, quantity in items}),))
+            cart_items = []
+            for product_id, price, quantity, stock in cursor.fetchall():
+                if quantity > stock:
+                    raise ValueError(f"Not enough stock for product {product_id}. Available: {max(stock, 0)}")
+                cart_items.append((product_id, price, quantity))
+        if not cart_items:
+            return None
+        order_items = []
+        for product_id, price, quantity in cart_items:
+            if customer_type == 'retail':
+                price = price * 0.9
+            order_items.append({'product_id': product_id, 'quantity': quantity, 'price': price})
+        total = sum(item['price'] * item['quantity'] for item in order_items)
+        discount_applied = (visit_count + 1) % 3 == 0
+        if discount_applied:
+            total = total * 0.9
+        otp = ''.join([str(random.randint(0, 9)) for _ in range(6)])
+        order_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute(
+            "INSERT INTO orders (username, total_amount, order_date, otp, status, idempotency_key) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (username, total, order_date, otp, "placed", idempotency_key)
+        )
+        order_id = cursor.lastrowid
+        cursor.execute(
+            "INSERT INTO order_events (order_id, from_status, to_status, changed_at) VALUES (?, NULL, ?, ?)",
+            (order_id, "placed", order_date)
+        )
+        cursor.executemany(
+            "INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
+            [(order_id, item['product_id'], item['quantity'], item['price']) for item in order_items]
+        )
+        Product.record_co_purchase(cursor, [item['product_id'] for item in order_items])
+        Product.record_sales(cursor, order_date[:10], [(item['product_id'], item['quantity']) for item in order_items])
+        Order.record_customer_order(cursor, username, sum(item['quantity'] for item in order_items), total, order_date)
+        cursor.executemany(
+            "UPDATE products SET quantity = quantity - ? WHERE id = ?",
+            [(item['quantity'], item['product_id']) for item in order_items]
+        )
+        cursor.execute(
+            "UPDATE users SET visit_count = visit_count + 1 WHERE username = ?",
+            (username,)
+        )
+        if items is None:
+            cursor.execute("DELETE FROM cart WHERE username = ?", (username,))
+        OrderOutbox.add_events(cursor, 'order_placed', [(order_id, {
+            'order_id': order_id,
+            'username': username,
+            'total_amount': total,
+            'order_date': order_date,
+            'status': 'placed',
+            'items': order_items,
+        })], order_date)
+        return {'order_id': order_id, 'username': username, 'total': total, 'order_date': order_date, 'otp': otp,
+                'status': 'placed', 'discount_applied': discount_applied, 'items': order_items, 'replayed': False}
+
+    @staticmethod
+    def print_order_confirmation(order):
+        """Print the confirmation shown after an order is placed"""
+        if order['replayed']:
+            print("\nThis order was already placed; showing the original order.")
+        print("\n==== Order Placed Successfully! ====")
+        print(f"Order ID: {order['order_id']}")
+        print(f"Order Date: {order['order_date']}")
+        print(f"Total Amount: ${order['total']:.2f}")
+        print(f"Your OTP for order confirmation: {order['otp']}")
+        print("IMPORTANT: Please keep this OTP. The manager will use it to confirm your order delivery.")
+        if order['discount_applied']:
+            print("10% Loyalty Discount Applied!")
+        print("Thank you for shopping with Dollmart!")
+
+    @staticmethod
+    def place_order(username, idempotency_key=None):
+        """Place an order with items in cart.
+
+        A retried call with the same idempotency_key returns the original
+        order instead of placing a second one. Returns the order id.
+        """
+        conn = connect_db()
         cursor = conn.cursor()
+        if idempotency_key is not None:
+            order = Cart.find_order_by_key(cursor, idempotency_key)
+            if order:
+                conn.close()
+                if order['username'] != username:
+                    print("This request key was already used by another customer.")
+                    return None
+                Cart.print_order_confirmation(order)
+                return order['order_id']
         cursor.execute("SELECT COUNT(*) FROM cart WHERE username = ?", (username,))
         if cursor.fetchone()[0] == 0:
             print("Your cart is empty.")
             conn.close()
             return
-        cursor.execute("SELECT customer_type, visit_count FROM users WHERE username = ?", (username,))
-        customer_data = cursor.fetchone()
-        customer_type = customer_data[0]
-        visit_count = customer_data[1]
+        cursor.execute("SELECT visit_count FROM users WHERE username = ?", (username,))
+        visit_count = cursor.fetchone()[0]
         total = Cart.view_cart(username)
-        discount_applied = False
         if (visit_count + 1) % 3 == 0:
             print("\n🎉 Congratulations! You are eligible for a 10% discount on this order!")
-            discount_applied = True
             total = total * 0.9
             print(f"Discounted Total: ${total:.2f}")
         while True:
@@ -528,64 +2700,63 @@ class Cart:
             if confirm in ['y', 'n']:
                 break
             print("Please enter 'y' or 'n'.")
+        conn.close()
         if confirm == 'n':
             print("Order cancelled.")
-            conn.close()
             return
-        otp = ''.join([str(random.randint(0, 9)) for _ in range(6)])
-        order_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute(
-            "INSERT INTO orders (username, total_amount, order_date, otp, status) VALUES (?, ?, ?, ?, ?)",
-            (username, total, order_date, otp, "placed")
-        )
-        order_id = cursor.lastrowid
-        cursor.execute("""
-            SELECT c.product_id, p.price, c.quantity 
-            FROM cart c 
-            JOIN products p ON c.product_id = p.id 
-            WHERE c.username = ?
-        """, (username,))
-        cart_items = cursor.fetchall()
-        for item in cart_items:
-            product_id, price, quantity = item
-            if customer_type == 'retail':
-                price = price * 0.9
-            cursor.execute(
-                "INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
-                (order_id, product_id, quantity, price)
-            )
-            cursor.execute(
-                "UPDATE products SET quantity = quantity - ? WHERE id = ?",
-                (quantity, product_id)
-            )
-        cursor.execute(
-            "UPDATE users SET visit_count = visit_count + 1 WHERE username = ?",
-            (username,)
-        )
-        cursor.execute("DELETE FROM cart WHERE username = ?", (username,))
-        conn.commit()
+        order = Cart.submit_order(username, idempotency_key)
+        if order is None:
+            print("Your cart is empty.")
+            return
+        if order['username'] != username:
+            print("This request key was already used by another customer.")
+            return None
+        Cart.print_order_confirmation(order)
+        return order['order_id']
+
+    @staticmethod
+    def submit_order(username, idempotency_key=None):
+        """Check out the user's cart without prompting.
+
+        Returns the order dict (the original order if idempotency_key was
+        already used), or None if the cart is empty. Raises ValueError if
+        the user does not exist.
+        """
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            order = None
+            if idempotency_key is not None:
+                order = Cart.find_order_by_key(cursor, idempotency_key)
+            if order is None:
+                order = Cart.checkout(cursor, username, idempotency_key)
+            conn.commit()
+        except sqlite3.IntegrityError:
+            # Another connection committed the same key first
+            conn.rollback()
+            order = Cart.find_order_by_key(cursor, idempotency_key)
+            if order is None:
+                conn.close()
+                raise
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+        if order is not None:
+            CATALOG_CACHE.sync(cursor)
         conn.close()
-        
-        print("\n==== Order Placed Successfully! ====")
-        print(f"Order ID: {order_id}")
-        print(f"Order Date: {order_date}")
-        print(f"Total Amount: ${total:.2f}")
-        print(f"Your OTP for order confirmation: {otp}")
-        print("IMPORTANT: Please keep this OTP. The manager will use it to confirm your order delivery.")
-        if discount_applied:
-            print("10% Loyalty Discount Applied!")
-        print("Thank you for shopping with Dollmart!")
+        return order
 
     @staticmethod
     def update_product_availability():
-        """Update product availability by considering items in carts"""
-        conn = sqlite3.connect('dollmart.db')
+        """Update product availability by considering items in carts and queued checkouts"""
+        conn = connect_db()
         cursor = conn.cursor()
-        cursor.execute("SELECT id, quantity FROM products")
-        products = {product[0]: product[1] for product in cursor.fetchall()}
+        products = {product.id: product.quantity for product in CATALOG_CACHE.products(cursor)}
         cursor.execute("""
             SELECT product_id, SUM(quantity) as reserved
-            FROM cart
+            FROM reserved_items
             GROUP BY product_id
         """)
         reserved_items = cursor.fetchall()
@@ -598,13 +2769,92 @@ class Cart:
 
 
 class Order:
+    # Columns of an order's item table
+    ITEM_COLUMNS = [('Name', '{}'), ('Quantity', '{}', '>'), ('Price', '${:.2f}', '>'), ('Subtotal', '${:.2f}', '>')]
+
+    # Row counts and throughput of the most recent confirm_orders_batch() call
+    last_batch_stats = None
+
+    @staticmethod
+    def orders_source(include_archive=False):
+        """Return the SQL table expression for orders, optionally including the archive"""
+        if not include_archive:
+            return "orders"
+        return """(
+            SELECT id, username, total_amount, order_date, otp, status FROM orders
+            UNION ALL
+            SELECT id, username, total_amount, order_date, otp, status FROM orders_archive
+        )"""
+
+    @staticmethod
+    def order_items_source(include_archive=False):
+        """Return the SQL table expression for order_items, optionally including the archive"""
+        if not include_archive:
+            return "order_items"
+        return """(
+            SELECT order_id, product_id, quantity, price FROM order_items
+            UNION ALL
+            SELECT order_id, product_id, quantity, price FROM order_items_archive
+        )"""
+
+    @staticmethod
+    def archive_orders(older_than_days, batch_size=ARCHIVE_BATCH_SIZE):
+        """Move delivered orders older than the cutoff into the archive tables"""
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime("%Y-%m-%d %H:%M:%S")
+        archived_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn = connect_db()
+        cursor = conn.cursor()
+        archived = 0
+        while True:
+            cursor.execute(
+                "SELECT id FROM orders WHERE status = 'delivered' AND order_date < ? ORDER BY id LIMIT ?",
+                (cutoff, batch_size)
+            )
+            order_ids = [row[0] for row in cursor.fetchall()]
+            if not order_ids:
+                break
+            placeholders = ','.join('?' * len(order_ids))
+            cursor.execute(f"""
+                INSERT INTO orders_archive (id, username, total_amount, order_date, otp, status, archived_at,
+                                            idempotency_key)
+                SELECT id, username, total_amount, order_date, otp, status, ?, idempotency_key
+                FROM orders WHERE id IN ({placeholders})
+            """, [archived_at] + order_ids)
+            cursor.execute(f"""
+                INSERT INTO order_items_archive (order_id, product_id, quantity, price)
+                SELECT order_id, product_id, quantity, price
+                FROM order_items WHERE order_id IN ({placeholders})
+            """, order_ids)
+            cursor.execute(f"DELETE FROM order_items WHERE order_id IN ({placeholders})", order_ids)
+            cursor.execute(f"DELETE FROM orders WHERE id IN ({placeholders})", order_ids)
+            conn.commit()
+            archived += len(order_ids)
+        conn.close()
+        return archived
+
     @staticmethod
-    def view_order_history(username):
+    def archive_old_orders():
+        """Prompt for a cutoff and archive delivered orders (manager only)"""
+        while True:
+            try:
+                days = int(input("Archive delivered orders older than how many days? "))
+                if days < 0:
+                    print("Please enter zero or a positive number of days.")
+                    continue
+                break
+            except ValueError:
+                print("Please enter a valid number of days.")
+        archived = Order.archive_orders(days)
+        print(f"Archived {archived} delivered order(s).")
+
+    @staticmethod
+    def view_order_history(username, include_archive=False):
         """View order history for a user"""
-        conn = sqlite3.connect('dollmart.db')
+        conn = connect_db()
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT id, total_amount, order_date, status FROM orders WHERE username = ? ORDER BY order_date DESC",
+            f"SELECT id, total_amount, order_date, status FROM {Order.orders_source(include_archive)} "
+            "WHERE username = ? ORDER BY order_date DESC",
             (username,)
         )
         orders = cursor.fetchall()
@@ -612,41 +2862,40 @@ class Order:
             print("You have no previous orders.")
             conn.close()
             return
-        print("\n=== Your Order History ===")
-        for order in orders:
-            order_id, total_amount, order_date, status = order
-            print(f"\nOrder ID: {order_id}")
-            print(f"Date: {order_date}")
-            print(f"Status: {status.upper()}")
-            print(f"Total Amount: ${total_amount:.2f}")
-            cursor.execute("""
-                SELECT p.name, oi.quantity, oi.price, (oi.quantity * oi.price) as subtotal 
-                FROM order_items oi 
-                JOIN products p ON oi.product_id = p.id 
-                WHERE oi.order_id = ?
-            """, (order_id,))
-            items = cursor.fetchall()
-            print("Items:")
-            print("Name | Quantity | Price | Subtotal")
-            print("-" * 60)
-            for item in items:
-                name, quantity, price, subtotal = item
-                print(f"{name} | {quantity} | ${price:.2f} | ${subtotal:.2f}")
-            print("-" * 60)
+        cursor.execute(f"""
+            SELECT oi.order_id, p.name, oi.quantity, oi.price, (oi.quantity * oi.price) as subtotal 
+            FROM {Order.order_items_source(include_archive)} oi 
+            JOIN products p ON oi.product_id = p.id 
+            WHERE oi.order_id IN (SELECT id FROM {Order.orders_source(include_archive)} WHERE username = ?)
+        """, (username,))
+        items_by_order = {}
+        for order_id, *item in cursor.fetchall():
+            items_by_order.setdefault(order_id, []).append(item)
         conn.close()
+        buffer = io.StringIO()
+        buffer.write("\n=== Your Order History ===\n")
+        for order_id, total_amount, order_date, status in orders:
+            buffer.write(f"\nOrder ID: {order_id}\nDate: {order_date}\nStatus: {status.upper()}\n"
+                         f"Total Amount: ${total_amount:.2f}\nItems:\n")
+            writer = TableWriter(Order.ITEM_COLUMNS, buffer)
+            writer.write_rows(items_by_order.get(order_id, []))
+            writer.finish()
+        show_text(buffer.getvalue())
     
     @staticmethod
-    def view_all_orders():
+    def view_all_orders(include_archive=False):
         """View all orders (manager only)"""
-        conn = sqlite3.connect('dollmart.db')
+        orders_source = Order.orders_source(include_archive)
+        items_source = Order.order_items_source(include_archive)
+        conn = REPORTING_SNAPSHOT.reader()
         cursor = conn.cursor()
         cursor.execute(
-            """
+            f"""
             SELECT o.id, o.username, o.total_amount, o.order_date, 
                    COUNT(oi.product_id) as items_count, 
                    u.customer_type, o.status
-            FROM orders o
-            JOIN order_items oi ON o.id = oi.order_id
+            FROM {orders_source} o
+            JOIN {items_source} oi ON o.id = oi.order_id
             JOIN users u ON o.username = u.username
             GROUP BY o.id
             ORDER BY o.order_date DESC
@@ -657,24 +2906,24 @@ class Order:
             print("No orders found.")
             conn.close()
             return
-        print("\n=== All Orders ===")
-        print("ID | Username | Customer Type | Items | Total | Date | Status")
-        print("-" * 90)
-        for order in orders:
-            order_id, username, total, date, items_count, customer_type, status = order
-            print(f"{order_id} | {username} | {customer_type} | {items_count} | ${total:.2f} | {date} | {status.upper()}")
-        print("-" * 90)
+        TableWriter.render(
+            [('ID', '{}', '>'), ('Username', '{}'), ('Customer Type', '{}'), ('Items', '{}', '>'),
+             ('Total', '${:.2f}', '>'), ('Date', '{}'), ('Status', str.upper)],
+            [(order_id, username, customer_type, items_count, total, date, status)
+             for order_id, username, total, date, items_count, customer_type, status in orders],
+            title="=== All Orders ==="
+        )
         while True:
             view_detail = input("View order details? (y/n): ").lower()
             if view_detail == 'y':
                 try:
                     order_id = int(input("Enter Order ID: "))
-                    cursor.execute("SELECT id FROM orders WHERE id = ?", (order_id,))
+                    cursor.execute(f"SELECT id FROM {orders_source} WHERE id = ?", (order_id,))
                     if not cursor.fetchone():
                         print("Order ID does not exist.")
                         continue
                     cursor.execute(
-                        "SELECT username, total_amount, order_date, status FROM orders WHERE id = ?",
+                        f"SELECT username, total_amount, order_date, status FROM {orders_source} WHERE id = ?",
                         (order_id,)
                     )
                     order_details = cursor.fetchone()
@@ -684,20 +2933,16 @@ class Order:
                     print(f"Date: {date}")
                     print(f"Status: {status.upper()}")
                     print(f"Total: ${total:.2f}")
-                    cursor.execute("""
+                    cursor.execute(f"""
                         SELECT p.name, oi.quantity, oi.price, (oi.quantity * oi.price) as subtotal 
-                        FROM order_items oi 
+                        FROM {items_source} oi 
                         JOIN products p ON oi.product_id = p.id 
                         WHERE oi.order_id = ?
                     """, (order_id,))
                     items = cursor.fetchall()
                     print("Items:")
-                    print("Name | Quantity | Price | Subtotal")
-                    print("-" * 60)
-                    for item in items:
-                        name, quantity, price, subtotal = item
-                        print(f"{name} | {quantity} | ${price:.2f} | ${subtotal:.2f}")
-                    print("-" * 60)
+                    TableWriter.render(Order.ITEM_COLUMNS, items)
+                    Order.view_order_events(order_id)
                 except ValueError:
                     print("Please enter a valid Order ID.")
             elif view_detail == 'n':
@@ -705,19 +2950,144 @@ class Order:
             else:
                 print("Please enter 'y' or 'n'.")
         conn.close()
-    
+    
+    @staticmethod
+    def apply_transition(cursor, order_ids, new_status, note=None):
+        """Move orders to new_status inside the caller's transaction.
+
+        Returns (changed_ids, errors) where errors maps order_id to a message.
+        Cancelling or returning an order puts its items back into stock.
+        """
+        if new_status not in ORDER_TRANSITIONS:
+            raise ValueError(f"Unknown order status: {new_status}")
+        order_ids = list(dict.fromkeys(order_ids))
+        current = {}
+        for chunk in chunked(order_ids):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"SELECT id, status FROM orders WHERE id IN ({placeholders})", chunk)
+            current.update(cursor.fetchall())
+        changed = []
+        errors = {}
+        for order_id in order_ids:
+            status = current.get(order_id)
+            if status is None:
+                errors[order_id] = "Order ID does not exist."
+            elif new_status not in ORDER_TRANSITIONS.get(status, ()):
+                errors[order_id] = f"Cannot change status from {status} to {new_status}."
+            else:
+                changed.append((order_id, status))
+        changed_ids = [order_id for order_id, _ in changed]
+        if new_status in STOCK_RESTORING_STATUSES:
+            restock = []
+            for chunk in chunked(changed_ids):
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f"""
+                    SELECT product_id, SUM(quantity) FROM order_items
+                    WHERE order_id IN ({placeholders})
+                    GROUP BY product_id
+                """, chunk)
+                restock.extend((quantity, product_id) for product_id, quantity in cursor.fetchall())
+            cursor.executemany("UPDATE products SET quantity = quantity + ? WHERE id = ?", restock)
+            for chunk in chunked(changed_ids):
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f"""
+                    SELECT substr(o.order_date, 1, 10), oi.product_id, SUM(oi.quantity)
+                    FROM order_items oi JOIN orders o ON o.id = oi.order_id
+                    WHERE oi.order_id IN ({placeholders})
+                    GROUP BY 1, 2
+                """, chunk)
+                for day, product_id, quantity in cursor.fetchall():
+                    Product.record_sales(cursor, day, [(product_id, quantity)], sign=-1)
+        changed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.executemany("UPDATE orders SET status = ? WHERE id = ?",
+                           [(new_status, order_id) for order_id in changed_ids])
+        if new_status in STOCK_RESTORING_STATUSES:
+            Order.remove_customer_orders(cursor, changed_ids)
+        cursor.executemany(
+            "INSERT INTO order_events (order_id, from_status, to_status, changed_at, note) VALUES (?, ?, ?, ?, ?)",
+            [(order_id, status, new_status, changed_at, note) for order_id, status in changed]
+        )
+        OrderOutbox.add_events(cursor, 'order_status_changed', [
+            (order_id, {'order_id': order_id, 'from_status': status, 'to_status': new_status, 'note': note})
+            for order_id, status in changed
+        ], changed_at)
+        return changed_ids, errors
+
+    @staticmethod
+    def transition_orders(order_ids, new_status, note=None):
+        """Change the status of one or more orders in a single transaction"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            changed_ids, errors = Order.apply_transition(cursor, order_ids, new_status, note)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+        if new_status in STOCK_RESTORING_STATUSES:
+            CATALOG_CACHE.sync(cursor)
+        conn.close()
+        return changed_ids, errors
+
+    @staticmethod
+    def update_order_status():
+        """Change the status of one or more orders (manager only)"""
+        while True:
+            try:
+                order_ids = [int(value) for value in input("Enter Order ID(s), separated by commas: ").split(',')
+                             if value.strip()]
+                if not order_ids:
+                    print("Please enter at least one Order ID.")
+                    continue
+                break
+            except ValueError:
+                print("Please enter valid Order IDs.")
+        print(f"Statuses: {', '.join(ORDER_TRANSITIONS)}")
+        while True:
+            new_status = input("Enter new status: ").strip().lower()
+            if new_status in ORDER_TRANSITIONS:
+                break
+            print("Invalid status. Please try again.")
+        note = input("Note (optional): ").strip() or None
+        changed_ids, errors = Order.transition_orders(order_ids, new_status, note)
+        for order_id in changed_ids:
+            print(f"Order #{order_id} is now {new_status.upper()}.")
+        for order_id, message in errors.items():
+            print(f"Order #{order_id}: {message}")
+
+    @staticmethod
+    def view_order_events(order_id):
+        """Print the status history of an order"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT from_status, to_status, changed_at, note FROM order_events WHERE order_id = ? ORDER BY id",
+            (order_id,)
+        )
+        events = cursor.fetchall()
+        conn.close()
+        if not events:
+            return
+        print("Status History:")
+        for from_status, to_status, changed_at, note in events:
+            transition = f"{from_status.upper()} -> {to_status.upper()}" if from_status else to_status.upper()
+            print(f"{changed_at} | {transition}{f' ({note})' if note else ''}")
+
     @staticmethod
     def confirm_order():
         """Confirm order delivery by verifying OTP"""
-        conn = sqlite3.connect('dollmart.db')
+        conn = connect_db()
         cursor = conn.cursor()
         cursor.execute(
             """
             SELECT id, username, order_date, total_amount
             FROM orders 
-            WHERE status = 'placed'
+            WHERE status IN (?, ?, ?)
             ORDER BY order_date ASC
-            """
+            """,
+            PENDING_STATUSES
         )
         pending_orders = cursor.fetchall()
         if not pending_orders:
@@ -736,7 +3106,12 @@ class Order:
         while True:
             try:
                 order_id = int(input("Enter Order ID to confirm delivery: "))
-                cursor.execute("SELECT id, otp FROM orders WHERE id = ? AND status = 'placed'", (order_id,))
+                if not OTP_LIMITER.acquire(order_id):
+                    print("Too many OTP attempts for this order. Please try again later.")
+                    conn.close()
+                    return
+                cursor.execute("SELECT id, otp FROM orders WHERE id = ? AND status IN (?, ?, ?)",
+                               (order_id,) + PENDING_STATUSES)
                 order_data = cursor.fetchone()
                 if not order_data:
                     print("Invalid Order ID or order is already delivered.")
@@ -748,41 +3123,502 @@ class Order:
         otp = input("Enter OTP provided by the customer: ")
         
         if otp == order_data[1]:
-            cursor.execute("UPDATE orders SET status = 'delivered' WHERE id = ?", (order_id,))
+            cursor.execute("BEGIN IMMEDIATE")
+            changed_ids, errors = Order.apply_transition(cursor, [order_id], 'delivered', note="OTP verified")
             conn.commit()
-            print(f"Order #{order_id} has been confirmed as delivered!")
+            if changed_ids:
+                OTP_LIMITER.reset(order_id)
+                print(f"Order #{order_id} has been confirmed as delivered!")
+            else:
+                print(f"Error: {errors[order_id]}")
         else:
             print("Invalid OTP. Order status not updated.")
             
         conn.close()
     
     @staticmethod
-    def view_all_customers():
-        """View all customers (manager only)"""
-        conn = sqlite3.connect('dollmart.db')
+    def confirm_orders_batch(rows):
+        """Confirm many deliveries in one transaction.
+
+        rows is an iterable of (order_id, otp) pairs, e.g. csv.reader output.
+        Returns a list of (line_number, order_id, confirmed, message) tuples.
+        """
+        start = time.perf_counter()
+        parsed = []
+        results = []
+        for line_number, row in enumerate(rows, start=1):
+            row = [str(field).strip() for field in row]
+            if not any(row):
+                continue
+            try:
+                order_id, otp = row
+                order_id = int(order_id)
+            except ValueError:
+                results.append((line_number, None, False, "Malformed row; expected order_id,otp."))
+                continue
+            if OTP_LIMITER.acquire(order_id):
+                parsed.append((line_number, order_id, otp))
+            else:
+                results.append((line_number, order_id, False, "Too many OTP attempts; try again later."))
+        conn = connect_db()
         cursor = conn.cursor()
+        order_ids = list(dict.fromkeys(order_id for _, order_id, _ in parsed))
+        cursor.execute("BEGIN IMMEDIATE")
+        pending = {}
+        for chunk in chunked(order_ids):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"SELECT id, otp FROM orders WHERE id IN ({placeholders}) AND status IN (?, ?, ?)",
+                           chunk + list(PENDING_STATUSES))
+            pending.update(cursor.fetchall())
+        confirmed = []
+        for line_number, order_id, otp in parsed:
+            if order_id not in pending:
+                results.append((line_number, order_id, False, "Invalid Order ID or order is already delivered."))
+            elif otp != pending[order_id]:
+                results.append((line_number, order_id, False, "Invalid OTP."))
+            else:
+                del pending[order_id]
+                confirmed.append(order_id)
+                results.append((line_number, order_id, True, "Confirmed as delivered."))
+        Order.apply_transition(cursor, confirmed, 'delivered', note="OTP verified (batch)")
+        conn.commit()
+        conn.close()
+        for order_id in confirmed:
+            OTP_LIMITER.reset(order_id)
+        results.sort(key=lambda result: result[0])
+        elapsed = time.perf_counter() - start
+        Order.last_batch_stats = {
+            'rows': len(results),
+            'confirmed': len(confirmed),
+            'seconds': elapsed,
+            'rows_per_second': len(results) / elapsed if elapsed > 0 else 0.0,
+        }
+        return results
+
+    @staticmethod
+    def batch_confirm_orders():
+        """Confirm deliveries from a file or pasted order_id,otp lines (manager only)"""
+        import csv
+        path = input("Enter path to a CSV file of order_id,otp rows (or '-' to paste rows, blank line to finish): ")
+        if path.strip() == '-':
+            lines = []
+            while True:
+                line = input()
+                if not line.strip():
+                    break
+                lines.append(line)
+            results = Order.confirm_orders_batch(csv.reader(lines))
+        else:
+            try:
+                with open(path.strip(), newline='') as batch_file:
+                    results = Order.confirm_orders_batch(csv.reader(batch_file))
+            except OSError as e:
+                print(f"Could not read batch file: {e}")
+                return
+        if not results:
+            print("No rows to confirm.")
+            return
+        print("\n=== Batch Confirmation Results ===")
+        for line_number, order_id, confirmed, message in results:
+            label = f"Order #{order_id}" if order_id is not None else "Row"
+            print(f"Line {line_number}: {label} - {'OK' if confirmed else 'FAILED'} - {message}")
+        stats = Order.last_batch_stats
+        print(f"Confirmed {stats['confirmed']} of {stats['rows']} rows in {stats['seconds'] * 1000:.1f} ms "
+              f"({stats['rows_per_second']:.0f} rows/s).")
+
+    @staticmethod
+    def record_customer_order(cursor, username, item_count, total, order_date):
+        """Add a placed order to the customer's customer_stats row inside the caller's transaction"""
+        cursor.execute("""
+            INSERT INTO customer_stats (username, order_count, item_count, lifetime_spend, last_order_date)
+            VALUES (?, 1, ?, ?, ?)
+            ON CONFLICT (username) DO UPDATE SET
+                order_count = order_count + 1,
+                item_count = item_count + excluded.item_count,
+                lifetime_spend = lifetime_spend + excluded.lifetime_spend,
+                last_order_date = MAX(COALESCE(last_order_date, ''), excluded.last_order_date)
+        """, (username, item_count, total, order_date))
+
+    @staticmethod
+    def remove_customer_orders(cursor, order_ids):
+        """Take cancelled or returned orders back out of their customers' customer_stats rows"""
+        placeholders_status = ','.join('?' * len(STOCK_RESTORING_STATUSES))
+        for chunk in chunked(order_ids):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"""
+                SELECT o.username, COUNT(*), COALESCE(SUM(i.units), 0), COALESCE(SUM(o.total_amount), 0)
+                FROM orders o
+                LEFT JOIN (
+                    SELECT order_id, SUM(quantity) AS units FROM order_items
+                    WHERE order_id IN ({placeholders})
+                    GROUP BY order_id
+                ) i ON i.order_id = o.id
+                WHERE o.id IN ({placeholders})
+                GROUP BY o.username
+            """, chunk + chunk)
+            for username, order_count, item_count, spend in cursor.fetchall():
+                cursor.execute(f"""
+                    UPDATE customer_stats SET
+                        order_count = order_count - ?,
+                        item_count = item_count - ?,
+                        lifetime_spend = lifetime_spend - ?,
+                        last_order_date = (
+                            SELECT MAX(order_date) FROM (
+                                SELECT order_date, status FROM orders WHERE username = ?
+                                UNION ALL
+                                SELECT order_date, status FROM orders_archive WHERE username = ?
+                            ) WHERE status NOT IN ({placeholders_status})
+                        )
+                    WHERE username = ?
+                """, (order_count, item_count, spend, username, username) + STOCK_RESTORING_STATUSES + (username,))
+
+    @staticmethod
+    def rebuild_customer_stats(cursor):
+        """Recompute customer_stats from live and archived orders that were not cancelled or returned"""
+        cursor.execute("DELETE FROM customer_stats")
+        placeholders = ','.join('?' * len(STOCK_RESTORING_STATUSES))
+        cursor.execute(f"""
+            INSERT INTO customer_stats (username, order_count, item_count, lifetime_spend, last_order_date)
+            SELECT o.username, COUNT(*), COALESCE(SUM(i.units), 0), COALESCE(SUM(o.total_amount), 0), MAX(o.order_date)
+            FROM (
+                SELECT id, username, total_amount, order_date, status FROM orders
+                UNION ALL
+                SELECT id, username, total_amount, order_date, status FROM orders_archive
+            ) o
+            LEFT JOIN (
+                SELECT order_id, SUM(quantity) AS units FROM (
+                    SELECT order_id, quantity FROM order_items
+                    UNION ALL
+                    SELECT order_id, quantity FROM order_items_archive
+                )
+                GROUP BY order_id
+            ) i ON i.order_id = o.id
+            WHERE o.username IS NOT NULL AND o.status NOT IN ({placeholders})
+            GROUP BY o.username
+        """, STOCK_RESTORING_STATUSES)
+
+    @staticmethod
+    def customer_summary(cursor, username):
+        """Return a customer's lifetime order aggregates and loyalty tier"""
         cursor.execute(
-            """
-            SELECT username, customer_type, visit_count, 
-                   (SELECT COUNT(*) FROM orders WHERE orders.username = users.username) as orders_count
-            FROM users
-            WHERE role = 'customer'
-            ORDER BY orders_count DESC
-            """
+            "SELECT order_count, item_count, lifetime_spend, last_order_date FROM customer_stats WHERE username = ?",
+            (username,)
         )
+        order_count, item_count, lifetime_spend, last_order_date = cursor.fetchone() or (0, 0, 0.0, None)
+        return {'username': username, 'order_count': order_count, 'item_count': item_count,
+                'lifetime_spend': lifetime_spend, 'last_order_date': last_order_date,
+                'average_basket': lifetime_spend / order_count if order_count else 0.0,
+                'tier': loyalty_tier(order_count, lifetime_spend)}
+
+    @staticmethod
+    def view_customer_summary(username):
+        """Show a customer their lifetime totals and loyalty tier"""
+        conn = connect_db()
+        summary = Order.customer_summary(conn.cursor(), username)
+        conn.close()
+        print(f"\n=== Account Summary ({username}) ===")
+        print(f"Orders: {summary['order_count']}")
+        print(f"Lifetime Spend: ${summary['lifetime_spend']:.2f}")
+        print(f"Average Basket: ${summary['average_basket']:.2f}")
+        print(f"Last Order: {summary['last_order_date'] or '-'}")
+        print(f"Loyalty Tier: {summary['tier'] or 'None yet'}")
+        for name, min_orders, min_spend in reversed(LOYALTY_TIERS):
+            if summary['order_count'] < min_orders and summary['lifetime_spend'] < min_spend:
+                print(f"Next tier: {name} at {min_orders} orders or ${min_spend:.2f} spent")
+                break
+
+    @staticmethod
+    def view_all_customers():
+        """View all customers with their lifetime totals (manager only)"""
+        conn = REPORTING_SNAPSHOT.reader()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT u.username, u.customer_type, u.visit_count, COALESCE(s.order_count, 0),
+                   COALESCE(s.lifetime_spend, 0), s.last_order_date
+            FROM users u
+            LEFT JOIN customer_stats s ON s.username = u.username
+            WHERE u.role = 'customer'
+            ORDER BY COALESCE(s.order_count, 0) DESC, u.username
+        """)
         customers = cursor.fetchall()
+        conn.close()
         if not customers:
             print("No customers found.")
-            conn.close()
             return
-        print("\n=== All Customers ===")
-        print("Username | Type | Visit Count | Orders Count")
-        print("-" * 60)
-        for customer in customers:
-            username, customer_type, visit_count, orders_count = customer
-            print(f"{username} | {customer_type} | {visit_count} | {orders_count}")
-        print("-" * 60)
+        TableWriter.render(
+            [('Username', '{}'), ('Type', '{}'), ('Tier', '{}'), ('Visit Count', '{}', '>'),
+             ('Orders Count', '{}', '>'), ('Lifetime Spend', '${:.2f}', '>'), ('Average Basket', '${:.2f}', '>'),
+             ('Last Order', '{}')],
+            [(username, customer_type, loyalty_tier(orders_count, spend) or '-', visit_count, orders_count, spend,
+              spend / orders_count if orders_count else 0.0, last_order_date or '-')
+             for username, customer_type, visit_count, orders_count, spend, last_order_date in customers],
+            title="=== All Customers ==="
+        )
+
+
+class OrderOutbox:
+    """Transactional outbox of order events with checkpointed consumers.
+
+    Events are written by the same transaction that changes the order, so a
+    consumer never sees an event for an order that was rolled back. Each
+    consumer's position is stored in outbox_offsets.
+    """
+    @staticmethod
+    def add_events(cursor, event_type, events, created_at):
+        """Append (order_id, payload) events inside the caller's transaction"""
+        cursor.executemany(
+            "INSERT INTO order_outbox (event_type, order_id, payload, created_at) VALUES (?, ?, ?, ?)",
+            [(event_type, order_id, json.dumps(payload), created_at) for order_id, payload in events]
+        )
+
+    @staticmethod
+    def get_offset(consumer):
+        """Return the id of the last event acknowledged by consumer"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT last_id FROM outbox_offsets WHERE consumer = ?", (consumer,))
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else 0
+
+    @staticmethod
+    def fetch(consumer, batch_size=100):
+        """Return up to batch_size events after the consumer's checkpoint"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, event_type, order_id, payload, created_at
+            FROM order_outbox
+            WHERE id > COALESCE((SELECT last_id FROM outbox_offsets WHERE consumer = ?), 0)
+            ORDER BY id
+            LIMIT ?
+        """, (consumer, batch_size))
+        rows = cursor.fetchall()
+        conn.close()
+        return [
+            {'id': row[0], 'event_type': row[1], 'order_id': row[2], 'payload': json.loads(row[3]),
+             'created_at': row[4]}
+            for row in rows
+        ]
+
+    @staticmethod
+    def acknowledge(consumer, last_id):
+        """Move the consumer's checkpoint forward to last_id"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO outbox_offsets (consumer, last_id, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (consumer) DO UPDATE SET
+                last_id = MAX(last_id, excluded.last_id),
+                updated_at = excluded.updated_at
+        """, (consumer, last_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def stream(consumer, batch_size=100, poll_interval=None):
+        """Yield batches of events, checkpointing each batch once the caller asks for the next.
+
+        With poll_interval=None the stream ends when the consumer has caught up;
+        otherwise it keeps tailing the outbox, sleeping between empty polls.
+        """
+        while True:
+            batch = OrderOutbox.fetch(consumer, batch_size)
+            if not batch:
+                if poll_interval is None:
+                    return
+                time.sleep(poll_interval)
+                continue
+            yield batch
+            OrderOutbox.acknowledge(consumer, batch[-1]['id'])
+
+    @staticmethod
+    def prune():
+        """Delete events that every registered consumer has acknowledged"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT MIN(last_id) FROM outbox_offsets")
+        low_water_mark = cursor.fetchone()[0]
+        deleted = 0
+        if low_water_mark:
+            cursor.execute("DELETE FROM order_outbox WHERE id <= ?", (low_water_mark,))
+            deleted = cursor.rowcount
+            conn.commit()
         conn.close()
+        return deleted
+
+
+class _BackupRestarted(Exception):
+    """Raised from the backup progress callback to stop a paged copy that keeps restarting"""
+
+
+class DatabaseBackup:
+    """Online backup, verification and point-in-time restore of dollmart.db"""
+
+    @staticmethod
+    def backup(backup_dir=BACKUP_DIR, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP, progress=None,
+               max_restarts=BACKUP_MAX_RESTARTS):
+        """Copy the live database into a timestamped file in backup_dir.
+
+        The sqlite3 backup API copies `pages` pages per step. Connection.backup
+        itself only waits after a BUSY or LOCKED step, so the progress callback
+        sleeps `sleep` seconds after every step that leaves pages to copy; the
+        source is unlocked during the pause, so checkout writers get in while a
+        large copy runs. A write by another connection restarts the copy; after max_restarts the
+        rest is copied in one step, briefly holding writers off, so busy stores
+        still get a backup. progress(status, remaining, total) is called after
+        each step. The copy is verified before it is given its final name.
+        Returns a stats dict.
+        """
+        os.makedirs(backup_dir, exist_ok=True)
+        taken_at = datetime.now()
+        path = os.path.join(backup_dir, f"dollmart-{taken_at.strftime(BACKUP_TIME_FORMAT)}.db")
+        temp_path = path + '.tmp'
+        start = time.perf_counter()
+        restarts = 0
+        last_remaining = None
+
+        def step(status, remaining, total):
+            nonlocal restarts, last_remaining
+            # A successful step that made no headway means the copy started over
+            if status == sqlite3.SQLITE_OK and last_remaining is not None and remaining >= last_remaining:
+                restarts += 1
+                if restarts > max_restarts:
+                    raise _BackupRestarted()
+            last_remaining = remaining
+            if progress:
+                progress(status, remaining, total)
+            if remaining and sleep:
+                time.sleep(sleep)
+
+        source = connect_db()
+        target = sqlite3.connect(temp_path)
+        try:
+            try:
+                source.backup(target, pages=pages, progress=step, sleep=sleep)
+            except _BackupRestarted:
+                source.backup(target, pages=-1, progress=progress)
+        finally:
+            target.close()
+            source.close()
+        problems = DatabaseBackup.verify(temp_path)
+        if problems:
+            os.remove(temp_path)
+            raise sqlite3.DatabaseError(f"Backup failed integrity check: {problems[0]}")
+        os.replace(temp_path, path)
+        seconds = time.perf_counter() - start
+        size = os.path.getsize(path)
+        return {
+            'path': path,
+            'taken_at': taken_at,
+            'restarts': restarts,
+            'bytes': size,
+            'seconds': seconds,
+            'mb_per_second': size / 1e6 / seconds if seconds else 0.0,
+        }
+
+    @staticmethod
+    def verify(path):
+        """Run PRAGMA integrity_check on a database file; returns a list of problems"""
+        conn = sqlite3.connect(path)
+        try:
+            results = [row[0] for row in conn.execute("PRAGMA integrity_check").fetchall()]
+        except sqlite3.DatabaseError as e:
+            results = [str(e)]
+        finally:
+            conn.close()
+        return [] if results == ['ok'] else results
+
+    @staticmethod
+    def list_backups(backup_dir=BACKUP_DIR):
+        """Return (taken_at, path) for each backup in backup_dir, oldest first"""
+        if not os.path.isdir(backup_dir):
+            return []
+        backups = []
+        for name in os.listdir(backup_dir):
+            if not (name.startswith('dollmart-') and name.endswith('.db')):
+                continue
+            try:
+                taken_at = datetime.strptime(name[len('dollmart-'):-len('.db')], BACKUP_TIME_FORMAT)
+            except ValueError:
+                continue
+            backups.append((taken_at, os.path.join(backup_dir, name)))
+        return sorted(backups)
+
+    @staticmethod
+    def restore(path=None, at=None, backup_dir=BACKUP_DIR, pages=BACKUP_PAGES_PER_STEP, progress=None):
+        """Restore the live database from a backup file.
+
+        With no path, the latest backup taken at or before `at` (default: now)
+        is used. The backup is verified first and copied in through the backup
+        API, so open connections see either the old or the restored database.
+        Returns the path restored from, or None if no backup matched.
+        """
+        if path is None:
+            at = at or datetime.now()
+            candidates = [p for taken_at, p in DatabaseBackup.list_backups(backup_dir) if taken_at <= at]
+            if not candidates:
+                return None
+            path = candidates[-1]
+        problems = DatabaseBackup.verify(path)
+        if problems:
+            raise sqlite3.DatabaseError(f"Backup failed integrity check: {problems[0]}")
+        source = sqlite3.connect(path)
+        target = connect_db()
+        try:
+            source.backup(target, pages=pages, progress=progress)
+            # New instance id so catalog caches reload instead of replaying a rewound change log
+            target.execute("UPDATE store_meta SET value = ? WHERE key = 'instance_id'", (uuid.uuid4().hex,))
+            target.commit()
+        finally:
+            target.close()
+            source.close()
+        return path
+
+    @staticmethod
+    def backup_database():
+        """Take an online backup (manager only)"""
+        def report(status, remaining, total):
+            if total:
+                print(f"\rCopied {total - remaining}/{total} pages", end='')
+        try:
+            stats = DatabaseBackup.backup(progress=report)
+        except sqlite3.Error as e:
+            print(f"\nBackup failed: {e}")
+            return
+        print(f"\nBackup written to {stats['path']} ({stats['bytes'] / 1e6:.1f} MB, "
+              f"{stats['mb_per_second']:.1f} MB/s), integrity check passed.")
+
+    @staticmethod
+    def restore_database():
+        """Restore the database from a backup (manager only)"""
+        backups = DatabaseBackup.list_backups()
+        if not backups:
+            print("No backups found.")
+            return
+        print("\n=== Backups ===")
+        for taken_at, path in backups:
+            print(f"{taken_at.strftime('%Y-%m-%d %H:%M:%S')} | {path}")
+        value = input("Restore state as of (YYYY-MM-DD HH:MM:SS, blank for latest): ").strip()
+        at = None
+        if value:
+            try:
+                at = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+            except ValueError:
+                print("Invalid date format.")
+                return
+        if input("This replaces the current database. Continue? (y/n): ").lower() != 'y':
+            print("Restore cancelled.")
+            return
+        try:
+            path = DatabaseBackup.restore(at=at)
+        except sqlite3.Error as e:
+            print(f"Restore failed: {e}")
+            return
+        if path is None:
+            print("No backup taken at or before that time.")
+        else:
+            print(f"Database restored from {path}.")
 
 
 def manager_menu():
@@ -796,8 +3632,17 @@ def manager_menu():
         print("5. View All Customers")
         print("6. View All Orders")
         print("7. Confirm Order Delivery")
-        print("8. Logout")
-        choice = input("Enter your choice (1-8): ")
+        print("8. View All Orders (Including Archive)")
+        print("9. Archive Delivered Orders")
+        print("10. Batch Confirm Deliveries")
+        print("11. Update Order Status")
+        print(f"12. Toggle Reporting Mode (currently {'on' if REPORTING_SNAPSHOT.enabled else 'off'})")
+        print("13. Back Up Database")
+        print("14. Restore Database From Backup")
+        print("15. Build Recommendations From Past Orders")
+        print("16. Restock Report")
+        print("17. Logout")
+        choice = input("Enter your choice (1-17): ")
         if choice == '1':
             Product.add_product()
         elif choice == '2':
@@ -813,6 +3658,24 @@ def manager_menu():
         elif choice == '7':
             Order.confirm_order()
         elif choice == '8':
+            Order.view_all_orders(include_archive=True)
+        elif choice == '9':
+            Order.archive_old_orders()
+        elif choice == '10':
+            Order.batch_confirm_orders()
+        elif choice == '11':
+            Order.update_order_status()
+        elif choice == '12':
+            toggle_reporting_mode()
+        elif choice == '13':
+            DatabaseBackup.backup_database()
+        elif choice == '14':
+            DatabaseBackup.restore_database()
+        elif choice == '15':
+            Product.build_recommendations()
+        elif choice == '16':
+            Product.view_restock_report()
+        elif choice == '17':
             print("Logging out...")
             break
         else:
@@ -830,8 +3693,19 @@ def customer_menu(user):
         print("5. View Cart")
         print("6. Place Order")
         print("7. View Order History")
-        print("8. Logout")
-        choice = input("Enter your choice (1-8): ")
+        print("8. Filter Products")
+        print("9. Browse Products")
+        print("10. View Full Order History (Including Archive)")
+        print("11. Bulk Update Cart")
+        print("12. Clear Cart")
+        print("13. Reorder Past Order")
+        print("14. Saved Baskets")
+        print("15. Queue Order (Asynchronous Checkout)")
+        print("16. View Queued Orders")
+        print("17. View Product Details")
+        print("18. Account Summary")
+        print("19. Logout")
+        choice = input("Enter your choice (1-19): ")
         if choice == '1':
             Product.view_all_products()
         elif choice == '2':
@@ -847,15 +3721,684 @@ def customer_menu(user):
         elif choice == '7':
             Order.view_order_history(user.username)
         elif choice == '8':
+            Product.filter_products()
+        elif choice == '9':
+            Product.browse_products()
+        elif choice == '10':
+            Order.view_order_history(user.username, include_archive=True)
+        elif choice == '11':
+            Cart.bulk_update_cart(user.username)
+        elif choice == '12':
+            removed = Cart.clear_cart(user.username)
+            print(f"Removed {removed} item(s) from your cart.")
+        elif choice == '13':
+            Cart.reorder_past_order(user.username)
+        elif choice == '14':
+            Cart.manage_saved_baskets(user.username)
+        elif choice == '15':
+            CheckoutQueue.queue_order(user.username)
+        elif choice == '16':
+            CheckoutQueue.view_jobs(user.username)
+        elif choice == '17':
+            Product.view_product()
+        elif choice == '18':
+            Order.view_customer_summary(user.username)
+        elif choice == '19':
             print("Logging out...")
             break
         else:
             print("Invalid choice. Please try again.")
 
 
-def main():
+class _CartWrite:
+    """One session's pending cart write and its outcome"""
+    __slots__ = ('statements', 'done', 'error')
+
+    def __init__(self, statements):
+        self.statements = statements
+        self.done = threading.Event()
+        self.error = None
+
+
+class CartWriteBuffer:
+    """Group commit for cart writes from many sessions.
+
+    A writer thread takes the first pending write, waits up to window_ms
+    for more, applies each write under its own savepoint and commits them
+    together. submit() blocks until the commit covering its write is done,
+    so a session always reads its own writes. Each write that shares a
+    commit saves one fsync.
+    """
+
+    def __init__(self, window_ms=CART_COMMIT_WINDOW_MS, max_writes=CART_COMMIT_MAX_WRITES):
+        self.window = window_ms / 1000
+        self.max_writes = max_writes
+        self.writes = 0
+        self.commits = 0
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='cart-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, statements):
+        """Apply a list of (sql, params) as one unit and wait for it to be committed"""
+        write = _CartWrite(statements)
+        self._pending.put(write)
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+
+    def stats(self):
+        """Writes applied, commits made and fsyncs saved compared with one commit per write"""
+        return {'writes': self.writes, 'commits': self.commits, 'fsyncs_saved': self.writes - self.commits}
+
+    def close(self):
+        """Commit what is pending and stop the writer thread"""
+        self._pending.put(None)
+        self._thread.join()
+
+    def _run(self):
+        conn = connect_db()
+        stopping = False
+        while not stopping:
+            first = self._pending.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_writes:
+                remaining = deadline - time.monotonic()
+                try:
+                    write = self._pending.get(timeout=remaining) if remaining > 0 else self._pending.get_nowait()
+                except queue.Empty:
+                    break
+                if write is None:
+                    stopping = True
+                    break
+                batch.append(write)
+            self._apply(conn, batch)
+        conn.close()
+
+    def _apply(self, conn, batch):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for write in batch:
+                cursor.execute("SAVEPOINT cart_write")
+                try:
+                    for sql, params in write.statements:
+                        cursor.execute(sql, params)
+                    cursor.execute("RELEASE cart_write")
+                except sqlite3.Error as e:
+                    cursor.execute("ROLLBACK TO cart_write")
+                    cursor.execute("RELEASE cart_write")
+                    write.error = e
+            conn.commit()
+            self.commits += 1
+            self.writes += sum(1 for write in batch if write.error is None)
+        except sqlite3.Error as e:
+            conn.rollback()
+            for write in batch:
+                write.error = write.error or e
+        for write in batch:
+            write.done.set()
+
+
+CART_WRITE_BUFFER = None
+
+
+class CheckoutQueue:
+    """Durable checkout queue drained by worker processes.
+
+    submit() records a job in checkout_jobs, moves the cart lines into
+    checkout_job_items and returns at once; while queued, those lines stay
+    reserved through the reserved_items view. Workers claim a batch of queued
+    jobs and run Cart.checkout on each job's lines under its own savepoint,
+    all inside one transaction, so a batch of orders costs one commit. Jobs
+    that place no order give their lines back to the cart. A worker that dies mid-batch rolls back and its jobs stay queued;
+    each job carries an idempotency key, so it is never placed twice.
+    """
+
+    @staticmethod
+    def submit(username, idempotency_key=None):
+        """Queue a checkout of the user's cart and return the job id.
+
+        The cart lines are copied to the job and the cart emptied in the same
+        transaction, so the worker places exactly what was submitted. A key
+        the user already queued returns that job. Returns None, queueing
+        nothing, if the cart is empty.
+        """
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if idempotency_key is not None:
+                cursor.execute("SELECT id FROM checkout_jobs WHERE idempotency_key = ? AND username = ? "
+                               "ORDER BY id LIMIT 1", (idempotency_key, username))
+                row = cursor.fetchone()
+                if row:
+                    conn.rollback()
+                    conn.close()
+                    return row[0]
+            cursor.execute("SELECT 1 FROM cart WHERE username = ? LIMIT 1", (username,))
+            if cursor.fetchone() is None:
+                conn.rollback()
+                conn.close()
+                return None
+            cursor.execute(
+                "INSERT INTO checkout_jobs (username, idempotency_key, submitted_at) VALUES (?, ?, ?)",
+                (username, idempotency_key or f"job-{uuid.uuid4().hex}", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+            job_id = cursor.lastrowid
+            cursor.execute(
+                "INSERT INTO checkout_job_items (job_id, product_id, quantity) "
+                "SELECT ?, product_id, quantity FROM cart WHERE username = ?",
+                (job_id, username)
+            )
+            cursor.execute("DELETE FROM cart WHERE username = ?", (username,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+        conn.close()
+        return job_id
+
+    @staticmethod
+    def status(job_id):
+        """Return a dict describing the job, or None if it does not exist"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, username, status, order_id, error, submitted_at, finished_at
+            FROM checkout_jobs WHERE id = ?
+        """, (job_id,))
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return None
+        return {'job_id': row[0], 'username': row[1], 'status': row[2], 'order_id': row[3], 'error': row[4],
+                'submitted_at': row[5], 'finished_at': row[6]}
+
+    @staticmethod
+    def wait(job_id, timeout=10.0, poll_interval=0.01):
+        """Poll until the job is finished or timeout passes; returns its latest status"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = CheckoutQueue.status(job_id)
+            if job is None or job['status'] != 'queued' or time.monotonic() >= deadline:
+                return job
+            time.sleep(poll_interval)
+
+    @staticmethod
+    def process_batch(batch_size=CHECKOUT_BATCH_SIZE):
+        """Claim and run up to batch_size queued jobs in one transaction; returns how many ran"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("SELECT id, username, idempotency_key FROM checkout_jobs WHERE status = 'queued' "
+                           "ORDER BY id LIMIT ?", (batch_size,))
+            jobs = cursor.fetchall()
+            job_items = {job_id: [] for job_id, _, _ in jobs}
+            for chunk in chunked(list(job_items)):
+                cursor.execute(f"SELECT job_id, product_id, quantity FROM checkout_job_items "
+                               f"WHERE job_id IN ({','.join('?' * len(chunk))})", chunk)
+                for job_id, product_id, quantity in cursor.fetchall():
+                    job_items[job_id].append((product_id, quantity))
+            results = []
+            for job_id, username, idempotency_key in jobs:
+                cursor.execute("SAVEPOINT checkout_job")
+                try:
+                    order = Cart.find_order_by_key(cursor, idempotency_key)
+                    if order is not None and order['username'] != username:
+                        raise ValueError("This request key was already used by another customer.")
+                    if order is None:
+                        order = Cart.checkout(cursor, username, idempotency_key, job_items[job_id])
+                    cursor.execute("RELEASE checkout_job")
+                except Exception as e:
+                    # One bad job must not hold up the rest of the batch
+                    cursor.execute("ROLLBACK TO checkout_job")
+                    cursor.execute("RELEASE checkout_job")
+                    results.append(('failed', None, str(e), job_id))
+                    continue
+                if order is None:
+                    results.append(('failed', None, "Cart is empty.", job_id))
+                else:
+                    results.append(('done', order['order_id'], None, job_id))
+                    if not order['replayed']:
+                        job_items[job_id] = []
+            # Lines of jobs that placed nothing go back to their cart; finished jobs hold no stock
+            cursor.executemany("""
+                INSERT INTO cart (username, product_id, quantity)
+                SELECT ?, i.product_id, i.quantity FROM checkout_job_items i
+                JOIN products p ON p.id = i.product_id
+                WHERE i.job_id = ?
+                ON CONFLICT (username, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+            """, [(username, job_id) for job_id, username, _ in jobs if job_items[job_id]])
+            for chunk in chunked(list(job_items)):
+                cursor.execute(f"DELETE FROM checkout_job_items WHERE job_id IN ({','.join('?' * len(chunk))})", chunk)
+            finished_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            cursor.executemany(
+                "UPDATE checkout_jobs SET status = ?, order_id = ?, error = ?, finished_at = ? WHERE id = ?",
+                [(status, order_id, error, finished_at, job_id) for status, order_id, error, job_id in results]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+        if jobs:
+            CATALOG_CACHE.sync(cursor)
+        conn.close()
+        return len(jobs)
+
+    @staticmethod
+    def run_worker(batch_size=CHECKOUT_BATCH_SIZE, poll_interval=CHECKOUT_POLL_INTERVAL, exit_when_idle=False):
+        """Process jobs until interrupted (or, with exit_when_idle, until the queue is empty)"""
+        processed = 0
+        try:
+            while True:
+                count = CheckoutQueue.process_batch(batch_size)
+                processed += count
+                if count == 0:
+                    if exit_when_idle:
+                        break
+                    time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+        return processed
+
+    @staticmethod
+    def start_workers(count, batch_size=CHECKOUT_BATCH_SIZE, exit_when_idle=False):
+        """Start count worker processes and return them"""
+        import multiprocessing
+        workers = [
+            multiprocessing.Process(target=CheckoutQueue.run_worker, args=(batch_size,),
+                                    kwargs={'exit_when_idle': exit_when_idle}, name=f"checkout-worker-{i}")
+            for i in range(count)
+        ]
+        for worker in workers:
+            worker.start()
+        return workers
+
+    @staticmethod
+    def queue_order(username):
+        """Submit the cart to the checkout queue and report the result when it is ready"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM cart WHERE username = ?", (username,))
+        empty = cursor.fetchone()[0] == 0
+        conn.close()
+        if empty:
+            print("Your cart is empty.")
+            return None
+        Cart.view_cart(username)
+        while True:
+            confirm = input("\nQueue this order for checkout? (y/n): ").lower()
+            if confirm in ['y', 'n']:
+                break
+            print("Please enter 'y' or 'n'.")
+        if confirm == 'n':
+            print("Order cancelled.")
+            return None
+        job_id = CheckoutQueue.submit(username)
+        if job_id is None:
+            print("Your cart is empty.")
+            return None
+        print(f"Order queued as job #{job_id}.")
+        job = CheckoutQueue.wait(job_id, timeout=2.0)
+        if job['status'] == 'done':
+            print(f"Order placed. Order ID: {job['order_id']}")
+        elif job['status'] == 'failed':
+            print(f"Checkout failed: {job['error']}")
+        else:
+            print("Still processing; check View Queued Orders for your order ID.")
+        return job_id
+
+    @staticmethod
+    def view_jobs(username):
+        """List the user's queued checkouts and their results"""
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, status, order_id, error, submitted_at FROM checkout_jobs
+            WHERE username = ? ORDER BY id DESC
+        """, (username,))
+        jobs = cursor.fetchall()
+        conn.close()
+        if not jobs:
+            print("You have no queued orders.")
+            return
+        TableWriter.render(
+            [('Job', '{}', '>'), ('Status', str.upper), ('Order ID', lambda value: '-' if value is None else str(value)),
+             ('Error', lambda value: value or ''), ('Submitted', '{}')],
+            jobs, title="=== Queued Orders ==="
+        )
+
+
+class CommandError(Exception):
+    """A command-line operation that could not be carried out"""
+
+
+def build_parser():
+    """Argument parser for the non-interactive command line"""
+    import argparse
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('--json', action='store_true', help='write results as JSON lines')
+    parser = argparse.ArgumentParser(prog='dollmart', description='Dollmart e-commerce system. '
+                                     'Run without arguments for the interactive menu.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    products = commands.add_parser('products', help='catalog queries').add_subparsers(dest='action', required=True)
+    listing = products.add_parser('list', parents=[output], help='list products with available quantities')
+    listing.add_argument('--category')
+    listing.add_argument('--in-stock', action='store_true')
+    listing.add_argument('--min-price', type=float)
+    listing.add_argument('--max-price', type=float)
+    restock = products.add_parser('restock', parents=[output], help='sales velocity and days until stockout')
+    restock.add_argument('--threshold-days', type=float, default=RESTOCK_THRESHOLD_DAYS)
+    restock.add_argument('--flagged', action='store_true', help='only products that need restocking')
+
+    cart = commands.add_parser('cart', help='cart operations').add_subparsers(dest='action', required=True)
+    show = cart.add_parser('show', parents=[output], help="show a user's cart")
+    show.add_argument('--user', required=True)
+    set_items = cart.add_parser('set', parents=[output], help='set quantities, 0 removes the item')
+    set_items.add_argument('--user', required=True)
+    set_items.add_argument('items', nargs='+', metavar='PRODUCT_ID=QUANTITY')
+    clear = cart.add_parser('clear', parents=[output], help="empty a user's cart")
+    clear.add_argument('--user', required=True)
+
+    order = commands.add_parser('order', help='order operations').add_subparsers(dest='action', required=True)
+    place = order.add_parser('place', parents=[output], help="check out a user's cart")
+    place.add_argument('--user', required=True)
+    place.add_argument('--key', help='idempotency key; retries with the same key return the original order')
+    submit = order.add_parser('submit', parents=[output], help="queue a checkout of a user's cart")
+    submit.add_argument('--user', required=True)
+    submit.add_argument('--key', help='idempotency key for the order')
+    submit.add_argument('--wait', type=float, default=0, metavar='SECONDS', help='wait for the order id')
+    job = order.add_parser('job', parents=[output], help='show queued checkout jobs')
+    job.add_argument('job_ids', nargs='+', type=int, metavar='JOB_ID')
+    order_list = order.add_parser('list', parents=[output], help='list orders')
+    order_list.add_argument('--user')
+    order_list.add_argument('--status', choices=sorted(ORDER_TRANSITIONS))
+    status = order.add_parser('status', parents=[output], help='change the status of orders')
+    status.add_argument('order_ids', nargs='+', type=int, metavar='ORDER_ID')
+    status.add_argument('--to', required=True, choices=sorted(ORDER_TRANSITIONS))
+    status.add_argument('--note')
+
+    catalog_import = commands.add_parser('import', parents=[output],
+                                         help='add products from a CSV with name,price,category,quantity columns')
+    catalog_import.add_argument('path', help="CSV file, or '-' for stdin")
+
+    worker = commands.add_parser('worker', help='run checkout queue workers')
+    worker.add_argument('--processes', type=int, default=1)
+    worker.add_argument('--batch-size', type=int, default=CHECKOUT_BATCH_SIZE)
+    worker.add_argument('--exit-when-idle', action='store_true')
+
+    batch = commands.add_parser('batch', help='run one command per input line, writing JSON lines')
+    batch.add_argument('path', nargs='?', default='-', help="file of commands, or '-' for stdin (default)")
+    return parser
+
+
+def open_input(path):
+    """Open a file argument, treating '-' as stdin"""
+    return sys.stdin if path == '-' else open(path, newline='')
+
+
+def cli_products_list(args):
+    """products list"""
+    if args.category or args.in_stock or args.min_price is not None or args.max_price is not None:
+        products = Product.query_catalog(args.in_stock, args.category, args.min_price, args.max_price, sort_by='id')
+    else:
+        conn = connect_db()
+        products = CATALOG_CACHE.products(conn.cursor())
+        conn.close()
+    available = Cart.update_product_availability()
+    for product in products:
+        yield {'id': product.id, 'name': product.name, 'price': product.price, 'category': product.category,
+               'quantity': product.quantity, 'available': available.get(product.id, 0)}
+
+
+def cli_products_restock(args):
+    """products restock"""
+    for row in Product.restock_report(threshold_days=args.threshold_days):
+        if row['flagged'] or not args.flagged:
+            record = {'id': row['id'], 'name': row['name'], 'available': row['available']}
+            record.update({f'units_per_day_{days}d': rate for days, rate in row['velocity'].items()})
+            record.update({'days_left': row['days_left'], 'flagged': row['flagged']})
+            yield record
+
+
+def cli_cart_show(args):
+    """cart show"""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.product_id, p.name, p.price, c.quantity
+        FROM cart c JOIN products p ON p.id = c.product_id
+        WHERE c.username = ?
+        ORDER BY c.product_id
+    """, (args.user,))
+    rows = cursor.fetchall()
+    conn.close()
+    for product_id, name, price, quantity in rows:
+        yield {'product_id': product_id, 'name': name, 'price': price, 'quantity': quantity}
+
+
+def require_user(username):
+    """Raise CommandError unless the user exists"""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM users WHERE username = ?", (username,))
+    exists = cursor.fetchone() is not None
+    conn.close()
+    if not exists:
+        raise CommandError(f"User {username} does not exist.")
+
+
+def cli_cart_set(args):
+    """cart set"""
+    require_user(args.user)
+    quantities = {}
+    for item in args.items:
+        product_id, _, quantity = item.partition('=')
+        quantities[product_id] = quantity
+    for product_id, quantity, applied, message in Cart.set_quantities(args.user, quantities):
+        yield {'product_id': product_id, 'quantity': quantity, 'applied': applied, 'message': message}
+
+
+def cli_cart_clear(args):
+    """cart clear"""
+    require_user(args.user)
+    yield {'username': args.user, 'removed': Cart.clear_cart(args.user)}
+
+
+def cli_order_place(args):
+    """order place"""
+    require_user(args.user)
+    order = Cart.submit_order(args.user, args.key)
+    if order is None:
+        raise CommandError("Cart is empty.")
+    if order['username'] != args.user:
+        raise CommandError("This request key was already used by another customer.")
+    yield order
+
+
+def cli_order_submit(args):
+    """order submit"""
+    require_user(args.user)
+    job_id = CheckoutQueue.submit(args.user, args.key)
+    if job_id is None:
+        raise CommandError("Cart is empty.")
+    yield CheckoutQueue.wait(job_id, args.wait) if args.wait else CheckoutQueue.status(job_id)
+
+
+def cli_order_job(args):
+    """order job"""
+    for job_id in args.job_ids:
+        job = CheckoutQueue.status(job_id)
+        yield job if job else {'job_id': job_id, 'found': False, 'error': "Job does not exist."}
+
+
+def run_workers(args):
+    """worker: run checkout workers in this process or a pool of processes"""
+    if args.processes <= 1:
+        processed = CheckoutQueue.run_worker(args.batch_size, exit_when_idle=args.exit_when_idle)
+        print(f"Processed {processed} checkout jobs.")
+        return 0
+    workers = CheckoutQueue.start_workers(args.processes, args.batch_size, args.exit_when_idle)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.join()
+    return 0
+
+
+def cli_order_list(args):
+    """order list"""
+    conditions = []
+    params = []
+    if args.user:
+        conditions.append("username = ?")
+        params.append(args.user)
+    if args.status:
+        conditions.append("status = ?")
+        params.append(args.status)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT id, username, total_amount, order_date, status FROM orders {where} ORDER BY id", params)
+    try:
+        for order_id, username, total, order_date, status in cursor:
+            yield {'order_id': order_id, 'username': username, 'total': total, 'order_date': order_date,
+                   'status': status}
+    finally:
+        conn.close()
+
+
+def cli_order_status(args):
+    """order status"""
+    changed_ids, errors = Order.transition_orders(args.order_ids, args.to, args.note)
+    for order_id in args.order_ids:
+        if order_id in errors:
+            yield {'order_id': order_id, 'changed': False, 'error': errors[order_id]}
+        elif order_id in changed_ids:
+            yield {'order_id': order_id, 'changed': True, 'status': args.to}
+
+
+def cli_import(args):
+    """import"""
+    import csv
+    source = open_input(args.path)
+    try:
+        imported, errors = Product.import_catalog(csv.DictReader(source))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    yield {'imported': imported, 'errors': [{'row': row, 'error': message} for row, message in errors]}
+
+
+CLI_COMMANDS = {
+    ('products', 'list'): cli_products_list,
+    ('products', 'restock'): cli_products_restock,
+    ('cart', 'show'): cli_cart_show,
+    ('cart', 'set'): cli_cart_set,
+    ('cart', 'clear'): cli_cart_clear,
+    ('order', 'place'): cli_order_place,
+    ('order', 'submit'): cli_order_submit,
+    ('order', 'job'): cli_order_job,
+    ('order', 'list'): cli_order_list,
+    ('order', 'status'): cli_order_status,
+    ('import', None): cli_import,
+}
+
+
+def write_record(record, as_json, out):
+    """Write one result as a JSON line, or as ' | '-separated values"""
+    if as_json:
+        out.write(json.dumps(record) + '\n')
+    else:
+        out.write(' | '.join(json.dumps(value) if isinstance(value, (list, dict)) else str(value)
+                             for value in record.values()) + '\n')
+
+
+def run_command(args, out, extra=None):
+    """Run a parsed command, streaming its records to out.
+
+    Returns True on success: no error was raised and no record reports a
+    line that was not applied, an order that was not changed or a job that
+    was not found.
+    """
+    handler = CLI_COMMANDS[(args.command, getattr(args, 'action', None))]
+    as_json = extra is not None or args.json
+    ok = True
+    try:
+        for record in handler(args):
+            write_record(dict(extra or {}, **record), as_json, out)
+            if record.get('applied') is False or record.get('changed') is False or record.get('found') is False:
+                ok = False
+    except (CommandError, sqlite3.Error, OSError) as e:
+        if as_json:
+            write_record(dict(extra or {}, error=str(e)), True, out)
+        else:
+            print(f"Error: {e}", file=sys.stderr)
+        return False
+    return ok
+
+
+def run_batch(parser, path, out):
+    """Run one command per line (shell words or a JSON array); returns True if all succeeded"""
+    import shlex
+    ok = True
+    source = open_input(path)
+    try:
+        for line_number, line in enumerate(source, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                argv = json.loads(line) if line.startswith('[') else shlex.split(line)
+                if not isinstance(argv, list) or not all(isinstance(word, str) for word in argv):
+                    raise ValueError("A JSON command must be an array of strings.")
+                args = parser.parse_args(argv)
+            except (ValueError, SystemExit):
+                write_record({'line': line_number, 'error': f"Invalid command: {line}"}, True, out)
+                ok = False
+                continue
+            if args.command in ('batch', 'worker'):
+                write_record({'line': line_number, 'error': f"{args.command} cannot run inside a batch."}, True, out)
+                ok = False
+                continue
+            ok = run_command(args, out, extra={'line': line_number}) and ok
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    return ok
+
+
+def run_cli(argv):
+    """Run one non-interactive command and return the process exit code"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    out = sys.stdout
+    if args.command == 'worker':
+        return run_workers(args)
+    if args.command == 'batch':
+        ok = run_batch(parser, args.path, out)
+    else:
+        ok = run_command(args, out)
+    out.flush()
+    return 0 if ok else 1
+
+
+def main(argv=None):
     """Main function to run the Dollmart e-commerce system"""
+    argv = sys.argv[1:] if argv is None else argv
     create_database()
+    if argv:
+        return run_cli(argv)
     while True:
         print("\n=== Welcome to Dollmart E-Commerce System ===")
         print("1. Register")
@@ -878,4 +4421,4 @@ def main():
             print("Invalid choice. Please try again.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
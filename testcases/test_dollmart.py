@@ -1,7 +1,9 @@
 import pytest
 import sqlite3
 import hashlib
+import json
 import os
+import time
 import sys
 from io import StringIO
 from unittest.mock import patch
@@ -9,21 +11,52 @@ from datetime import datetime
 from freezegun import freeze_time
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
-from dollmart import User, Product, Cart, Order, create_database
+from dollmart import User, Product, Cart, Order, create_database, CatalogCache, CatalogSnapshot, OrderOutbox, ReportingSnapshot, DatabaseBackup
+from dollmart import SCHEMA_VERSION, CHANGE_LOG_RETENTION, main, TableWriter, CheckoutQueue
+from dollmart import SQLiteStorage, MemoryStorage, loyalty_tier, LOYALTY_TIERS, RateLimiter, rate_limit_metrics
+
+# Run the suite on disk (default) or in memory with DOLLMART_TEST_STORAGE=memory
+TEST_STORAGE = os.environ.get('DOLLMART_TEST_STORAGE', 'sqlite')
+
+def redirect_connect(only_main=False):
+    """Point connections to the store (and to test_dollmart.db) at the test database.
+
+    With only_main, connections to any other path are passed through.
+    """
+    if TEST_STORAGE == 'memory':
+        def connect(path, *args, **kwargs):
+            if path in ('dollmart.db', 'test_dollmart.db') or not only_main:
+                return orig_connect(test_storage.uri, uri=True)
+            return orig_connect(path, *args, **kwargs)
+    elif only_main:
+        def connect(path, *args, **kwargs):
+            return orig_connect('test_dollmart.db' if path == 'dollmart.db' else path, *args, **kwargs)
+    else:
+        def connect(path, *args, **kwargs):
+            return orig_connect('test_dollmart.db')
+    sqlite3.connect = connect
+
 
 @pytest.fixture
 def setup_test_db():
     """Create a test database and clean up after tests"""
-    conn = sqlite3.connect('test_dollmart.db')
-    global orig_connect
+    global orig_connect, test_storage
     orig_connect = sqlite3.connect
-    sqlite3.connect = lambda _: orig_connect('test_dollmart.db')
-    create_database()
-    yield
+    test_storage = MemoryStorage() if TEST_STORAGE == 'memory' else SQLiteStorage('test_dollmart.db')
+    conn = test_storage.connect()
+    redirect_connect()
+    # Fresh limiters so attempts and lockouts do not carry over between tests
+    with patch('dollmart.STORAGE', test_storage), \
+            patch('dollmart.LOGIN_LIMITER', RateLimiter('login', 5, 1 / 60)), \
+            patch('dollmart.OTP_LIMITER', RateLimiter('otp', 3, 1 / 300)):
+        create_database()
+        yield
     sqlite3.connect = orig_connect
     conn.close()
-    if os.path.exists('test_dollmart.db'):
-        os.remove('test_dollmart.db')
+    test_storage.close()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists('test_dollmart.db' + suffix):
+            os.remove('test_dollmart.db' + suffix)
 
 @pytest.fixture
 def setup_test_data(setup_test_db):
@@ -43,17 +76,19 @@ def setup_test_data(setup_test_db):
         "INSERT INTO users (username, password, role, customer_type, visit_count) VALUES (?, ?, ?, ?, ?)",
         ('discountuser', hashed_password, 'customer', 'individual', 2)
     )
+    cursor.execute("INSERT INTO categories (name) VALUES ('Electronics')")
+    cursor.execute("INSERT INTO categories (name) VALUES ('Toys')")
     cursor.execute(
-        "INSERT INTO products (name, price, category, quantity) VALUES (?, ?, ?, ?)",
-        ('Test Product 1', 10.99, 'Electronics', 50)
+        "INSERT INTO products (name, price, category_id, quantity) VALUES (?, ?, ?, ?)",
+        ('Test Product 1', 10.99, 1, 50)
     )
     cursor.execute(
-        "INSERT INTO products (name, price, category, quantity) VALUES (?, ?, ?, ?)",
-        ('Test Product 2', 5.99, 'Toys', 30)
+        "INSERT INTO products (name, price, category_id, quantity) VALUES (?, ?, ?, ?)",
+        ('Test Product 2', 5.99, 2, 30)
     )
     cursor.execute(
-        "INSERT INTO products (name, price, category, quantity) VALUES (?, ?, ?, ?)",
-        ('Low Stock Product', 15.99, 'Electronics', 1)
+        "INSERT INTO products (name, price, category_id, quantity) VALUES (?, ?, ?, ?)",
+        ('Low Stock Product', 15.99, 1, 1)
     )
     conn.commit()
     conn.close()
@@ -180,7 +215,11 @@ class TestProduct:
             
             conn = sqlite3.connect('test_dollmart.db')
             cursor = conn.cursor()
-            cursor.execute("SELECT name, price, category, quantity FROM products WHERE name = 'Test Product 3'")
+            cursor.execute("""
+                SELECT p.name, p.price, c.name, p.quantity
+                FROM products p JOIN categories c ON c.id = p.category_id
+                WHERE p.name = 'Test Product 3'
+            """)
             product = cursor.fetchone()
             conn.close()
             
@@ -261,7 +300,7 @@ class TestProduct:
             
             conn = sqlite3.connect('test_dollmart.db')
             cursor = conn.cursor()
-            cursor.execute("SELECT category FROM products WHERE id = 1")
+            cursor.execute("SELECT c.name FROM products p JOIN categories c ON c.id = p.category_id WHERE p.id = 1")
             category = cursor.fetchone()[0]
             conn.close()
             
@@ -518,6 +557,26 @@ class TestOrder:
             conn.close()
             
             assert status == 'placed'  # Status should remain unchanged
+
+    def test_confirm_order_cancelled_meanwhile(self, setup_order_history):
+        """Test that an order cancelled after it was chosen is not reported as delivered"""
+        def cancel_then_enter_otp(prompt):
+            conn = sqlite3.connect('test_dollmart.db')
+            conn.execute("UPDATE orders SET status = 'cancelled' WHERE id = 1")
+            conn.commit()
+            conn.close()
+            return '123456'
+
+        answers = iter([lambda prompt: '1', cancel_then_enter_otp])
+        with patch('builtins.input', side_effect=lambda prompt: next(answers)(prompt)):
+            with patch('dollmart.OTP_LIMITER.reset') as mock_reset:
+                with patch('sys.stdout', new=StringIO()) as fake_output:
+                    Order.confirm_order()
+                    output = fake_output.getvalue()
+
+        assert 'confirmed as delivered' not in output
+        assert 'Cannot change status from cancelled to delivered.' in output
+        mock_reset.assert_not_called()
     
     def test_view_all_customers(self, setup_order_history):
         """Test viewing all customers"""
@@ -655,4 +714,1705 @@ class TestEdgeCases:
         """Test updating product with invalid quantity"""
         with patch('builtins.print') as mock_print:
             with pytest.raises(StopIteration):
-                Product.update_product()
\ No newline at end of file
+                Product.update_product()
+# Test in-memory catalog cache
+class TestCatalogCache:
+    def test_repeated_listing_hits_cache(self, setup_test_data):
+        """Test that a second listing is served from the cache"""
+        cache = CatalogCache()
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        first = cache.products(cursor)
+        second = cache.products(cursor)
+        conn.close()
+
+        assert [p.id for p in first] == [p.id for p in second] == [1, 2, 3]
+        assert cache.stats()['misses'] == 1
+        assert cache.stats()['hits'] == 1
+
+    def test_external_write_is_picked_up(self, setup_test_data):
+        """Test that writes made outside the cache are replayed from the change log"""
+        cache = CatalogCache()
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cache.products(cursor)
+        cursor.execute("UPDATE products SET quantity = 7 WHERE id = 1")
+        cursor.execute("DELETE FROM products WHERE id = 2")
+        conn.commit()
+        products = {p.id: p for p in cache.products(cursor)}
+        conn.close()
+
+        assert products[1].quantity == 7
+        assert 2 not in products
+        assert cache.stats()['hits'] == 1
+
+    def test_lookups_sync_once_per_connection(self, setup_test_data):
+        """Test that repeated lookups skip the log replay until something is committed"""
+        cache = CatalogCache()
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        other = sqlite3.connect('test_dollmart.db')
+        with patch.object(CatalogCache, 'sync', autospec=True, side_effect=CatalogCache.sync) as sync:
+            for _ in range(5):
+                cache.get(cursor, 1)
+            assert sync.call_count == 1
+            other.execute("UPDATE products SET quantity = 9 WHERE id = 1")
+            other.commit()
+            assert cache.get(cursor, 1).quantity == 9
+            cursor.execute("UPDATE products SET quantity = 8 WHERE id = 1")
+            conn.commit()
+            assert cache.get(cursor, 1).quantity == 8
+            assert sync.call_count == 3
+        other.close()
+        conn.close()
+
+    def test_get_many_keeps_order_and_skips_missing(self, setup_test_data):
+        """Test batch lookup: cached rows reused, the rest read together"""
+        cache = CatalogCache()
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cache.get(cursor, 2)
+        records = cache.get_many(cursor, [3, 99, 2, 1])
+        conn.close()
+
+        assert [record.id for record in records] == [3, 2, 1]
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['size'] == 3
+
+    @patch('builtins.input', side_effect=['1', '2', '20.99'])
+    def test_update_product_writes_through(self, mock_input, setup_test_data):
+        """Test that update_product refreshes the shared cache"""
+        Product.view_all_products()
+        with patch('builtins.print'):
+            Product.update_product()
+
+        with patch('sys.stdout', new=StringIO()) as fake_output:
+            Product.view_all_products()
+            assert '$20.99' in fake_output.getvalue()
+
+    def test_lru_eviction(self, setup_test_data):
+        """Test that the cache stays within capacity"""
+        cache = CatalogCache(capacity=2)
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        assert len(cache.products(cursor)) == 3
+        cache.get(cursor, 1)
+        cache.get(cursor, 2)
+        cache.get(cursor, 3)
+        record = cache.get(cursor, 1)
+        conn.close()
+
+        assert record.name == 'Test Product 1'
+        assert cache.stats()['size'] == 2
+        assert cache.stats()['complete'] is False
+        assert cache.stats()['misses'] == 5
+
+# Test NumPy catalog snapshot
+class TestCatalogSnapshot:
+    def test_filter_and_top_k(self, setup_test_data):
+        """Test vectorized filtering by category, price and top-k sorting"""
+        pytest.importorskip('numpy')
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        snapshot = CatalogSnapshot.build(cursor)
+        conn.close()
+
+        assert snapshot.query(category='electronics') == [1, 3]
+        assert snapshot.query(max_price=11) == [2, 1]
+        assert snapshot.query(sort_by='price', descending=True, limit=1) == [3]
+
+    def test_in_stock_uses_cart_reservations(self, setup_test_data):
+        """Test that in-stock filtering subtracts items reserved in carts"""
+        pytest.importorskip('numpy')
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO cart (username, product_id, quantity) VALUES ('testuser', 3, 1)")
+        conn.commit()
+        snapshot = CatalogSnapshot.build(cursor)
+        conn.close()
+
+        assert snapshot.query(in_stock=True) == [2, 1]
+
+    def test_incremental_refresh(self, setup_test_data):
+        """Test that refresh applies inserts, updates and deletes from the change log"""
+        pytest.importorskip('numpy')
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        snapshot = CatalogSnapshot.build(cursor)
+        cursor.execute("UPDATE products SET price = 1.00 WHERE id = 3")
+        cursor.execute("DELETE FROM products WHERE id = 2")
+        cursor.execute("INSERT INTO products (name, price, category_id, quantity) VALUES ('Puzzle', 2.50, 2, 4)")
+        conn.commit()
+        snapshot.refresh(cursor)
+        conn.close()
+
+        assert len(snapshot) == 3
+        assert snapshot.query() == [3, 4, 1]
+        assert snapshot.query(category='Toys') == [4]
+
+    @patch('builtins.input', side_effect=['Electronics', '', '12', 'y', '1', ''])
+    def test_filter_products(self, mock_input, setup_test_data):
+        """Test the interactive product filter"""
+        with patch('sys.stdout', new=StringIO()) as fake_output:
+            Product.filter_products()
+            output = fake_output.getvalue()
+
+            assert 'Test Product 1' in output
+            assert 'Low Stock Product' not in output
+            assert 'Test Product 2' not in output
+
+# Test faceted browse
+class TestFacets:
+    def test_facet_counts(self, setup_test_data):
+        """Test category, price bucket and stock counts from the facet table"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        facets = Product.facet_counts(cursor)
+        electronics = Product.facet_counts(cursor, category='Electronics')
+        conn.close()
+
+        assert facets['categories'] == [('Electronics', 2, 2), ('Toys', 1, 1)]
+        assert facets['price_buckets'] == [(0, 1, 1), (1, 2, 2)]
+        assert facets['total'] == 3
+        assert electronics['price_buckets'] == [(1, 2, 2)]
+        assert electronics['total'] == 2
+
+    def test_facets_follow_product_changes(self, setup_test_data):
+        """Test that triggers keep facet counts current"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("UPDATE products SET quantity = 0 WHERE id = 3")
+        cursor.execute("UPDATE products SET price = 120 WHERE id = 1")
+        cursor.execute("DELETE FROM products WHERE id = 2")
+        conn.commit()
+        facets = Product.facet_counts(cursor)
+        conn.close()
+
+        assert facets['categories'] == [('Electronics', 2, 1)]
+        assert facets['price_buckets'] == [(1, 1, 0), (4, 1, 1)]
+        assert facets['in_stock'] == 1
+
+    @patch('builtins.input', side_effect=['1', 'Toys', '4', '6'])
+    def test_browse_products(self, mock_input, setup_test_data):
+        """Test browsing with a category facet selected"""
+        with patch('sys.stdout', new=StringIO()) as fake_output:
+            Product.browse_products()
+            output = fake_output.getvalue()
+
+            assert 'Electronics (2)' in output
+            assert 'Matching products: 1 (1 in stock)' in output
+            assert 'Test Product 2' in output
+            assert 'Test Product 1' not in output
+
+# Test normalized categories
+class TestCategories:
+    def test_migrate_free_text_categories(self, setup_test_db):
+        """Test migrating a legacy products.category column to category ids"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("DROP TABLE products")
+        cursor.execute("""
+            CREATE TABLE products (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                price REAL NOT NULL,
+                category TEXT NOT NULL,
+                quantity INTEGER NOT NULL
+            )
+        """)
+        cursor.executemany(
+            "INSERT INTO products (name, price, category, quantity) VALUES (?, ?, ?, ?)",
+            [('Lamp', 20.0, 'Home', 3), ('Robot', 30.0, 'Toys', 2), ('Rug', 40.0, 'Home', 0)]
+        )
+        cursor.execute("PRAGMA user_version = 0")
+        conn.commit()
+        conn.close()
+
+        create_database()
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA table_info(products)")
+        columns = [row[1] for row in cursor.fetchall()]
+        cursor.execute("""
+            SELECT p.name, c.name FROM products p JOIN categories c ON c.id = p.category_id ORDER BY p.id
+        """)
+        products = cursor.fetchall()
+        facets = Product.facet_counts(cursor, category='home')
+        conn.close()
+
+        assert 'category' not in columns
+        assert products == [('Lamp', 'Home'), ('Robot', 'Toys'), ('Rug', 'Home')]
+        assert facets['total'] == 2
+        assert facets['in_stock'] == 1
+
+    def test_category_search_uses_category_ids(self, setup_test_data):
+        """Test category search when the catalog is not fully cached"""
+        cache = CatalogCache(capacity=1)
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        products = cache.search(cursor, 'electr', by_name=False)
+        none = cache.search(cursor, 'garden', by_name=False)
+        conn.close()
+
+        assert [p.id for p in products] == [1, 3]
+        assert all(p.category == 'Electronics' for p in products)
+        assert none == []
+
+    @patch('builtins.input', side_effect=['1', '3', 'toys'])
+    def test_update_category_reuses_existing(self, mock_input, setup_test_data):
+        """Test that category names are matched case-insensitively"""
+        with patch('builtins.print'):
+            Product.update_product()
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM categories")
+        category_count = cursor.fetchone()[0]
+        cursor.execute("SELECT category_id FROM products WHERE id = 1")
+        category_id = cursor.fetchone()[0]
+        conn.close()
+
+        assert category_count == 2
+        assert category_id == 2
+
+# Test order archival
+class TestOrderArchive:
+    def _age_delivered_order(self):
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("UPDATE orders SET order_date = '2020-01-01 10:00:00' WHERE status = 'delivered'")
+        conn.commit()
+        conn.close()
+
+    def test_archive_moves_old_delivered_orders(self, setup_order_history):
+        """Test that only delivered orders older than the cutoff are archived"""
+        self._age_delivered_order()
+        archived = Order.archive_orders(30, batch_size=1)
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, status FROM orders")
+        hot_orders = cursor.fetchall()
+        cursor.execute("SELECT id, status FROM orders_archive")
+        archived_orders = cursor.fetchall()
+        cursor.execute("SELECT COUNT(*) FROM order_items_archive WHERE order_id = 2")
+        archived_items = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM order_items WHERE order_id = 2")
+        hot_items = cursor.fetchone()[0]
+        conn.close()
+
+        assert archived == 1
+        assert hot_orders == [(1, 'placed')]
+        assert archived_orders == [(2, 'delivered')]
+        assert archived_items == 1
+        assert hot_items == 0
+
+    def test_archived_order_keeps_idempotency_key(self, setup_cart_with_items):
+        """Test that a retried key still finds its order after the order was archived"""
+        with freeze_time("2020-01-01 10:00:00"):
+            order = Cart.submit_order('testuser', 'archived-key')
+        Order.transition_orders([order['order_id']], 'delivered')
+        Order.archive_orders(30)
+        Cart.add_item('testuser', 1, 1)
+
+        replay = Cart.submit_order('testuser', 'archived-key')
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT idempotency_key FROM orders_archive WHERE id = ?", (order['order_id'],))
+        archived_key = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM orders")
+        live_orders = cursor.fetchone()[0]
+        conn.close()
+
+        assert archived_key == 'archived-key'
+        assert replay['replayed'] and replay['order_id'] == order['order_id']
+        assert live_orders == 0
+
+    def test_upgrade_adds_archive_idempotency_key(self, setup_order_history):
+        """Test that an archive table from an older schema gets the idempotency_key column"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("DROP TABLE orders_archive")
+        cursor.execute("CREATE TABLE orders_archive (id INTEGER PRIMARY KEY, username TEXT, total_amount REAL, "
+                       "order_date TEXT, otp TEXT, status TEXT, archived_at TEXT)")
+        cursor.execute("PRAGMA user_version = 0")
+        conn.commit()
+        conn.close()
+        create_database()
+        self._age_delivered_order()
+
+        assert Order.archive_orders(30) == 1
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, idempotency_key FROM orders_archive")
+        archived = cursor.fetchall()
+        conn.close()
+
+        assert archived == [(2, None)]
+
+    def test_history_includes_archive_only_when_asked(self, setup_order_history):
+        """Test that archived orders are hidden unless the archive is requested"""
+        self._age_delivered_order()
+        Order.archive_orders(30)
+
+        with patch('sys.stdout', new=StringIO()) as fake_output:
+            Order.view_order_history('testuser')
+            assert 'DELIVERED' not in fake_output.getvalue()
+
+        with patch('sys.stdout', new=StringIO()) as fake_output:
+            Order.view_order_history('testuser', include_archive=True)
+            output = fake_output.getvalue()
+            assert 'DELIVERED' in output
+            assert 'Low Stock Product' in output
+
+    @patch('builtins.input', side_effect=['y', '2', 'n'])
+    def test_view_all_orders_with_archive(self, mock_input, setup_order_history):
+        """Test viewing an archived order's details as manager"""
+        self._age_delivered_order()
+        Order.archive_orders(30)
+
+        with patch('sys.stdout', new=StringIO()) as fake_output:
+            Order.view_all_orders(include_archive=True)
+            output = fake_output.getvalue()
+
+            assert '15.99' in output
+            assert 'Order ID: 2' in output
+            assert 'Low Stock Product' in output
+
+# Test batch delivery confirmation
+class TestBatchConfirm:
+    def test_confirm_orders_batch(self, setup_order_history):
+        """Test per-row results for a batch of confirmations"""
+        results = Order.confirm_orders_batch([
+            ('order_id', 'otp'),
+            ('1', '000000'),
+            ('1', '123456'),
+            ('2', '654321'),
+            ('1', '123456'),
+            ('99', '111111'),
+        ])
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT status FROM orders WHERE id = 1")
+        status = cursor.fetchone()[0]
+        conn.close()
+
+        assert [(r[0], r[2]) for r in results] == [
+            (1, False), (2, False), (3, True), (4, False), (5, False), (6, False)
+        ]
+        assert results[1][3] == 'Invalid OTP.'
+        assert status == 'delivered'
+        assert Order.last_batch_stats['confirmed'] == 1
+        assert Order.last_batch_stats['rows'] == 6
+
+    def test_batch_confirm_from_file(self, setup_order_history, tmp_path):
+        """Test confirming deliveries from a CSV file"""
+        batch_file = tmp_path / 'deliveries.csv'
+        batch_file.write_text("1,123456\n\n2,654321\n")
+        with patch('builtins.input', side_effect=[str(batch_file)]):
+            with patch('sys.stdout', new=StringIO()) as fake_output:
+                Order.batch_confirm_orders()
+                output = fake_output.getvalue()
+
+        assert 'Line 1: Order #1 - OK' in output
+        assert 'Line 3: Order #2 - FAILED' in output
+        assert 'Confirmed 1 of 2 rows' in output
+
+# Test order lifecycle
+class TestOrderLifecycle:
+    def test_bulk_transition_logs_events(self, setup_order_history):
+        """Test moving several orders at once and rejecting invalid transitions"""
+        changed, errors = Order.transition_orders([1, 2, 42], 'packed')
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT status FROM orders WHERE id = 1")
+        status = cursor.fetchone()[0]
+        cursor.execute("SELECT order_id, from_status, to_status FROM order_events")
+        events = cursor.fetchall()
+        conn.close()
+
+        assert changed == [1]
+        assert 'delivered to packed' in errors[2]
+        assert errors[42] == 'Order ID does not exist.'
+        assert status == 'packed'
+        assert events == [(1, 'placed', 'packed')]
+
+    def test_cancel_restores_stock(self, setup_order_history):
+        """Test that cancelling an order returns its items to stock"""
+        Order.transition_orders([1], 'cancelled', note='customer request')
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT quantity FROM products WHERE id IN (1, 2) ORDER BY id")
+        quantities = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT status FROM orders WHERE id = 1")
+        status = cursor.fetchone()[0]
+        conn.close()
+
+        assert quantities == [52, 31]
+        assert status == 'cancelled'
+        changed, errors = Order.transition_orders([1], 'cancelled')
+        assert changed == [] and 1 in errors
+
+    def test_events_are_append_only(self, setup_order_history):
+        """Test that the order event log rejects updates and deletes"""
+        Order.transition_orders([1], 'shipped')
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        with pytest.raises(sqlite3.IntegrityError):
+            cursor.execute("DELETE FROM order_events")
+        conn.close()
+
+    @patch('builtins.input', side_effect=['1', '123456'])
+    def test_confirm_shipped_order(self, mock_input, setup_order_history):
+        """Test that shipped orders are still pending delivery confirmation"""
+        Order.transition_orders([1], 'shipped')
+        with patch('builtins.print'):
+            Order.confirm_order()
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT to_status FROM order_events WHERE order_id = 1 ORDER BY id")
+        statuses = [row[0] for row in cursor.fetchall()]
+        conn.close()
+
+        assert statuses == ['shipped', 'delivered']
+
+# Test order event outbox
+class TestOrderOutbox:
+    @patch('builtins.input', side_effect=['y'])
+    def test_place_order_writes_outbox_event(self, mock_input, setup_cart_with_items):
+        """Test that a placed order produces an outbox event with its items"""
+        with patch('builtins.print'):
+            Cart.place_order('testuser')
+
+        events = OrderOutbox.fetch('fulfilment')
+        assert len(events) == 1
+        assert events[0]['event_type'] == 'order_placed'
+        assert events[0]['payload']['username'] == 'testuser'
+        assert [item['product_id'] for item in events[0]['payload']['items']] == [1, 2]
+        assert 'otp' not in events[0]['payload']
+
+    @patch('builtins.input', side_effect=['n'])
+    def test_cancelled_checkout_writes_nothing(self, mock_input, setup_cart_with_items):
+        """Test that no event is written when checkout is abandoned"""
+        with patch('builtins.print'):
+            Cart.place_order('testuser')
+
+        assert OrderOutbox.fetch('fulfilment') == []
+
+    def test_stream_checkpoints_per_consumer(self, setup_order_history):
+        """Test batched streaming with independent consumer offsets"""
+        Order.transition_orders([1], 'packed')
+        Order.transition_orders([1], 'shipped')
+        Order.transition_orders([1], 'delivered')
+
+        batches = []
+        for batch in OrderOutbox.stream('analytics', batch_size=2):
+            batches.append([event['payload']['to_status'] for event in batch])
+
+        assert batches == [['packed', 'shipped'], ['delivered']]
+        assert list(OrderOutbox.stream('analytics')) == []
+        assert len(OrderOutbox.fetch('email')) == 3
+        OrderOutbox.acknowledge('email', 0)
+        assert OrderOutbox.prune() == 0
+        OrderOutbox.acknowledge('email', OrderOutbox.get_offset('analytics'))
+        assert OrderOutbox.prune() == 3
+
+# Test product change-data-capture feed
+class TestProductChanges:
+    @patch('builtins.input', side_effect=['y'])
+    def test_changes_since_reports_stock_decrements(self, mock_input, setup_cart_with_items):
+        """Test that checkout stock decrements appear as stock changes"""
+        start = Product.changes_since(0)
+        assert [c['op'] for c in start['changes']] == ['insert', 'insert', 'insert']
+        assert start['changes'][0]['category'] == 'Electronics'
+
+        with patch('builtins.print'):
+            Cart.place_order('testuser')
+
+        feed = Product.changes_since(start['last_seq'])
+        assert [(c['product_id'], c['op'], c['old_quantity'], c['quantity']) for c in feed['changes']] == [
+            (1, 'stock', 50, 48),
+            (2, 'stock', 30, 29),
+        ]
+        assert Product.changes_since(feed['last_seq'])['changes'] == []
+
+    def test_update_and_delete_changes(self, setup_test_data):
+        """Test that edits and deletes are captured with their values"""
+        seq = Product.changes_since(0)['last_seq']
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("UPDATE products SET price = 9.99 WHERE id = 2")
+        cursor.execute("DELETE FROM products WHERE id = 3")
+        conn.commit()
+        conn.close()
+
+        changes = Product.changes_since(seq, limit=10)['changes']
+        assert (changes[0]['op'], changes[0]['price']) == ('update', 9.99)
+        assert (changes[1]['op'], changes[1]['name'], changes[1]['quantity']) == ('delete', 'Low Stock Product', None)
+
+    def test_reset_when_log_pruned(self, setup_test_data):
+        """Test that consumers behind the retained log are told to reload"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM product_changes WHERE seq < 3")
+        conn.commit()
+        conn.close()
+
+        feed = Product.changes_since(0)
+        assert feed['reset'] is True
+        assert feed['last_seq'] == 3
+        assert Product.changes_since(2)['reset'] is False
+
+# Test idempotent checkout
+class TestIdempotentCheckout:
+    @patch('builtins.input', side_effect=['y'])
+    def test_retry_returns_original_order(self, mock_input, setup_cart_with_items):
+        """Test that a retried checkout with the same key does not create a second order"""
+        with patch('builtins.print'):
+            first = Cart.place_order('testuser', idempotency_key='req-1')
+            conn = sqlite3.connect('test_dollmart.db')
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO cart (username, product_id, quantity) VALUES ('testuser', 1, 5)")
+            conn.commit()
+            conn.close()
+            second = Cart.place_order('testuser', idempotency_key='req-1')
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM orders")
+        orders_count = cursor.fetchone()[0]
+        cursor.execute("SELECT quantity FROM products WHERE id = 1")
+        quantity = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM cart WHERE username = 'testuser'")
+        cart_count = cursor.fetchone()[0]
+        conn.close()
+
+        assert first == second == 1
+        assert orders_count == 1
+        assert quantity == 48
+        assert cart_count == 1
+
+    def test_key_is_unique(self, setup_order_history):
+        """Test that the idempotency key column is uniquely indexed"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("UPDATE orders SET idempotency_key = 'dup' WHERE id = 1")
+        with pytest.raises(sqlite3.IntegrityError):
+            cursor.execute("UPDATE orders SET idempotency_key = 'dup' WHERE id = 2")
+        conn.close()
+
+    def test_checkout_core_is_non_interactive(self, setup_cart_with_items):
+        """Test the transactional checkout used by scripted callers"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        order = Cart.checkout(cursor, 'testuser', 'req-2')
+        conn.commit()
+        replay = Cart.find_order_by_key(cursor, 'req-2')
+        empty = Cart.checkout(cursor, 'testuser')
+        conn.close()
+
+        assert abs(order['total'] - 27.97) < 0.01
+        assert replay['order_id'] == order['order_id']
+        assert replay['otp'] == order['otp']
+        assert empty is None
+
+# Test bulk cart operations
+class TestBulkCart:
+    def test_set_quantities(self, setup_cart_with_items):
+        """Test setting many quantities with per-line validation"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO cart (username, product_id, quantity) VALUES ('retailuser', 2, 25)")
+        conn.commit()
+        conn.close()
+
+        results = Cart.set_quantities('testuser', {1: 5, 2: 6, 3: 1, 999: 1, 4: -1})
+        outcome = {r[0]: (r[2], r[3]) for r in results}
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, quantity FROM cart WHERE username = 'testuser' ORDER BY product_id")
+        cart = cursor.fetchall()
+        conn.close()
+
+        assert outcome[1] == (True, 'Quantity set.')
+        assert outcome[2] == (False, 'Not enough stock. Available: 5')
+        assert outcome[999] == (False, 'Product ID does not exist.')
+        assert outcome[4][0] is False
+        assert cart == [(1, 5), (2, 1), (3, 1)]
+
+    def test_zero_quantity_removes_and_clear_cart(self, setup_cart_with_items):
+        """Test removing lines in bulk and clearing the cart"""
+        Cart.set_quantities('testuser', {1: 0})
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id FROM cart WHERE username = 'testuser'")
+        remaining = cursor.fetchall()
+        conn.close()
+
+        assert remaining == [(2,)]
+        assert Cart.clear_cart('testuser') == 1
+        assert Cart.clear_cart('testuser') == 0
+
+    def test_merge_guest_cart(self, setup_cart_with_items):
+        """Test merging a guest cart into a user cart with stock clamping"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO cart (username, product_id, quantity) VALUES (?, ?, ?)",
+            [('guest-42', 1, 3), ('guest-42', 3, 1), ('discountuser', 2, 29)]
+        )
+        conn.commit()
+        conn.close()
+
+        results = Cart.merge_carts('guest-42', 'testuser')
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, quantity FROM cart WHERE username = 'testuser' ORDER BY product_id")
+        cart = cursor.fetchall()
+        cursor.execute("SELECT COUNT(*) FROM cart WHERE username = 'guest-42'")
+        guest_lines = cursor.fetchone()[0]
+        conn.close()
+
+        assert results == [(1, 5, 5), (3, 1, 1)]
+        assert cart == [(1, 5), (2, 1), (3, 1)]
+        assert guest_lines == 0
+
+    def test_merge_cart_into_itself(self, setup_cart_with_items):
+        """Test that merging a cart into itself keeps every line"""
+        assert Cart.merge_carts('testuser', 'testuser') == []
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, quantity FROM cart WHERE username = 'testuser' ORDER BY product_id")
+        cart = cursor.fetchall()
+        conn.close()
+
+        assert cart == [(1, 2), (2, 1)]
+
+# Test reorder and saved baskets
+class TestReorder:
+    def test_reorder_clamps_to_availability(self, setup_order_history):
+        """Test copying a past order into the cart with stock clamping"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO cart (username, product_id, quantity) VALUES ('retailuser', 2, 30)")
+        cursor.execute("INSERT INTO cart (username, product_id, quantity) VALUES ('testuser', 1, 1)")
+        conn.commit()
+        conn.close()
+
+        results = Cart.reorder('testuser', 1)
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, quantity FROM cart WHERE username = 'testuser' ORDER BY product_id")
+        cart = cursor.fetchall()
+        conn.close()
+
+        assert results == [(1, 'Test Product 1', 2, 2), (2, 'Test Product 2', 1, 0)]
+        assert cart == [(1, 3)]
+
+    def test_reorder_other_users_order(self, setup_order_history):
+        """Test that customers can only reorder their own orders"""
+        assert Cart.reorder('retailuser', 1) is None
+
+    def test_save_and_load_basket(self, setup_cart_with_items):
+        """Test saving the cart as a basket and loading it back"""
+        assert Cart.save_basket('testuser', 'weekly') == 2
+        Cart.clear_cart('testuser')
+        assert Cart.list_baskets('testuser')[0][0] == 'weekly'
+
+        with patch('builtins.input', side_effect=['2', 'weekly']):
+            with patch('sys.stdout', new=StringIO()) as fake_output:
+                Cart.manage_saved_baskets('testuser')
+                output = fake_output.getvalue()
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, quantity FROM cart WHERE username = 'testuser' ORDER BY product_id")
+        cart = cursor.fetchall()
+        conn.close()
+
+        assert 'Test Product 1: added 2.' in output
+        assert cart == [(1, 2), (2, 1)]
+
+# Test reporting snapshot mode
+@pytest.fixture
+def setup_reporting_snapshot(setup_test_data, tmp_path):
+    """Reporting snapshot in a temp dir; only the live database is redirected"""
+    redirect_connect(only_main=True)
+    snapshot = ReportingSnapshot(str(tmp_path / 'report.db'), max_age=3600)
+    snapshot.enabled = True
+    with patch('dollmart.REPORTING_SNAPSHOT', snapshot):
+        yield snapshot
+    snapshot.stop()
+
+
+class TestReportingSnapshot:
+    def test_reports_read_snapshot_until_refresh(self, setup_reporting_snapshot):
+        """Test that reports see the snapshot, not later live writes"""
+        snapshot = setup_reporting_snapshot
+        assert snapshot.age() is None
+        snapshot.refresh()
+        assert snapshot.age() < 60
+
+        conn = sqlite3.connect('test_dollmart.db')
+        conn.execute("INSERT INTO products (name, price, category_id, quantity) VALUES ('Late Product', 5.0, 1, 3)")
+        conn.commit()
+        conn.close()
+
+        with patch('sys.stdout', new=StringIO()) as fake_output:
+            Product.view_all_products()
+            stale = fake_output.getvalue()
+        snapshot.refresh()
+        with patch('sys.stdout', new=StringIO()) as fake_output:
+            Product.view_all_products()
+            fresh = fake_output.getvalue()
+
+        assert 'Reporting snapshot' in stale
+        assert 'Late Product' not in stale
+        assert 'Late Product' in fresh
+
+    def test_stale_snapshot_refreshed_on_read(self, setup_reporting_snapshot, setup_order_history):
+        """Test lazy refresh once the snapshot is older than max_age"""
+        snapshot = setup_reporting_snapshot
+        snapshot.max_age = 0
+        snapshot.refresh()
+        os.utime(snapshot.path, (0, 0))
+
+        with patch('builtins.input', side_effect=['n']):
+            with patch('sys.stdout', new=StringIO()) as fake_output:
+                Order.view_all_orders()
+                output = fake_output.getvalue()
+
+        assert 'testuser' in output
+        assert snapshot.age() < 60
+
+    def test_background_refresh(self, setup_reporting_snapshot):
+        """Test that the scheduled refresh thread writes the snapshot"""
+        snapshot = setup_reporting_snapshot
+        snapshot.start(interval=0.01)
+        for _ in range(200):
+            if snapshot.age() is not None:
+                break
+            time.sleep(0.01)
+        snapshot.stop()
+
+        assert snapshot.age() is not None
+
+    @pytest.mark.skipif(TEST_STORAGE == 'memory', reason="journal modes apply to database files")
+    def test_open_read_does_not_block_writers(self, setup_reporting_snapshot):
+        """Test that a long read of the live database, like a refresh, lets checkout writes commit"""
+        reader = sqlite3.connect('test_dollmart.db')
+        reader.execute("BEGIN")
+        reader.execute("SELECT COUNT(*) FROM products").fetchone()
+        writer = sqlite3.connect('test_dollmart.db', timeout=0)
+        writer.execute("UPDATE products SET quantity = quantity - 1 WHERE id = 1")
+        writer.commit()
+        mode = writer.execute("PRAGMA journal_mode").fetchone()[0]
+        writer.close()
+        reader.rollback()
+        reader.close()
+
+        assert mode == 'wal'
+
+# Test online backup and restore
+@pytest.fixture
+def setup_backup_dir(setup_test_data, tmp_path):
+    """Backup directory in a temp dir; only the live database is redirected"""
+    redirect_connect(only_main=True)
+    return str(tmp_path / 'backups')
+
+
+class TestDatabaseBackup:
+    def test_backup_is_verified_copy(self, setup_backup_dir):
+        """Test a paged backup with progress reporting"""
+        steps = []
+        stats = DatabaseBackup.backup(setup_backup_dir, pages=1, sleep=0,
+                                      progress=lambda status, remaining, total: steps.append(remaining))
+
+        conn = sqlite3.connect(stats['path'])
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM products ORDER BY id")
+        names = [row[0] for row in cursor.fetchall()]
+        conn.close()
+
+        assert names == ['Test Product 1', 'Test Product 2', 'Low Stock Product']
+        assert len(steps) > 1 and steps[-1] == 0
+        assert DatabaseBackup.verify(stats['path']) == []
+        assert [path for _, path in DatabaseBackup.list_backups(setup_backup_dir)] == [stats['path']]
+
+    def test_backup_pauses_between_steps(self, setup_backup_dir):
+        """Test that the copy sleeps after every step except the last"""
+        steps = []
+        with patch('dollmart.time.sleep') as sleep:
+            DatabaseBackup.backup(setup_backup_dir, pages=1, sleep=0.05,
+                                  progress=lambda status, remaining, total: steps.append(remaining))
+
+        assert len(steps) > 1
+        assert sleep.call_count == len(steps) - 1
+        sleep.assert_called_with(0.05)
+
+    def test_backup_completes_under_concurrent_writes(self, setup_backup_dir):
+        """Test that a copy restarted by other writers falls back to a single step"""
+        writer = sqlite3.connect('test_dollmart.db')
+
+        def write(status, remaining, total):
+            writer.execute("UPDATE users SET visit_count = visit_count + 1 WHERE username = 'testuser'")
+            writer.commit()
+
+        stats = DatabaseBackup.backup(setup_backup_dir, pages=1, sleep=0, progress=write, max_restarts=2)
+        writer.close()
+
+        assert stats['restarts'] == 3
+        assert DatabaseBackup.verify(stats['path']) == []
+
+    def test_verify_detects_corruption(self, setup_backup_dir, tmp_path):
+        """Test that a damaged file fails the integrity check"""
+        bad_path = str(tmp_path / 'bad.db')
+        with open(bad_path, 'wb') as f:
+            f.write(b'not a database' * 100)
+        assert DatabaseBackup.verify(bad_path) != []
+
+    def test_point_in_time_restore(self, setup_backup_dir):
+        """Test restoring the latest backup taken before a given time"""
+        with freeze_time("2024-01-01 10:00:00"):
+            DatabaseBackup.backup(setup_backup_dir)
+        conn = sqlite3.connect('test_dollmart.db')
+        conn.execute("DELETE FROM products WHERE id = 2")
+        conn.commit()
+        conn.close()
+        with freeze_time("2024-01-02 10:00:00"):
+            DatabaseBackup.backup(setup_backup_dir)
+
+        assert DatabaseBackup.restore(at=datetime(2023, 12, 31), backup_dir=setup_backup_dir) is None
+        restored = DatabaseBackup.restore(at=datetime(2024, 1, 1, 12), backup_dir=setup_backup_dir)
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM products")
+        count = cursor.fetchone()[0]
+        conn.close()
+
+        assert restored.endswith('dollmart-20240101-100000-000000.db')
+        assert count == 3
+
+# Test startup fast path
+class TestStartup:
+    def test_current_schema_skips_ddl(self, setup_test_db):
+        """Test that a database at SCHEMA_VERSION is not touched on startup"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        cursor.execute("DROP TABLE saved_basket_items")
+        conn.commit()
+        conn.close()
+
+        create_database()
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'saved_basket_items'")
+        fast_path_count = cursor.fetchone()[0]
+        cursor.execute("PRAGMA user_version = 0")
+        conn.commit()
+        conn.close()
+
+        create_database()
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'saved_basket_items'")
+        full_path_count = cursor.fetchone()[0]
+        conn.close()
+
+        assert version == SCHEMA_VERSION
+        assert fast_path_count == 0
+        assert full_path_count == 1
+
+    def test_fast_path_prunes_change_log(self, setup_test_db):
+        """Test that the change log is still trimmed when DDL is skipped"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.executemany("INSERT INTO product_changes (product_id, op, changed_at) VALUES (1, 'stock', 'now')",
+                           [()] * (CHANGE_LOG_RETENTION + 5))
+        conn.commit()
+        conn.close()
+
+        create_database()
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM product_changes")
+        count = cursor.fetchone()[0]
+        conn.close()
+
+        assert count == CHANGE_LOG_RETENTION
+
+# Test non-interactive command line
+def run_main(argv, stdin=''):
+    """Run main() with arguments, returning (exit code, parsed JSON lines)"""
+    with patch('sys.stdin', new=StringIO(stdin)):
+        with patch('sys.stdout', new=StringIO()) as fake_output:
+            code = main(argv)
+            output = fake_output.getvalue()
+    return code, [json.loads(line) for line in output.splitlines()]
+
+
+class TestCommandLine:
+    def test_products_list_json(self, setup_cart_with_items):
+        """Test listing products as JSON lines with available quantities"""
+        code, records = run_main(['products', 'list', '--json', '--category', 'electronics'])
+
+        assert code == 0
+        assert [(r['name'], r['quantity'], r['available']) for r in records] == [
+            ('Test Product 1', 50, 48), ('Low Stock Product', 1, 1)]
+
+    def test_cart_and_order_place(self, setup_test_data):
+        """Test building a cart and placing an order without prompts"""
+        code, records = run_main(['cart', 'set', '--user', 'testuser', '1=2', '2=99', '--json'])
+        assert code == 1
+        assert [(r['product_id'], r['applied']) for r in records] == [(1, True), (2, False)]
+
+        code, records = run_main(['order', 'place', '--user', 'testuser', '--key', 'job-1', '--json'])
+        assert code == 0
+        assert records[0]['status'] == 'placed' and records[0]['replayed'] is False
+
+        code, records = run_main(['order', 'place', '--user', 'testuser', '--key', 'job-1', '--json'])
+        assert records[0]['replayed'] is True
+
+        code, records = run_main(['order', 'place', '--user', 'testuser', '--json'])
+        assert code == 1
+        assert records == [{'error': 'Cart is empty.'}]
+
+    def test_unknown_user_and_rejected_changes(self, setup_order_history):
+        """Test that unknown users are refused and partly applied commands exit non-zero"""
+        code, records = run_main(['cart', 'set', '--user', 'ghost', '1=1', '--json'])
+        assert code == 1
+        assert records == [{'error': 'User ghost does not exist.'}]
+
+        code, records = run_main(['order', 'place', '--user', 'ghost', '--json'])
+        assert code == 1
+        assert records == [{'error': 'User ghost does not exist.'}]
+
+        code, records = run_main(['cart', 'clear', '--user', 'ghost', '--json'])
+        assert code == 1
+        assert records == [{'error': 'User ghost does not exist.'}]
+
+        code, records = run_main(['order', 'job', '999', '--json'])
+        assert code == 1
+        assert records[0]['error'] == 'Job does not exist.'
+
+        with pytest.raises(ValueError, match='Unknown user: ghost'):
+            Cart.submit_order('ghost')
+
+        code, records = run_main(['order', 'status', '1', '2', '--to', 'cancelled', '--json'])
+        assert code == 1
+        assert [(r['order_id'], r['changed']) for r in records] == [(1, True), (2, False)]
+
+        code, records = run_main(['batch'], stdin="order place --user ghost\norder list --user testuser\n")
+        assert code == 1
+        assert records[0] == {'line': 1, 'error': 'User ghost does not exist.'}
+        assert [r['order_id'] for r in records[1:]] == [1, 2]
+
+    def test_import_catalog(self, setup_test_data, tmp_path):
+        """Test importing products from a CSV file"""
+        catalog = tmp_path / 'catalog.csv'
+        catalog.write_text("name,price,category,quantity\nLamp,20,Home,3\nBroken,free,Home,1\n")
+
+        code, records = run_main(['import', str(catalog), '--json'])
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT p.price, c.name FROM products p JOIN categories c ON c.id = p.category_id "
+                       "WHERE p.name = 'Lamp'")
+        lamp = cursor.fetchone()
+        conn.close()
+
+        assert code == 0
+        assert records[0]['imported'] == 1
+        assert records[0]['errors'][0]['row'] == 2
+        assert lamp == (20.0, 'Home')
+
+    def test_batch_mode(self, setup_test_data):
+        """Test running several commands from stdin as JSON lines"""
+        commands = "cart set --user testuser 1=1\n" \
+                   '["order", "place", "--user", "testuser"]\n' \
+                   "not-a-command\n" \
+                   '["products", 1]\n' \
+                   "order list --user testuser\n"
+
+        code, records = run_main(['batch'], stdin=commands)
+
+        assert code == 1
+        assert [r['line'] for r in records] == [1, 2, 3, 4, 5]
+        assert 'error' in records[2] and 'error' in records[3]
+        assert records[4]['status'] == 'placed'
+
+# Test buffered table rendering
+class TestTableWriter:
+    def test_aligned_columns_and_truncation(self):
+        """Test column alignment, number formats and truncation of long cells"""
+        out = StringIO()
+        writer = TableWriter([('ID', '{}', '>'), ('Name', '{}'), ('Price', '${:.2f}', '>')], out, max_width=10)
+        writer.write_rows([(1, 'Doll', 5.0), (12, 'A very long product name', 120.5)])
+        writer.finish()
+
+        assert out.getvalue().splitlines() == [
+            'ID | Name       |   Price',
+            '-------------------------',
+            ' 1 | Doll       |   $5.00',
+            '12 | A very ... | $120.50',
+            '-------------------------',
+        ]
+
+    def test_rows_written_in_batches(self):
+        """Test that rows are written with one write() per batch"""
+        out = StringIO()
+        writes = []
+        out.write = lambda text, write=out.write: writes.append(text) or write(text)
+        writer = TableWriter([('N', '{}')], out, batch_rows=100)
+        writer.write_rows((i,) for i in range(250))
+        writer.finish()
+
+        assert len(writes) == 4
+        assert writer.rows_written == 250
+        assert len(out.getvalue().splitlines()) == 253
+
+    def test_tall_listing_uses_pager_on_terminal(self):
+        """Test that listings taller than the terminal go through the pager"""
+        fake_stdout = StringIO()
+        fake_stdout.isatty = lambda: True
+        with patch('sys.stdout', new=fake_stdout), \
+                patch('shutil.get_terminal_size', return_value=os.terminal_size((80, 24))), \
+                patch('pydoc.pager') as pager:
+            TableWriter.render([('N', '{}')], [(i,) for i in range(10)])
+            TableWriter.render([('N', '{}')], [(i,) for i in range(100)])
+
+        assert pager.call_count == 1
+        assert '99' in pager.call_args[0][0]
+        assert fake_stdout.getvalue().count('\n') == 13
+
+# Test queued checkout
+class TestCheckoutQueue:
+    def test_batch_places_orders_in_one_transaction(self, setup_cart_with_items):
+        """Test that queued jobs become orders in one batch and that an empty cart is not queued"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO cart (username, product_id, quantity) VALUES ('retailuser', 1, 3)")
+        conn.commit()
+        conn.close()
+        first = CheckoutQueue.submit('testuser')
+        empty = CheckoutQueue.submit('discountuser')
+        second = CheckoutQueue.submit('retailuser')
+        assert CheckoutQueue.status(first)['status'] == 'queued'
+
+        assert empty is None
+        assert CheckoutQueue.process_batch() == 2
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT quantity FROM products WHERE id = 1")
+        stock = cursor.fetchone()[0]
+        conn.close()
+
+        assert CheckoutQueue.status(first)['status'] == 'done'
+        assert CheckoutQueue.status(second)['order_id'] == CheckoutQueue.status(first)['order_id'] + 1
+        assert stock == 45
+
+    def test_resubmitted_key_is_not_placed_twice(self, setup_cart_with_items):
+        """Test that a job retried with the same key returns the original job and order"""
+        first = CheckoutQueue.submit('testuser', 'retry-key')
+        second = CheckoutQueue.submit('testuser', 'retry-key')
+
+        assert second == first
+        assert CheckoutQueue.run_worker(batch_size=1, exit_when_idle=True) == 1
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM orders")
+        orders = cursor.fetchone()[0]
+        conn.close()
+
+        assert orders == 1
+        assert CheckoutQueue.status(first)['order_id'] == CheckoutQueue.status(second)['order_id']
+        assert CheckoutQueue.status(second)['status'] == 'done'
+
+    def test_jobs_place_the_lines_they_were_submitted_with(self, setup_cart_with_items):
+        """Test that each job keeps its own cart lines and the cart is free for the next order"""
+        first = CheckoutQueue.submit('testuser')
+        Cart.add_item('testuser', 2, 3)
+        second = CheckoutQueue.submit('testuser')
+        Cart.add_item('testuser', 3, 1)
+
+        assert CheckoutQueue.process_batch() == 2
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT order_id, product_id, quantity FROM order_items ORDER BY order_id, product_id")
+        items = cursor.fetchall()
+        cursor.execute("SELECT product_id, quantity FROM cart WHERE username = 'testuser'")
+        cart = cursor.fetchall()
+        conn.close()
+
+        first_order, second_order = CheckoutQueue.status(first)['order_id'], CheckoutQueue.status(second)['order_id']
+        assert items == [(first_order, 1, 2), (first_order, 2, 1), (second_order, 2, 3)]
+        assert cart == [(3, 1)]
+
+    def test_job_fails_when_stock_ran_out(self, setup_test_data):
+        """Test that a job's lines are checked against stock when the worker places them"""
+        Cart.add_item('testuser', 3, 1)
+        job_id = CheckoutQueue.submit('testuser')
+        conn = sqlite3.connect('test_dollmart.db')
+        conn.execute("UPDATE products SET quantity = 0 WHERE id = 3")
+        conn.commit()
+        conn.close()
+
+        CheckoutQueue.process_batch()
+
+        job = CheckoutQueue.status(job_id)
+        assert job['status'] == 'failed'
+        assert job['error'] == 'Not enough stock for product 3. Available: 0'
+        assert Cart.clear_cart('testuser') == 1
+
+    def test_key_of_another_customer_fails_and_returns_lines(self, setup_cart_with_items):
+        """Test that a job whose key placed someone else's order fails and gives its lines back"""
+        Cart.add_item('retailuser', 2, 2)
+        order = Cart.submit_order('retailuser', 'shared-key')
+        job_id = CheckoutQueue.submit('testuser', 'shared-key')
+
+        CheckoutQueue.process_batch()
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, quantity FROM cart WHERE username = 'testuser' ORDER BY product_id")
+        cart = cursor.fetchall()
+        cursor.execute("SELECT COUNT(*) FROM checkout_job_items")
+        held_lines = cursor.fetchone()[0]
+        conn.close()
+
+        job = CheckoutQueue.status(job_id)
+        assert (job['status'], job['order_id']) == ('failed', None)
+        assert job['error'] == 'This request key was already used by another customer.'
+        assert order['username'] == 'retailuser'
+        assert cart == [(1, 2), (2, 1)]
+        assert held_lines == 0
+
+    def test_queued_lines_stay_reserved(self, setup_test_data):
+        """Test that stock in a queued job cannot be put in another cart"""
+        Cart.add_item('testuser', 3, 1)
+        job_id = CheckoutQueue.submit('testuser')
+
+        assert Cart.update_product_availability()[3] == 0
+        assert Cart.set_quantities('retailuser', {3: 1}) == [(3, 1, False, "Not enough stock. Available: 0")]
+        assert Cart.set_quantities('testuser', {3: 1})[0][2] is False
+
+        CheckoutQueue.process_batch()
+        assert CheckoutQueue.status(job_id)['status'] == 'done'
+
+    def test_upgrade_moves_carts_into_queued_jobs(self, setup_cart_with_items):
+        """Test that jobs queued before job lines existed take their user's cart on upgrade"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO checkout_jobs (username, idempotency_key, submitted_at) "
+                       "VALUES ('testuser', 'old-job', '2026-03-01 09:00:00')")
+        cursor.execute("DROP TABLE checkout_job_items")
+        cursor.execute("PRAGMA user_version = 0")
+        conn.commit()
+        conn.close()
+        create_database()
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, quantity FROM checkout_job_items ORDER BY product_id")
+        items = cursor.fetchall()
+        cursor.execute("SELECT COUNT(*) FROM cart WHERE username = 'testuser'")
+        cart_count = cursor.fetchone()[0]
+        conn.close()
+
+        assert items == [(1, 2), (2, 1)]
+        assert cart_count == 0
+
+    def test_submit_from_command_line(self, setup_cart_with_items):
+        """Test submitting a checkout and reading its job status as JSON"""
+        code, records = run_main(['order', 'submit', '--user', 'testuser', '--json'])
+        job_id = records[0]['job_id']
+        CheckoutQueue.process_batch()
+        code, records = run_main(['order', 'job', str(job_id), '--json'])
+
+        assert code == 0
+        assert records[0]['status'] == 'done'
+        assert records[0]['order_id'] == 1
+
+        code, records = run_main(['order', 'submit', '--user', 'testuser', '--json'])
+        assert code == 1
+        assert records == [{'error': 'Cart is empty.'}]
+
+# Test group-committed cart writes
+@pytest.fixture
+def cart_write_buffer(setup_test_data):
+    """Cart writes go through a buffer with a wide window so concurrent writes share commits"""
+    buffer = Cart.enable_write_buffer(window_ms=50)
+    yield buffer
+    Cart.disable_write_buffer()
+
+
+class TestCartWriteBuffer:
+    def test_concurrent_writes_share_commits(self, cart_write_buffer):
+        """Test group commit across sessions with read-your-writes"""
+        import threading
+        seen = {}
+
+        def session(product_id):
+            Cart.add_item('testuser', product_id, 1)
+            conn = sqlite3.connect('test_dollmart.db')
+            cursor = conn.cursor()
+            cursor.execute("SELECT quantity FROM cart WHERE username = 'testuser' AND product_id = ?", (product_id,))
+            seen[product_id] = cursor.fetchone()
+            conn.close()
+
+        threads = [threading.Thread(target=session, args=(product_id,)) for product_id in (1, 2, 3) * 3]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = Cart.disable_write_buffer()
+
+        assert all(row is not None for row in seen.values())
+        assert stats['writes'] == 9
+        assert stats['commits'] < 9
+        assert stats['fsyncs_saved'] == 9 - stats['commits']
+
+    def test_failed_write_does_not_affect_others(self, cart_write_buffer):
+        """Test that one bad write is rolled back alone and reported to its session"""
+        with pytest.raises(sqlite3.Error):
+            cart_write_buffer.submit([("INSERT INTO cart (username, product_id, quantity) VALUES (?, ?, ?)",
+                                       ('testuser', 1, 1)),
+                                      ("INSERT INTO no_such_table VALUES (1)", ())])
+        Cart.add_item('testuser', 2, 2)
+        Cart.remove_item('testuser', 2, 1)
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, quantity FROM cart WHERE username = 'testuser'")
+        cart = cursor.fetchall()
+        conn.close()
+
+        assert cart == [(2, 1)]
+
+    @patch('builtins.input', side_effect=['1', '2'])
+    def test_interactive_add_uses_buffer(self, mock_input, cart_write_buffer):
+        """Test that add_to_cart commits through the buffer"""
+        with patch('sys.stdout', new=StringIO()) as fake_output:
+            Cart.add_to_cart('testuser')
+            output = fake_output.getvalue()
+
+        assert 'Item added to cart successfully!' in output
+        assert cart_write_buffer.stats()['writes'] == 1
+
+# Test storage backends
+class TestStorage:
+    def test_memory_storage_shared_between_connections(self):
+        """Test that connections to one memory store see each other's commits"""
+        storage = MemoryStorage()
+        conn = storage.connect()
+        conn.execute("CREATE TABLE items (name TEXT)")
+        conn.execute("INSERT INTO items VALUES ('doll')")
+        conn.commit()
+        conn.close()
+
+        other = storage.connect()
+        rows = other.execute("SELECT name FROM items").fetchall()
+        other.close()
+        storage.close()
+
+        assert rows == [('doll',)]
+
+    def test_memory_stores_are_isolated(self):
+        """Test that two memory stores do not share tables"""
+        first, second = MemoryStorage(), MemoryStorage()
+        conn = first.connect()
+        conn.execute("CREATE TABLE items (name TEXT)")
+        conn.close()
+
+        conn = second.connect()
+        tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        conn.close()
+        first.close()
+        second.close()
+
+        assert tables == []
+
+    def test_store_runs_in_memory(self, tmp_path, monkeypatch):
+        """Test the app end to end on the memory backend without touching disk"""
+        monkeypatch.chdir(tmp_path)
+        storage = MemoryStorage()
+        with patch('dollmart.STORAGE', storage):
+            create_database()
+            Product.import_catalog([{'name': 'Rag Doll', 'price': '12.50', 'category': 'Toys', 'quantity': '4'}])
+            conn = storage.connect()
+            cursor = conn.cursor()
+            cursor.execute("SELECT name, quantity FROM products")
+            products = cursor.fetchall()
+            conn.close()
+        storage.close()
+
+        assert products == [('Rag Doll', 4)]
+        assert os.listdir(tmp_path) == []
+
+# Test co-purchase recommendations
+class TestRecommendations:
+    def place(self, username, product_ids):
+        for product_id in product_ids:
+            Cart.add_item(username, product_id, 1)
+        return Cart.submit_order(username)
+
+    def test_checkout_counts_pairs(self, setup_test_data):
+        """Test that checkout records each ordered pair of products once"""
+        self.place('testuser', [1, 2])
+        self.place('retailuser', [1, 2])
+        self.place('discountuser', [1, 3])
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, other_id, orders FROM product_pairs ORDER BY product_id, other_id")
+        pairs = cursor.fetchall()
+        conn.close()
+
+        assert pairs == [(1, 2, 2), (1, 3, 1), (2, 1, 2), (3, 1, 1)]
+
+    def test_recommendations_rank_and_exclude(self, setup_test_data):
+        """Test ranking by co-purchase count, skipping cart items and out-of-stock products"""
+        self.place('testuser', [1, 2])
+        self.place('retailuser', [1, 2])
+        self.place('discountuser', [1, 3])
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        for_product = Product.recommendations(cursor, [1])
+        for_cart = Product.recommendations(cursor, [1, 2])
+        conn.close()
+
+        # Low Stock Product (3) sold its only unit
+        assert [(product.id, score) for product, score in for_product] == [(2, 2)]
+        assert for_cart == []
+
+    def test_backfill_counts_past_orders_once(self, setup_order_history):
+        """Test that orders from before the upgrade are counted by the backfill, in batches, once"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("DROP TABLE product_pairs")
+        cursor.execute("PRAGMA user_version = 0")
+        conn.commit()
+        conn.close()
+        create_database()
+
+        first = Product.backfill_co_purchases(batch_size=1)
+        second = Product.backfill_co_purchases(batch_size=1)
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, other_id, orders FROM product_pairs ORDER BY product_id")
+        pairs = cursor.fetchall()
+        conn.close()
+
+        assert first > 0 and second == 0
+        assert pairs == [(1, 2, 1), (2, 1, 1)]
+
+    def test_large_baskets_are_not_counted(self, setup_order_history):
+        """Test that orders over the basket cap add no pairs, at checkout or in the backfill"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("DROP TABLE product_pairs")
+        cursor.execute("PRAGMA user_version = 0")
+        conn.commit()
+        conn.close()
+        create_database()
+
+        with patch('dollmart.PAIRS_MAX_BASKET', 1):
+            Product.backfill_co_purchases()
+            self.place('retailuser', [1, 2])
+        self.place('discountuser', [1, 2])
+
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, other_id, orders FROM product_pairs ORDER BY product_id")
+        pairs = cursor.fetchall()
+        conn.close()
+
+        assert pairs == [(1, 2, 1), (2, 1, 1)]
+
+    @patch('builtins.input', side_effect=['2'])
+    def test_views_show_also_bought(self, mock_input, setup_test_data):
+        """Test the product view and the cart view recommendations"""
+        self.place('retailuser', [1, 2])
+        Cart.add_item('testuser', 1, 1)
+
+        with patch('sys.stdout', new=StringIO()) as fake_output:
+            Product.view_product()
+            Cart.view_cart('testuser')
+            output = fake_output.getvalue()
+
+        assert "Customers who bought this also bought:\n  1 | Test Product 1" in output
+        assert "Customers also bought:\n  2 | Test Product 2" in output
+
+# Test the restock report
+class TestRestockReport:
+    def place(self, username, product_id, quantity, when):
+        with freeze_time(when):
+            Cart.add_item(username, product_id, quantity)
+            return Cart.submit_order(username)
+
+    def daily_sales(self):
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, day, quantity FROM daily_sales ORDER BY day, product_id")
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+
+    def test_checkout_and_cancel_update_daily_sales(self, setup_test_data):
+        """Test that sales are added at checkout and taken back on cancellation"""
+        self.place('testuser', 1, 6, "2026-01-01 10:00:00")
+        order = self.place('retailuser', 1, 7, "2026-01-20 10:00:00")
+        assert self.daily_sales() == [(1, '2026-01-01', 6), (1, '2026-01-20', 7)]
+
+        Order.transition_orders([order['order_id']], 'cancelled')
+
+        assert self.daily_sales() == [(1, '2026-01-01', 6), (1, '2026-01-20', 0)]
+
+    def test_velocity_windows_and_days_left(self, setup_test_data):
+        """Test per-window velocity and days left from stock minus cart reservations"""
+        self.place('testuser', 1, 6, "2026-01-01 10:00:00")
+        self.place('retailuser', 1, 7, "2026-01-20 10:00:00")
+        Cart.add_item('discountuser', 1, 30)
+
+        report = Product.restock_report(today=datetime(2026, 1, 20).date())
+        rows = {row['id']: row for row in report}
+
+        assert report[0]['id'] == 1
+        assert rows[1]['available'] == 7
+        assert rows[1]['velocity'] == {7: 1.0, 30: pytest.approx(13 / 30)}
+        assert rows[1]['days_left'] == pytest.approx(7.0)
+        assert rows[1]['flagged']
+        assert rows[2]['days_left'] is None and not rows[2]['flagged']
+
+    def test_upgrade_rebuilds_from_history(self, setup_order_history):
+        """Test that an upgraded store gets daily_sales built from past orders, skipping cancelled ones"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("UPDATE orders SET status = 'cancelled' WHERE id = 2")
+        cursor.execute("DROP TABLE daily_sales")
+        cursor.execute("PRAGMA user_version = 0")
+        conn.commit()
+        conn.close()
+        create_database()
+
+        today = datetime.now().strftime("%Y-%m-%d")
+        assert self.daily_sales() == [(1, today, 2), (2, today, 1)]
+
+    def test_command_line_flagged_only(self, setup_test_data):
+        """Test products restock --flagged"""
+        self.place('testuser', 3, 1, datetime.now())
+
+        code, records = run_main(['products', 'restock', '--flagged', '--json'])
+
+        assert code == 0
+        assert [(record['id'], record['available'], record['flagged']) for record in records] == [(3, 0, True)]
+        assert records[0]['units_per_day_7d'] == pytest.approx(1 / 7)
+
+# Test per-customer aggregates and loyalty tiers
+class TestCustomerStats:
+    def stats(self, username):
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT order_count, item_count, lifetime_spend, last_order_date FROM customer_stats "
+                       "WHERE username = ?", (username,))
+        row = cursor.fetchone()
+        conn.close()
+        return row
+
+    def test_checkout_updates_stats(self, setup_cart_with_items):
+        """Test that each checkout adds to the customer's aggregates"""
+        with freeze_time("2026-03-01 09:00:00"):
+            first = Cart.submit_order('testuser')
+        Cart.add_item('testuser', 2, 4)
+        with freeze_time("2026-03-05 09:00:00"):
+            second = Cart.submit_order('testuser')
+
+        order_count, item_count, spend, last_order_date = self.stats('testuser')
+        assert (order_count, item_count, last_order_date) == (2, 7, "2026-03-05 09:00:00")
+        assert spend == pytest.approx(first['total'] + second['total'])
+
+    def test_cancel_and_return_leave_stats(self, setup_cart_with_items):
+        """Test that cancelled and returned orders stop counting towards the customer's aggregates"""
+        with freeze_time("2026-03-01 09:00:00"):
+            first = Cart.submit_order('testuser')
+        Cart.add_item('testuser', 1, 40)
+        with freeze_time("2026-03-05 09:00:00"):
+            second = Cart.submit_order('testuser')
+        Cart.add_item('testuser', 2, 1)
+        with freeze_time("2026-03-06 09:00:00"):
+            third = Cart.submit_order('testuser')
+
+        changed, _ = Order.transition_orders([second['order_id']], 'cancelled')
+        assert changed == [second['order_id']]
+        order_count, item_count, spend, last_order_date = self.stats('testuser')
+        assert (order_count, item_count, last_order_date) == (2, 4, "2026-03-06 09:00:00")
+        assert spend == pytest.approx(first['total'] + third['total'])
+
+        Order.transition_orders([third['order_id']], 'delivered')
+        Order.transition_orders([third['order_id']], 'returned')
+        order_count, item_count, spend, last_order_date = self.stats('testuser')
+        assert (order_count, item_count, last_order_date) == (1, 3, "2026-03-01 09:00:00")
+        assert spend == pytest.approx(first['total'])
+
+        conn = sqlite3.connect('test_dollmart.db')
+        Order.rebuild_customer_stats(conn.cursor())
+        conn.commit()
+        conn.close()
+        assert self.stats('testuser')[:3] == (order_count, item_count, pytest.approx(spend))
+
+    def test_upgrade_rebuilds_from_history(self, setup_order_history):
+        """Test that an upgraded store gets customer_stats from live and archived orders"""
+        conn = sqlite3.connect('test_dollmart.db')
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO orders_archive (id, username, total_amount, order_date, otp, status, archived_at) "
+                       "VALUES (10, 'testuser', 100.0, '2020-01-01 00:00:00', '000000', 'delivered', '2021-01-01')")
+        cursor.execute("INSERT INTO order_items_archive (order_id, product_id, quantity, price) VALUES (10, 1, 5, 20.0)")
+        cursor.execute("DROP TABLE customer_stats")
+        cursor.execute("PRAGMA user_version = 0")
+        conn.commit()
+        conn.close()
+        create_database()
+
+        order_count, item_count, spend, _ = self.stats('testuser')
+        assert (order_count, item_count) == (3, 9)
+        assert spend == pytest.approx(27.97 + 15.99 + 100.0)
+        assert self.stats('retailuser') is None
+
+    def test_loyalty_tiers(self, setup_test_data):
+        """Test tier thresholds and the customer's account summary"""
+        gold, silver, bronze = LOYALTY_TIERS
+        assert loyalty_tier(0, 0) is None
+        assert loyalty_tier(bronze[1], 0) == 'Bronze'
+        assert loyalty_tier(0, silver[2]) == 'Silver'
+        assert loyalty_tier(gold[1], 0) == 'Gold'
+
+        conn = sqlite3.connect('test_dollmart.db')
+        conn.execute("INSERT INTO customer_stats VALUES ('testuser', 4, 8, 300.0, '2026-03-01 09:00:00')")
+        conn.commit()
+        conn.close()
+        with patch('sys.stdout', new=StringIO()) as fake_output:
+            Order.view_customer_summary('testuser')
+            output = fake_output.getvalue()
+
+        assert 'Average Basket: $75.00' in output
+        assert 'Loyalty Tier: Bronze' in output
+        assert 'Next tier: Silver' in output
+
+    def test_view_all_customers_reads_stats(self, setup_test_data):
+        """Test that the customer listing shows stored aggregates without orders to scan"""
+        conn = sqlite3.connect('test_dollmart.db')
+        conn.execute("INSERT INTO customer_stats VALUES ('retailuser', 12, 30, 1200.0, '2026-03-01 09:00:00')")
+        conn.commit()
+        conn.close()
+
+        with patch('sys.stdout', new=StringIO()) as fake_output:
+            Order.view_all_customers()
+            output = fake_output.getvalue()
+
+        lines = [line for line in output.splitlines() if line.startswith('retailuser')]
+        assert 'Silver' in lines[0] and '$1200.00' in lines[0] and '$100.00' in lines[0]
+        assert output.index('retailuser') < output.index('testuser')
+
+# Test login and OTP rate limiting
+class TestRateLimiter:
+    def test_bucket_locks_out_and_recovers(self, setup_test_db):
+        """Test that an empty bucket locks the key out until the lockout ends"""
+        limiter = RateLimiter('test', 3, 1 / 60, lockout_seconds=600)
+        with freeze_time("2026-05-01 12:00:00") as clock:
+            assert [limiter.acquire('alice') for _ in range(4)] == [True, True, True, False]
+            assert limiter.acquire('bob')
+            clock.tick(599)
+            assert not limiter.acquire('alice')
+            clock.tick(2)
+            assert limiter.acquire('alice')
+
+        assert limiter.stats()['lockouts'] == 1
+        assert limiter.stats()['rejected'] == 2
+
+    def test_refill_allows_spaced_attempts(self, setup_test_db):
+        """Test that attempts slower than the refill rate are never locked out"""
+        limiter = RateLimiter('test', 2, 1.0)
+        with freeze_time("2026-05-01 12:00:00") as clock:
+            for _ in range(10):
+                assert limiter.acquire('alice')
+                clock.tick(1)
+
+        assert limiter.stats()['lockouts'] == 0
+
+    def test_least_recent_buckets_dropped_beyond_max_keys(self, setup_test_db):
+        """Test that tracking stays bounded by dropping the least recently attempted keys"""
+        limiter = RateLimiter('test', 3, 0, max_keys=2)
+        with freeze_time("2026-05-01 12:00:00"):
+            assert limiter.acquire('alice') and limiter.acquire('bob')
+            assert limiter.acquire('alice')
+            assert limiter.acquire('carol')
+            assert limiter.stats()['tracked_keys'] == 2
+
+            # alice kept her spent tokens; bob was dropped and starts over with a full bucket
+            assert [limiter.acquire('alice') for _ in range(2)] == [True, False]
+            assert [limiter.acquire('bob') for _ in range(4)] == [True, True, True, False]
+
+    def test_lockout_survives_restart(self, setup_test_db):
+        """Test that a lockout is persisted, and cleared again by reset()"""
+        limiter = RateLimiter('test', 1, 0)
+        limiter.acquire(42)
+
+        restarted = RateLimiter('test', 1, 0)
+        assert not restarted.acquire(42)
+
+        restarted.reset(42)
+        assert RateLimiter('test', 1, 0).acquire(42)
+
+    def test_rejected_login_skips_sql_and_hashing(self, setup_test_data):
+        """Test that a locked-out login never hashes the password or opens the database"""
+        with patch('builtins.input', side_effect=['testuser', 'wrong'] * 5), patch('sys.stdout', new=StringIO()):
+            for _ in range(5):
+                assert User.login() is None
+
+        with patch('builtins.input', side_effect=['testuser', 'test123']), \
+                patch('sys.stdout', new=StringIO()) as fake_output, \
+                patch('dollmart.User.hash_password') as hash_password, \
+                patch('dollmart.connect_db') as connect:
+            assert User.login() is None
+            output = fake_output.getvalue()
+
+        assert 'Too many login attempts' in output
+        hash_password.assert_not_called()
+        connect.assert_not_called()
+        assert rate_limit_metrics()['login']['rejected'] == 1
+
+    def test_otp_attempts_limited(self, setup_order_history):
+        """Test that wrong OTPs lock an order out of interactive and batch confirmation"""
+        with patch('builtins.input', side_effect=['1', '000000'] * 3 + ['1']), \
+                patch('sys.stdout', new=StringIO()) as fake_output:
+            for _ in range(4):
+                Order.confirm_order()
+            output = fake_output.getvalue()
+
+        results = Order.confirm_orders_batch([('1', '123456')])
+
+        assert output.count('Invalid OTP') == 3
+        assert 'Too many OTP attempts for this order' in output
+        assert results == [(1, 1, False, "Too many OTP attempts; try again later.")]
+        assert rate_limit_metrics()['otp']['rejected'] == 2